@@ -30,6 +30,8 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['email','username','date_of_birth', 'password','password2','bio','avatar','avatar_url']
+        # read by to_representation, see catalog.eager
+        select_related = ['profile']
 
     
     def validate(self, attrs):
@@ -4,11 +4,13 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from vexify.metrics import HandlerTimingMixin
+from vexify.profiling import ProfilingMixin
 from .models import User, PasswordResetOTP
 from accounts.serializers import UserSerializer, ReqeustOTPSerializer, VerifyOTPSerializer
 
 
-class RegisterAPIView(APIView):
+class RegisterAPIView(ProfilingMixin, HandlerTimingMixin, APIView):
     def post(self, request):
         serializer = UserSerializer(data=request.data,context={'request': request})
         if serializer.is_valid():
@@ -17,7 +19,7 @@ class RegisterAPIView(APIView):
         return Response({"message": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserDetailView(APIView):
+class UserDetailView(ProfilingMixin, HandlerTimingMixin, APIView):
     permission = [IsAuthenticated]
 
     def get(self, request):
@@ -33,7 +35,7 @@ class UserDetailView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SendOTPView(APIView):
+class SendOTPView(ProfilingMixin, HandlerTimingMixin, APIView):
     def post(self,request):
         serializer = ReqeustOTPSerializer(data=request.data)
         if serializer.is_valid():
@@ -62,7 +64,7 @@ class SendOTPView(APIView):
         return Response({'message': f'OTP send to email {email}'})
 
 
-class VerifyOTPView(APIView):
+class VerifyOTPView(ProfilingMixin, HandlerTimingMixin, APIView):
     def post(self,request):
         serializer = VerifyOTPSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Artist, Album, Playlist, Favorite, Song, Category
+from . import playlists
+from .models import Artist, Album, Playlist, PlaylistTrack, Favorite, FavoriteItem, Song, Category, AudioMetadataJob
 
 # Inline to show songs in an album
 class SongInline(admin.TabularInline):
@@ -23,14 +24,50 @@ class ArtistAdmin(admin.ModelAdmin):
     search_fields = ['name']
     inlines = [AlbumInline]
 
+# Tracks in playlist order, new ones need a position (see catalog.playlists.GAP)
+class PlaylistTrackInline(admin.TabularInline):
+    model = PlaylistTrack
+    extra = 1
+    fields = ['song', 'position']
+    raw_id_fields = ['song']  # playlists can hold thousands of songs
+    ordering = ['position', 'id']
+
 class PlaylistAdmin(admin.ModelAdmin):
     list_display = ['name', 'user', 'created_at']
     search_fields = ['name', 'user__username']
-    filter_horizontal = ['songs']  # nicer multiple selection widget
+    inlines = [PlaylistTrackInline]
+
+    def save_formset(self, request, form, formset, change):
+        # the inline writes PlaylistTrack rows, no m2m_changed for the membership caches otherwise
+        playlist = formset.instance
+        before = set(playlist.tracks.values_list('song_id', flat=True))
+        super().save_formset(request, form, formset, change)
+        after = set(playlist.tracks.values_list('song_id', flat=True))
+        playlists.tracks_changed(playlist, added=after - before, removed=before - after)
 
 class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ['user']
-    filter_horizontal = ['songs', 'albums', 'playlists', 'artists']
+    list_display = ['user', 'version']
+
+# Read-only: changes go through catalog.favorites, which sends favorites_changed
+# for the counters, versions, caches and indexes built on these rows
+class FavoriteItemAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'item_id', 'created_at']
+    list_filter = ['kind']
+    raw_id_fields = ['user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class AudioMetadataJobAdmin(admin.ModelAdmin):
+    list_display = ['song', 'status', 'attempts', 'queued_at', 'finished_at']
+    list_filter = ['status']
+    raw_id_fields = ['song']
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name']
@@ -41,4 +78,6 @@ admin.site.register(Album, AlbumAdmin)
 admin.site.register(Song, )  # you can keep simple or add filters
 admin.site.register(Playlist, PlaylistAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(FavoriteItem, FavoriteItemAdmin)
 admin.site.register(Category, CategoryAdmin)
+admin.site.register(AudioMetadataJob, AudioMetadataJobAdmin)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from vexify import metrics
+        from .plays import collect_metrics
+        metrics.register_collector(collect_metrics)
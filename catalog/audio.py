@@ -0,0 +1,508 @@
+"""
+Audio metadata of uploaded songs, read in the background.
+
+Saving a song with a new ``audio_file`` queues an AudioMetadataJob, one
+row per song. Workers claim jobs in batches by stamping them with a token
+in one conditional UPDATE, so any number of worker threads and processes
+share the table without getting the same job. Jobs a dead worker left
+running for STALE_AFTER seconds are claimed again, a failed attempt is
+retried after RETRY_DELAY (doubled per attempt), up to MAX_ATTEMPTS.
+Claimed files are analyzed on a thread or process pool (analysis doesn't
+touch the database) and the results written with one bulk_update per
+batch.
+
+``analyze`` reads headers in pure Python, compressed audio is never
+decoded: MP3 frame headers and their Xing/Info/VBRI tables, the WAV fmt
+and data chunks and FLAC STREAMINFO. Loudness is the RMS level of PCM WAV
+samples, or the level the ReplayGain track gain of a FLAC file was
+computed from; MP3s have none. The content hash is the file's sha256.
+
+The process_audio_jobs command runs the queue. Analysis is CPU bound (WAV
+levels and hashes in pure Python) and would hold the GIL of the web
+process, so IN_PROCESS, a dispatcher thread of the web process analyzing
+on a process pool, is only meant for setups without a worker.
+"""
+import datetime
+import hashlib
+import logging
+import math
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from operator import mul
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import cache
+from .models import AudioMetadataJob, Song
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'IN_PROCESS': False,    # run queued jobs from the web process, on a process pool
+    'WORKERS': 2,           # files analyzed at a time
+    'BATCH_SIZE': 20,       # jobs claimed at a time
+    'MAX_ATTEMPTS': 3,
+    'STALE_AFTER': 600,     # seconds a running job may take before it's claimed again
+    'RETRY_DELAY': 60,      # seconds before a failed attempt is retried, doubled per attempt
+}
+
+# Song fields written from the analysis
+FIELDS = ['duration', 'bitrate', 'sample_rate', 'loudness', 'content_hash']
+
+READ_SIZE = 1 << 20
+SCAN_SIZE = 1 << 16     # bytes searched for the first MPEG frame
+
+
+def get_setting(name):
+    return getattr(settings, 'AUDIO_METADATA', {}).get(name, DEFAULTS[name])
+
+
+class AudioFormatError(ValueError):
+    """The file isn't audio ``analyze`` can read, retrying won't help."""
+
+
+# ---------- MP3 ----------
+# kbit/s by bitrate index, per (MPEG-1, layer)
+MPEG_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by sample rate index, per version bits (MPEG-1, MPEG-2, MPEG-2.5)
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+def _id3_size(head):
+    """Length of the ID3v2 tag at the start of a file, 0 without one."""
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = size << 7 | byte & 0x7f
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+
+def _mpeg_frame(header):
+    """(bitrate, sample_rate, samples, length, mono, mpeg1) of an MPEG audio frame header, None if it isn't one."""
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version = header[1] >> 3 & 3
+    layer = 4 - (header[1] >> 1 & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = header[2] >> 2 & 3
+    # reserved values, and free format streams which don't say their bitrate
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = MPEG_BITRATES[mpeg1, layer][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = header[2] >> 1 & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return bitrate, sample_rate, samples, length, header[3] >> 6 == 3, mpeg1
+
+
+def _mp3(file, size, start):
+    file.seek(start)
+    data = file.read(SCAN_SIZE)
+    # the first frame header another one follows, sync bytes show up in tags and album art too
+    offset = data.find(b'\xff')
+    while offset != -1:
+        frame = _mpeg_frame(data[offset:offset + 4])
+        if frame is not None:
+            following = data[offset + frame[3]:offset + frame[3] + 4]
+            if len(following) < 4 or _mpeg_frame(following) is not None:
+                break
+        offset = data.find(b'\xff', offset + 1)
+    else:
+        raise AudioFormatError("no MPEG audio frame")
+    bitrate, sample_rate, samples, _, mono, mpeg1 = frame
+
+    file.seek(max(size - 128, 0))
+    end = size - 128 if file.read(3) == b'TAG' else size     # ID3v1
+    audio = end - start - offset
+    frames = None
+    # VBR encoders describe the stream in the first frame, after the side information
+    xing = offset + 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        if flags & 1:
+            frames = int.from_bytes(data[xing + 8:xing + 12], 'big')
+        if flags & 3 == 3:
+            audio = int.from_bytes(data[xing + 12:xing + 16], 'big')
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        audio = int.from_bytes(data[offset + 46:offset + 50], 'big')
+        frames = int.from_bytes(data[offset + 50:offset + 54], 'big')
+
+    if frames:
+        duration = frames * samples / sample_rate
+        bitrate = round(audio * 8 / duration)
+    else:
+        duration = audio * 8 / bitrate
+    return {'duration': duration, 'bitrate': bitrate, 'sample_rate': sample_rate, 'loudness': None}
+
+
+# ---------- WAV ----------
+PCM = 1
+IEEE_FLOAT = 3
+EXTENSIBLE = 0xfffe
+# unsigned 8-bit samples to signed ones
+SIGNED_BYTES = bytes((byte - 128) & 0xff for byte in range(256))
+
+
+def _rms_level(file, start, length, audio_format, width):
+    """RMS level of PCM samples in dBFS, None for sample formats it doesn't read and for silence."""
+    if audio_format == IEEE_FLOAT and width == 4:
+        typecode, scale = 'f', 1.0
+    elif audio_format == PCM and width == 1:
+        typecode, scale = 'b', 128.0
+    elif audio_format == PCM and width in (2, 3, 4):
+        # wider samples are cut down to their two most significant bytes, plenty for a level
+        typecode, scale = 'h', 32768.0
+    else:
+        return None
+
+    file.seek(start)
+    block = READ_SIZE // width * width
+    total = 0
+    count = 0
+    while length > 0:
+        data = file.read(min(block, length))
+        data = data[:len(data) - len(data) % width]
+        if not data:
+            break
+        length -= len(data)
+        if width == 1:
+            data = data.translate(SIGNED_BYTES)
+        elif typecode == 'h' and width > 2:
+            wide = bytearray(len(data) // width * 2)
+            wide[0::2] = data[width - 2::width]
+            wide[1::2] = data[width - 1::width]
+            data = wide
+        samples = array(typecode, data)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        total += sum(map(mul, samples, samples))
+        count += len(samples)
+    rms = math.sqrt(total / count) / scale if count else 0
+    return 20 * math.log10(rms) if rms else None
+
+
+def _wav(file, size):
+    file.seek(12)
+    fmt = None
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            raise AudioFormatError("WAV file without a data chunk")
+        chunk, length = header[:4], int.from_bytes(header[4:], 'little')
+        if chunk == b'data':
+            break
+        if chunk == b'fmt ':
+            fmt = file.read(length)
+            file.seek(length & 1, 1)
+        else:
+            file.seek(length + (length & 1), 1)
+    if fmt is None or len(fmt) < 16:
+        raise AudioFormatError("WAV data before its fmt chunk")
+    start = file.tell()
+    # streamed WAVs leave the data size at its maximum
+    length = min(length, size - start)
+
+    audio_format, channels, sample_rate, byte_rate, block_align, _ = struct.unpack('<HHIIHH', fmt[:16])
+    if audio_format == EXTENSIBLE and len(fmt) >= 26:
+        audio_format = int.from_bytes(fmt[24:26], 'little')
+    if not byte_rate or not channels:
+        raise AudioFormatError("WAV fmt chunk without a byte rate")
+    return {
+        'duration': length / byte_rate,
+        'bitrate': byte_rate * 8,
+        'sample_rate': sample_rate,
+        'loudness': _rms_level(file, start, length, audio_format, block_align // channels),
+    }
+
+
+# ---------- FLAC ----------
+STREAMINFO = 0
+VORBIS_COMMENT = 4
+# ReplayGain 2.0 track gains bring tracks to -18 LUFS
+REPLAYGAIN_REFERENCE = -18.0
+
+
+def _replaygain(block):
+    """The REPLAYGAIN_TRACK_GAIN of a Vorbis comment block in dB, None without one."""
+    try:
+        offset = 4 + int.from_bytes(block[:4], 'little')
+        count = int.from_bytes(block[offset:offset + 4], 'little')
+        offset += 4
+        for _ in range(count):
+            length = int.from_bytes(block[offset:offset + 4], 'little')
+            key, _, value = block[offset + 4:offset + 4 + length].decode('utf-8', 'replace').partition('=')
+            offset += 4 + length
+            if key.upper() == 'REPLAYGAIN_TRACK_GAIN':
+                return float(value.split()[0])
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def _flac(file, size, start):
+    file.seek(start + 4)
+    info = gain = None
+    last = False
+    while not last:
+        header = file.read(4)
+        if len(header) < 4:
+            raise AudioFormatError("truncated FLAC metadata")
+        last, kind, length = header[0] & 0x80, header[0] & 0x7f, int.from_bytes(header[1:], 'big')
+        if kind == STREAMINFO:
+            info = file.read(length)
+        elif kind == VORBIS_COMMENT:
+            gain = _replaygain(file.read(length))
+        else:
+            file.seek(length, 1)
+    if info is None or len(info) < 18:
+        raise AudioFormatError("FLAC file without STREAMINFO")
+
+    # 20 bits sample rate, 3 bits channels, 5 bits sample size, 36 bits total samples
+    packed = int.from_bytes(info[10:18], 'big')
+    sample_rate = packed >> 44
+    samples = packed & (1 << 36) - 1
+    if not sample_rate:
+        raise AudioFormatError("FLAC STREAMINFO without a sample rate")
+    # encoders streaming their output may not know the total
+    duration = samples / sample_rate if samples else None
+    return {
+        'duration': duration,
+        'bitrate': round((size - file.tell()) * 8 / duration) if duration else None,
+        'sample_rate': sample_rate,
+        'loudness': REPLAYGAIN_REFERENCE - gain if gain is not None else None,
+    }
+
+
+# ---------- Analysis ----------
+def analyze(name):
+    """Metadata of the stored audio file ``name``, the Song FIELDS by name."""
+    with default_storage.open(name, 'rb') as file:
+        size = file.size
+        head = file.read(12)
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            metadata = _wav(file, size)
+        else:
+            start = _id3_size(head)
+            file.seek(start)
+            if file.read(4) == b'fLaC':
+                metadata = _flac(file, size, start)
+            else:
+                metadata = _mp3(file, size, start)
+        digest = hashlib.sha256()
+        for chunk in file.chunks(READ_SIZE):
+            digest.update(chunk)
+
+    duration, loudness = metadata['duration'], metadata['loudness']
+    metadata['duration'] = datetime.timedelta(seconds=round(duration, 3)) if duration is not None else None
+    metadata['loudness'] = round(loudness, 2) if loudness is not None else None
+    metadata['content_hash'] = digest.hexdigest()
+    return metadata
+
+
+def make_executor(workers=None, processes=False):
+    """A pool analyzing ``workers`` files at a time, processes for CPU bound work such as WAV levels."""
+    workers = workers or get_setting('WORKERS')
+    if processes:
+        # spawned, forking a threaded (web) process is unsafe; the workers only need Django's settings and apps
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+    return ThreadPoolExecutor(workers, thread_name_prefix='audio-metadata')
+
+
+# ---------- Jobs ----------
+def enqueue(songs, force=False):
+    """
+    Queue the songs, (id, audio file name) pairs, unless their file already
+    has a job or ``force``. Returns the ids of the queued songs.
+    """
+    songs = {pk: name for pk, name in songs if name}
+    if not force:
+        for pk, name in AudioMetadataJob.objects.filter(song_id__in=songs).values_list('song_id', 'audio_file'):
+            if songs[pk] == name:
+                del songs[pk]
+    if songs:
+        # a worker still running an old job of a song finds it gone and drops its result
+        AudioMetadataJob.objects.filter(song_id__in=songs).delete()
+        now = timezone.now()
+        AudioMetadataJob.objects.bulk_create([
+            AudioMetadataJob(song_id=pk, audio_file=name, queued_at=now) for pk, name in songs.items()
+        ], ignore_conflicts=True)
+    return list(songs)
+
+
+def claim(limit):
+    """
+    Claim up to ``limit`` jobs, pending ones due for an attempt in queue order
+    and running ones past STALE_AFTER. Returns the claim token and the (job id, audio file) pairs.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=get_setting('STALE_AFTER'))
+    ready = AudioMetadataJob.objects.filter(
+        Q(status=AudioMetadataJob.PENDING) & (Q(not_before__isnull=True) | Q(not_before__lte=now))
+        | Q(status=AudioMetadataJob.RUNNING, started_at__lt=stale)
+    )
+    ids = list(ready.order_by('queued_at', 'id').values_list('id', flat=True)[:limit])
+    token = uuid.uuid4().hex
+    if ids:
+        # the filter is checked again by the UPDATE, a job another worker got in between is skipped
+        ready.filter(pk__in=ids).update(
+            status=AudioMetadataJob.RUNNING, token=token, started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+    jobs = AudioMetadataJob.objects.filter(token=token, status=AudioMetadataJob.RUNNING)
+    return token, list(jobs.values_list('id', 'audio_file'))
+
+
+@transaction.atomic
+def finish(token, results, errors):
+    """
+    Write the results of claimed jobs, ``results`` maps job ids to metadata
+    and ``errors`` to (message, final). Jobs re-queued or deleted since they
+    were claimed are skipped. Returns the number of (done, failed) jobs.
+    """
+    held = dict(AudioMetadataJob.objects.select_for_update().filter(
+        pk__in=[*results, *errors], token=token, status=AudioMetadataJob.RUNNING
+    ).values_list('id', 'song_id'))
+    now = timezone.now()
+
+    songs = [Song(pk=held[job_id], **metadata) for job_id, metadata in results.items() if job_id in held]
+    # keep a duration entered by hand when the file doesn't tell
+    Song.objects.bulk_update([song for song in songs if song.duration is not None], FIELDS)
+    Song.objects.bulk_update([song for song in songs if song.duration is None], FIELDS[1:])
+    AudioMetadataJob.objects.filter(pk__in=[job_id for job_id in results if job_id in held]).update(
+        status=AudioMetadataJob.DONE, token='', error='', finished_at=now
+    )
+
+    failed = 0
+    attempts = dict(AudioMetadataJob.objects.filter(pk__in=held).values_list('id', 'attempts'))
+    for job_id, (message, final) in errors.items():
+        if job_id not in held:
+            continue
+        if final or attempts[job_id] >= get_setting('MAX_ATTEMPTS'):
+            failed += 1
+            AudioMetadataJob.objects.filter(pk=job_id).update(
+                status=AudioMetadataJob.FAILED, token='', error=message, finished_at=now
+            )
+        else:
+            # retried after RETRY_DELAY, doubled with every attempt
+            delay = get_setting('RETRY_DELAY') * 2 ** (attempts[job_id] - 1)
+            AudioMetadataJob.objects.filter(pk=job_id).update(
+                status=AudioMetadataJob.PENDING, token='', error=message,
+                not_before=now + datetime.timedelta(seconds=delay),
+            )
+
+    if songs:
+        # durations are rendered, bulk_update sends no post_save
+        tags = cache.song_tags(song.pk for song in songs)
+        transaction.on_commit(lambda: cache.bump(tags))
+    return len(songs), failed
+
+
+def run_batch(executor, batch_size=None):
+    """Claim, analyze and finish one batch of jobs. Returns (done, failed), None once the queue is empty."""
+    token, jobs = claim(batch_size or get_setting('BATCH_SIZE'))
+    if not jobs:
+        return None
+    futures = {executor.submit(analyze, name): job_id for job_id, name in jobs}
+    wait(futures)
+    results, errors = {}, {}
+    for future, job_id in futures.items():
+        try:
+            results[job_id] = future.result()
+        except AudioFormatError as error:
+            errors[job_id] = (str(error), True)
+        except Exception as error:
+            # missing files and storage hiccups are retried up to MAX_ATTEMPTS
+            logger.warning("Reading the audio metadata of job %s failed: %r", job_id, error)
+            errors[job_id] = (f'{type(error).__name__}: {error}', False)
+    return finish(token, results, errors)
+
+
+def drain(executor, batch_size=None, report=None):
+    """
+    Run batches until the queue is empty, calling ``report(done, failed,
+    seconds)`` after each. Returns (done, failed, seconds).
+    """
+    started = time.perf_counter()
+    done = failed = 0
+    while (counts := run_batch(executor, batch_size)) is not None:
+        done += counts[0]
+        failed += counts[1]
+        if report is not None:
+            report(done, failed, time.perf_counter() - started)
+    return done, failed, time.perf_counter() - started
+
+
+# ---------- In-process dispatcher ----------
+class Dispatcher:
+    """Runs queued jobs from a thread of the web process until the queue is empty, see IN_PROCESS."""
+
+    def __init__(self, workers, batch_size):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audio-metadata', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # the web process only writes the results
+        with make_executor(self.workers, processes=True) as executor:
+            while True:
+                self._wake.wait()
+                self._wake.clear()
+                try:
+                    drain(executor, self.batch_size)
+                except DatabaseError:
+                    logger.exception("Running audio metadata jobs failed")
+                finally:
+                    # the dispatcher thread owns its own connection, don't keep it idle
+                    connection.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher(get_setting('WORKERS'), get_setting('BATCH_SIZE'))
+    return _dispatcher
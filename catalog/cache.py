@@ -0,0 +1,164 @@
+"""
+Read-through cache of catalog GET responses.
+
+Entries are keyed on the path, the query string and the serializer version
+and remember the version of every tag they depend on (``artist:3``,
+``list:song``...). Tag versions live in the cache too: bumping a tag from
+the model signals invalidates every entry rendered from it without having
+to know their keys. Responses carry an ETag and ``If-None-Match`` is
+answered with a 304.
+"""
+import hashlib
+import json
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseNotModified
+from django.utils.cache import quote_etag
+from django.utils.http import urlencode
+from rest_framework.response import Response
+
+from .models import Album, Song
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'VERSION': 1,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(name, DEFAULTS[name])
+
+
+def get_cache():
+    return caches[get_setting('ALIAS')]
+
+
+# ---------- Tags ----------
+def _tag_key(tag):
+    return f'catalog:tag:{tag}'
+
+
+def tag_versions(tags):
+    """Current version of every tag, tags the cache doesn't know start a new version."""
+    cache = get_cache()
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, time.time_ns(), timeout=None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump(tags):
+    """Invalidate every cached response depending on one of the tags."""
+    if tags:
+        version = time.time_ns()
+        get_cache().set_many({_tag_key(tag): version for tag in set(tags)}, timeout=None)
+
+
+# ---------- Dependencies ----------
+# Which pages render what: song pages embed nothing, album and artist pages
+# embed their songs (with category names), albums show their artist's name
+# and artist pages list their albums. Categories are flat.
+def song_tags(song_ids):
+    song_ids = list(song_ids)
+    tags = {'list:song', 'list:album', 'list:artist', *(f'song:{pk}' for pk in song_ids)}
+    albums = Song.objects.filter(pk__in=song_ids, album__isnull=False).values_list('album_id', flat=True)
+    artists = Song.artist.through.objects.filter(song_id__in=song_ids).values_list('artist_id', flat=True)
+    tags.update(f'album:{pk}' for pk in albums)
+    tags.update(f'artist:{pk}' for pk in artists)
+    return tags
+
+
+def album_tags(album_ids):
+    album_ids = list(album_ids)
+    artists = Album.objects.filter(pk__in=album_ids).values_list('artist_id', flat=True)
+    tags = {'list:album', 'list:artist', *(f'album:{pk}' for pk in album_ids)}
+    tags.update(f'artist:{pk}' for pk in artists)
+    return tags
+
+
+def artist_tags(artist_ids):
+    artist_ids = list(artist_ids)
+    albums = Album.objects.filter(artist_id__in=artist_ids).values_list('id', flat=True)
+    tags = {'list:artist', 'list:album', *(f'artist:{pk}' for pk in artist_ids)}
+    tags.update(f'album:{pk}' for pk in albums)
+    return tags
+
+
+def category_tags(category_ids):
+    category_ids = list(category_ids)
+    songs = Song.categories.through.objects.filter(category_id__in=category_ids).values_list('song_id', flat=True)
+    albums = Album.categories.through.objects.filter(category_id__in=category_ids).values_list('album_id', flat=True)
+    tags = {'list:category', *(f'category:{pk}' for pk in category_ids)}
+    tags.update(song_tags(songs))
+    tags.update(f'album:{pk}' for pk in albums)
+    return tags
+
+
+# ---------- Responses ----------
+@lru_cache(maxsize=None)
+def serializer_version(serializer_class):
+    fields = ','.join(serializer_class().fields)
+    raw = f'{serializer_class.__module__}.{serializer_class.__qualname__}:{fields}:{get_setting("VERSION")}'
+    return hashlib.md5(raw.encode()).hexdigest()[:12]
+
+
+def etag_for(data):
+    raw = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    candidates = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [candidate.strip().removeprefix('W/') for candidate in candidates.split(',')]
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve responses of a viewset. ``cache_kind`` names
+    the tags: ``list:<kind>`` for lists, ``<kind>:<pk>`` for details.
+    """
+    cache_kind = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, [f'list:{self.cache_kind}'], request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(super().retrieve, [f'{self.cache_kind}:{pk}'], request, *args, **kwargs)
+
+    def cache_key(self, request):
+        # the data holds absolute URLs (media, next links) of the request's scheme and host
+        raw = f'{request.scheme}://{request.get_host()}{request.path}?{urlencode(sorted(request.GET.lists()), doseq=True)}'
+        version = serializer_version(self.get_serializer_class())
+        return f'catalog:response:{version}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def cached_response(self, handler, tags, request, *args, **kwargs):
+        cache = get_cache()
+        key = self.cache_key(request)
+        # read the versions first: an invalidation while rendering must win
+        versions = tag_versions(tags)
+
+        entry = cache.get(key)
+        if entry is not None and entry['versions'] == versions:
+            data, etag = entry['data'], entry['etag']
+            if not_modified(request, etag):
+                return HttpResponseNotModified(headers={'ETag': etag})
+            response = Response(data)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            etag = etag_for(response.data)
+            cache.set(key, {'data': response.data, 'etag': etag, 'versions': versions}, get_setting('TIMEOUT'))
+            if not_modified(request, etag):
+                return HttpResponseNotModified(headers={'ETag': etag})
+
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,337 @@
+"""
+Compiled read-only serializers.
+
+``compiled(SerializerClass)`` inspects a ModelSerializer once and turns it
+into a plan that renders plain dicts from ``values()`` rows, skipping the
+per-object field machinery of DRF:
+
+- model columns are read from the row and converted with the bound DRF
+  field's own ``to_representation`` (str/int fast paths, file URLs memoized)
+- forward FK primary key fields read the ``<fk>`` column
+- many primary key fields read the through table in one query
+- string related fields load the related objects once and use ``str()``
+- nested list serializers and SerializerMethodFields declared with a
+  ``NestedPage``/``NestedList`` in ``Meta.prefetch_related`` are compiled
+  recursively and loaded with one windowed query
+- other nested serializers are rendered by DRF once per distinct object
+
+Plans are compiled per serializer class and catalog.sparse Selection,
+pruned fields are neither loaded nor rendered. Output is identical to the
+DRF serializers (see the parity tests), the serializers stay the source
+of truth for fields and writes.
+"""
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils.encoding import filepath_to_uri
+from rest_framework import fields as drf_fields
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, StringRelatedField
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer, ListSerializer, Serializer, SerializerMethodField
+
+from .eager import NestedPage, eager_load, eager_load_serializer
+from .sparse import ALL, from_request
+from .utils import in_order
+
+DOT_SEGMENT = re.compile(r'(^|[/\\])\.\.?($|[/\\])')
+
+
+def is_enabled():
+    return getattr(settings, 'COMPILED_SERIALIZERS', True)
+
+
+def _order_by(ordering):
+    return [F(field[1:]).desc() if field.startswith('-') else F(field).asc() for field in ordering]
+
+
+def _child_lookup(model, relation):
+    """Lookup from the related model back to ``model`` for the relation named ``relation``."""
+    field = model._meta.get_field(relation)
+    if field.auto_created and not field.concrete:
+        return field.field.name
+    return field.related_query_name()
+
+
+class RenderContext:
+    """Per-render state: the request and memoized absolute file URLs."""
+
+    def __init__(self, request):
+        self.request = request
+        self.urls = {}
+        self.prefixes = {}
+
+    def file_url(self, storage, name):
+        url = self.urls.get(name)
+        if url is None:
+            url = self.urls[name] = self._file_url(storage, name)
+        return url
+
+    def _file_url(self, storage, name):
+        # FileSystemStorage.url() is urljoin(base_url, filepath_to_uri(name)), a plain
+        # concatenation unless the name has dot segments; build_absolute_uri() of
+        # the resulting quoted path only prepends scheme and host
+        prefix = self.prefixes.get(id(storage))
+        if prefix is None:
+            base_url = storage.base_url if isinstance(storage, FileSystemStorage) else None
+            if base_url and base_url.startswith('/') and base_url.endswith('/') and '/.' not in base_url:
+                prefix = self.request.build_absolute_uri(base_url) if self.request is not None else base_url
+            else:
+                prefix = False
+            self.prefixes[id(storage)] = prefix
+        if prefix and not DOT_SEGMENT.search(name):
+            return prefix + filepath_to_uri(name).lstrip('/')
+
+        url = storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+
+class CompiledSerializer:
+
+    def __init__(self, serializer_class, selection=ALL):
+        self.serializer_class = serializer_class
+        self.selection = selection
+        self.model = serializer_class.Meta.model
+        self.pk = self.model._meta.pk.attname
+        self.columns = [self.pk]
+        self.fields = []        # (name, kind, payload) in output order
+
+        if serializer_class.to_representation is not Serializer.to_representation:
+            raise ImproperlyConfigured(f"{serializer_class.__name__} overrides to_representation")
+        serializer = serializer_class(context={'selection': selection})
+        declared = getattr(serializer_class.Meta, 'prefetch_related', {})
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.fields.append((name, *self._compile_field(name, field, declared.get(name))))
+
+    # ---------- Compiling ----------
+    def _column(self, source):
+        if source not in self.columns:
+            self.columns.append(source)
+        return source
+
+    def _model_field(self, source):
+        return self.model._meta.get_field(source)
+
+    def _compile_field(self, name, field, spec):
+        source = field.source
+
+        if isinstance(spec, NestedPage):
+            child = compiled(spec.serializer_class, self.selection.child(name))
+            return 'nested', (child, spec.relation, spec.ordering, spec.limit)
+
+        if isinstance(field, SerializerMethodField):
+            raise ImproperlyConfigured(
+                f"{self.serializer_class.__name__}.{name} needs a NestedPage in Meta.prefetch_related"
+            )
+
+        if isinstance(field, ListSerializer):
+            child = field.child
+            ordering = (child.Meta.model._meta.pk.name,)
+            return 'nested', (compiled(type(child), self.selection.child(name)), source, ordering, None)
+
+        if isinstance(field, BaseSerializer):
+            return 'serializer', (self._column(source), field)
+
+        if isinstance(field, ManyRelatedField):
+            model_field = self._model_field(source)
+            if not model_field.many_to_many or not model_field.concrete:
+                raise ImproperlyConfigured(f"Only forward many-to-many fields are compiled ({name})")
+            if isinstance(field.child_relation, PrimaryKeyRelatedField):
+                return 'many_pks', model_field
+            if isinstance(field.child_relation, StringRelatedField):
+                return 'many_strings', model_field
+            raise ImproperlyConfigured(f"Unsupported related field {name}")
+
+        if isinstance(field, PrimaryKeyRelatedField):
+            return 'value', (self._column(source), None)
+
+        if isinstance(field, StringRelatedField):
+            return 'string', (self._column(source), self._model_field(source).related_model)
+
+        if source == '*' or '.' in source:
+            raise ImproperlyConfigured(f"Unsupported source for {name}: {source}")
+
+        if isinstance(field, drf_fields.FileField):
+            return 'file', (self._column(source), self._model_field(source).storage)
+        if type(field) in (drf_fields.CharField, drf_fields.EmailField, drf_fields.SlugField):
+            return 'value', (self._column(source), str)
+        if type(field) is drf_fields.IntegerField:
+            return 'value', (self._column(source), int)
+        return 'value', (self._column(source), field.to_representation)
+
+    # ---------- Loading ----------
+    def _many_pks(self, model_field, ids):
+        through = model_field.remote_field.through
+        source, target = model_field.m2m_field_name(), model_field.m2m_reverse_field_name()
+        rows = through.objects.filter(**{f'{source}__in': ids}).order_by(target).values_list(
+            f'{source}_id', f'{target}_id'
+        )
+        values = defaultdict(list)
+        for parent, pk in rows:
+            values[parent].append(pk)
+        return values
+
+    def _many_strings(self, model_field, ids):
+        lookup = model_field.related_query_name()
+        related = model_field.related_model.objects.filter(**{f'{lookup}__in': ids}).annotate(
+            _parent=F(lookup)
+        ).order_by('pk')
+        values = defaultdict(list)
+        strings = {}
+        for obj in related:
+            if obj.pk not in strings:
+                strings[obj.pk] = str(obj)
+            values[obj._parent].append(strings[obj.pk])
+        return values
+
+    def _nested(self, child, relation, ordering, limit, ids, context):
+        lookup = _child_lookup(self.model, relation)
+        queryset = child.model.objects.filter(**{f'{lookup}__in': ids}).annotate(_parent=F(lookup))
+        if limit is not None:
+            queryset = queryset.annotate(
+                _rank=Window(RowNumber(), partition_by=F(lookup), order_by=_order_by(ordering))
+            ).filter(_rank__lte=limit)
+        rows = list(queryset.order_by(*ordering).values(*child.columns, '_parent'))
+        values = defaultdict(list)
+        for row, item in zip(rows, child.render(rows, context)):
+            values[row['_parent']].append(item)
+        return values
+
+    def _strings(self, model, ids):
+        return {pk: str(obj) for pk, obj in model.objects.in_bulk(ids).items()}
+
+    def _serializers(self, field, ids, context):
+        model = field.Meta.model
+        bound = self.serializer_class(
+            context={'request': context.request, 'selection': self.selection}
+        ).fields[field.field_name]
+        objects = eager_load_serializer(model.objects.filter(pk__in=ids), bound)
+        return {obj.pk: bound.to_representation(obj) for obj in objects}
+
+    # ---------- Rendering ----------
+    def render(self, rows, context):
+        """Render ``values(*self.columns)`` rows, ``context`` is a RenderContext or a request."""
+        if not isinstance(context, RenderContext):
+            context = RenderContext(context)
+        rows = list(rows)
+        if not rows:
+            return []
+        ids = [row[self.pk] for row in rows]
+
+        getters = []
+        for name, kind, payload in self.fields:
+            if kind == 'value':
+                column, convert = payload
+                getters.append((name, column, convert, None))
+            elif kind == 'file':
+                column, storage = payload
+                # empty names are falsy FieldFiles, rendered as None
+                getters.append((name, column, lambda value, storage=storage: (
+                    context.file_url(storage, value) if value else None
+                ), None))
+            elif kind == 'string':
+                column, model = payload
+                strings = self._strings(model, {row[column] for row in rows if row[column] is not None})
+                getters.append((name, column, strings.get, None))
+            elif kind == 'serializer':
+                column, field = payload
+                related = self._serializers(field, {row[column] for row in rows if row[column] is not None}, context)
+                getters.append((name, column, related.get, None))
+            elif kind == 'many_pks':
+                getters.append((name, self.pk, None, self._many_pks(payload, ids)))
+            elif kind == 'many_strings':
+                getters.append((name, self.pk, None, self._many_strings(payload, ids)))
+            elif kind == 'nested':
+                getters.append((name, self.pk, None, self._nested(*payload, ids, context)))
+
+        output = []
+        for row in rows:
+            item = {}
+            for name, column, convert, many in getters:
+                value = row[column]
+                if many is not None:
+                    item[name] = many.get(value, [])
+                elif value is None:
+                    item[name] = None
+                elif convert is not None:
+                    item[name] = convert(value)
+                else:
+                    item[name] = value
+            output.append(item)
+        return output
+
+    def values(self, queryset, ordering=()):
+        """
+        The ``values()`` queryset this serializer renders, without eager loading.
+        Columns of ``ordering`` are selected as well for keyset pagination.
+        """
+        columns = list(self.columns)
+        columns += [name for name in (field.lstrip('-') for field in ordering) if name not in columns]
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def render_pks(self, queryset, ids, context):
+        """Render the rows of ``ids`` in that order."""
+        rows = {row[self.pk]: row for row in self.values(queryset.filter(pk__in=ids))}
+        return self.render([rows[pk] for pk in ids if pk in rows], context)
+
+
+# bounded, selections come from query parameters
+@lru_cache(maxsize=512)
+def compiled(serializer_class, selection=ALL):
+    return CompiledSerializer(serializer_class, selection)
+
+
+# ---------- Views ----------
+class CompiledListMixin:
+    """Viewset mixin rendering ``list`` with the compiled twin of the serializer class."""
+
+    def list(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().list(request, *args, **kwargs)
+        serializer = compiled(self.get_serializer_class(), from_request(request))
+        ordering = getattr(self.paginator, 'ordering', ())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()), ordering)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serializer.render(queryset, request))
+        return self.get_paginated_response(serializer.render(page, request))
+
+    def render_page(self, queryset, serializer_class, paginator):
+        """Paginated response of a nested collection action."""
+        request = self.request
+        if not is_enabled():
+            context = {'request': request}
+            page = paginator.paginate_queryset(eager_load(queryset, serializer_class, context), request, view=self)
+            data = serializer_class(page, many=True, context=context).data
+            return paginator.get_paginated_response(data)
+        serializer = compiled(serializer_class, from_request(request))
+        page = paginator.paginate_queryset(serializer.values(queryset, paginator.ordering), request, view=self)
+        return paginator.get_paginated_response(serializer.render(page, request))
+
+
+def render_in_order(serializer_class, queryset, ids, request, selection=None):
+    """Render the objects of ``ids`` in that order, compiled when enabled. ``selection`` defaults to the request's."""
+    if selection is None:
+        selection = from_request(request)
+    if is_enabled():
+        return compiled(serializer_class, selection).render_pks(queryset, ids, request)
+    context = {'request': request, 'selection': selection}
+    return serializer_class(in_order(eager_load(queryset, serializer_class, context), ids), many=True,
+                            context=context).data
+
+
+def render_queryset(serializer_class, queryset, request):
+    """Render every row of ``queryset``, compiled when enabled."""
+    if is_enabled():
+        serializer = compiled(serializer_class, from_request(request))
+        return serializer.render(serializer.values(queryset), request)
+    context = {'request': request}
+    return serializer_class(eager_load(queryset, serializer_class, context), many=True, context=context).data
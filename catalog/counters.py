@@ -0,0 +1,59 @@
+"""
+Denormalized ``favorite_count`` columns of Song, Album, Artist and Playlist.
+
+The counters are moved by the favorites_changed receiver inside the
+transaction that changes the favorites; ``reconcile`` recomputes them from
+the FavoriteItem rows in bulk.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Favorite, FavoriteItem
+
+
+def item_model(kind):
+    return Favorite.KINDS[kind]
+
+
+def apply(added, removed):
+    """Move the counters for lists of (user_id, kind, item_id)."""
+    deltas = Counter()
+    for _, kind, item_id in added:
+        deltas[(kind, item_id)] += 1
+    for _, kind, item_id in removed:
+        deltas[(kind, item_id)] -= 1
+
+    # one UPDATE per kind and distinct delta, almost always +1 or -1
+    groups = defaultdict(list)
+    for (kind, item_id), delta in deltas.items():
+        if delta:
+            groups[(kind, delta)].append(item_id)
+    for (kind, delta), ids in groups.items():
+        item_model(kind).objects.filter(pk__in=ids).update(favorite_count=F('favorite_count') + delta)
+
+
+def actual_count(kind):
+    """Subquery counting the FavoriteItem rows of the outer item."""
+    counts = (
+        FavoriteItem.objects.filter(kind=kind, item_id=OuterRef('pk'))
+        .values('item_id')
+        .annotate(total=Count('user_id'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def reconcile(kind, fix=True):
+    """
+    Compare the stored counters of one kind with the FavoriteItem rows.
+    Returns (drifted rows, total absolute drift); drifted rows are rewritten
+    in one UPDATE when ``fix`` is set.
+    """
+    model = item_model(kind)
+    drifted = model.objects.annotate(actual=actual_count(kind)).exclude(favorite_count=F('actual'))
+    rows = list(drifted.values_list('pk', 'favorite_count', 'actual'))
+    if fix and rows:
+        model.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(favorite_count=actual_count(kind))
+    return rows, sum(abs(stored - actual) for _, stored, actual in rows)
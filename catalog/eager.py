@@ -0,0 +1,139 @@
+"""
+Eager loading driven by serializer fields.
+
+``eager_load(queryset, SerializerClass)`` walks the serializer's declared
+fields and adds the select_related/prefetch_related calls they need:
+
+- forward FK / one-to-one relation fields and nested serializers -> select_related
+- many related fields and nested list serializers -> prefetch_related, in
+  primary key order so the output (and its ETag) is deterministic
+- ``Meta.select_related`` / ``Meta.prefetch_related`` declare what custom
+  code reads (to_representation overrides, SerializerMethodFields)
+
+``Meta.prefetch_related`` maps a field name to a relation name, a
+``NestedPage`` or a ``NestedList`` so only the fields that are actually
+rendered get loaded. The plan follows the fields of a serializer
+instance, so fields pruned by ``?fields=`` (catalog.sparse) are not
+loaded either.
+"""
+from django.db.models import Prefetch
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+from .pagination import KeysetPagination
+from .sparse import ALL
+
+
+class NestedPage:
+    """Prefetch of the first page of a collection rendered by a nested serializer."""
+
+    def __init__(self, relation, serializer_class, ordering, to_attr, limit=None):
+        self.relation = relation
+        self.serializer_class = serializer_class
+        self.ordering = ordering
+        self.to_attr = to_attr
+        self.limit = limit or KeysetPagination.page_size
+
+    def prefetch(self, prefix='', selection=ALL):
+        serializer_class = self.serializer_class
+        queryset = eager_load(serializer_class.Meta.model.objects.all(), serializer_class, {'selection': selection})
+        queryset = queryset.order_by(*self.ordering)
+        if self.limit is not None:
+            queryset = queryset[:self.limit]
+        return Prefetch(prefix + self.relation, queryset=queryset, to_attr=self.to_attr)
+
+
+class NestedList(NestedPage):
+    """Prefetch of a whole collection rendered by a nested serializer."""
+
+    def __init__(self, relation, serializer_class, ordering, to_attr):
+        super().__init__(relation, serializer_class, ordering, to_attr)
+        self.limit = None
+
+
+def _lookup(source):
+    return source.replace('.', '__')
+
+
+def plan(serializer, prefix=''):
+    """Return (select_related, prefetch_related) lookups for a serializer instance."""
+    selects, prefetches = [], []
+    meta = getattr(serializer, 'Meta', None)
+    declared = getattr(meta, 'prefetch_related', {})
+    selection = getattr(serializer, 'selection', ALL)
+
+    selects.extend(prefix + name for name in getattr(meta, 'select_related', ()))
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if name in declared:
+            spec = declared[name]
+            if isinstance(spec, NestedPage):
+                prefetches.append(spec.prefetch(prefix, selection.child(name)))
+            else:
+                prefetches.append(prefix + spec)
+            continue
+
+        if field.source == '*':
+            continue
+        source = _lookup(field.source)
+
+        if isinstance(field, ListSerializer):
+            child = field.child
+            queryset = eager_load_serializer(child.Meta.model.objects.order_by('pk'), child)
+            prefetches.append(Prefetch(prefix + source, queryset=queryset))
+
+        elif isinstance(field, BaseSerializer):
+            selects.append(prefix + source)
+            child_selects, child_prefetches = plan(field, f'{prefix}{source}__')
+            selects.extend(child_selects)
+            prefetches.extend(child_prefetches)
+
+        elif isinstance(field, ManyRelatedField) and '__' in source:
+            prefetches.append(prefix + source)
+
+        elif isinstance(field, ManyRelatedField):
+            queryset = serializer.Meta.model._meta.get_field(source).related_model.objects.order_by('pk')
+            if isinstance(field.child_relation, PrimaryKeyRelatedField):
+                queryset = queryset.only('pk')
+            prefetches.append(Prefetch(prefix + source, queryset=queryset))
+
+        elif isinstance(field, RelatedField) and not field.use_pk_only_optimization():
+            selects.append(prefix + source)
+
+    return selects, prefetches
+
+
+def eager_load(queryset, serializer_class, context=None):
+    return eager_load_serializer(queryset, serializer_class(context=context or {}))
+
+
+def eager_load_serializer(queryset, serializer):
+    selects, prefetches = plan(serializer)
+    if selects:
+        queryset = queryset.select_related(*selects)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
+
+
+def prefetched(obj, to_attr, queryset):
+    """Use the list prefetched into ``to_attr`` when available, ``queryset`` otherwise."""
+    try:
+        return getattr(obj, to_attr)
+    except AttributeError:
+        return queryset
+
+
+class EagerLoadingMixin:
+    """Viewset mixin loading everything the serializer class renders up front."""
+    # actions rendering the viewset serializer, custom actions load their own data
+    eager_actions = ('list', 'retrieve', 'update', 'partial_update')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.eager_actions:
+            queryset = eager_load(queryset, self.get_serializer_class(), self.get_serializer_context())
+        return queryset
@@ -0,0 +1,125 @@
+"""
+Library export: a user's favorites and playlist tracks as JSONL or CSV.
+
+``records(user_id)`` yields chunks of flat records (one per favorite, then
+one per playlist track in playlist order), reading the database with
+``.iterator(chunk_size=CHUNK_SIZE)`` and looking up item names once per
+chunk. ``export(user_id, output)`` encodes every chunk on its own and
+gzips it on the fly, so exporting a library of any size holds one chunk
+at a time. Used by the library/export/ endpoint and the export_library
+command.
+"""
+import csv
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from vexify.renderers import ORJSONRenderer
+from .models import Favorite, FavoriteItem, Playlist, PlaylistTrack
+from .utils import batched
+
+DEFAULTS = {
+    'CHUNK_SIZE': 2000,     # rows read and encoded at a time
+}
+
+OUTPUTS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+COLUMNS = ['type', 'playlist_id', 'playlist', 'position', 'kind', 'id', 'name', 'added_at']
+
+
+_encoder = JSONEncoder()
+
+
+def get_setting(name):
+    return getattr(settings, 'LIBRARY_EXPORT', {}).get(name, DEFAULTS[name])
+
+
+def _chunks(queryset):
+    size = get_setting('CHUNK_SIZE')
+    return batched(queryset.iterator(chunk_size=size), size)
+
+
+# ---------- Records ----------
+def _favorites(user_id):
+    rows = FavoriteItem.objects.filter(user_id=user_id).order_by('kind', 'item_id')
+    for chunk in _chunks(rows.values_list('kind', 'item_id', 'created_at')):
+        names = {}
+        for kind, model in Favorite.KINDS.items():
+            ids = [item_id for item_kind, item_id, _ in chunk if item_kind == kind]
+            if ids:
+                named = model.objects.filter(pk__in=ids).values_list('pk', 'name')
+                names.update(((kind, pk), name) for pk, name in named)
+        yield [
+            {'type': 'favorite', 'kind': kind, 'id': item_id, 'name': names.get((kind, item_id)),
+             'added_at': added_at}
+            for kind, item_id, added_at in chunk
+        ]
+
+
+def _tracks(user_id):
+    for playlist_id, playlist in Playlist.objects.filter(user_id=user_id).order_by('id').values_list('id', 'name'):
+        tracks = PlaylistTrack.objects.filter(playlist_id=playlist_id).order_by('position', 'id')
+        position = 0
+        for chunk in _chunks(tracks.values_list('song_id', 'song__name')):
+            records = []
+            for song_id, name in chunk:
+                position += 1
+                records.append({
+                    'type': 'track', 'playlist_id': playlist_id, 'playlist': playlist, 'position': position,
+                    'kind': 'song', 'id': song_id, 'name': name,
+                })
+            yield records
+
+
+def records(user_id):
+    """Chunks (lists) of the user's library records, see COLUMNS."""
+    yield from _favorites(user_id)
+    yield from _tracks(user_id)
+
+
+# ---------- Encoding ----------
+def _jsonl(chunks):
+    renderer = ORJSONRenderer()
+    for chunk in chunks:
+        yield b''.join(renderer.render(record) + b'\n' for record in chunk)
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, COLUMNS)
+    writer.writeheader()
+    for chunk in chunks:
+        for record in chunk:
+            if record.get('added_at') is not None:
+                # formatted like the JSON output
+                record['added_at'] = _encoder.default(record['added_at'])
+            writer.writerow(record)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzipped(parts):
+    """Gzip a stream of bytes as it goes."""
+    compressor = zlib.compressobj(wbits=31)     # gzip container
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(user_id, output='jsonl', compress=True):
+    """Bytes of the user's library in ``output`` (a key of OUTPUTS), gzipped unless ``compress`` is False."""
+    encode = _jsonl if output == 'jsonl' else _csv
+    parts = encode(records(user_id))
+    return gzipped(parts) if compress else parts
+
+
+def filename(user_id, output, compress=True):
+    return f'library-{user_id}.{output}' + ('.gz' if compress else '')
@@ -0,0 +1,149 @@
+"""
+Favorites: one FavoriteItem row per (user, kind, item).
+
+The unique (user, kind, item_id) constraint answers "items of a user" and
+the (kind, item_id, user) index "users of an item" from the index alone.
+Every change goes through this module, which sends favorites_changed with
+the (user_id, kind, item_id) tuples that were actually added or removed;
+counters, caches, recommendations and ``Favorite.version`` follow it.
+
+``sync`` applies an ordered batch of ``{"op": "add"|"remove", "kind": ...,
+"id": ...}`` operations from clients that queue toggles offline. Replaying
+it in order leaves every item in the state of its last operation, so only
+that one is applied and earlier ones on the same item are reported as
+superseded; replaying the same batch twice changes nothing. The requested
+ids are checked with one IN query per kind, diffed against the stored
+favorites with one more and written with one bulk_create and one delete,
+in one transaction that locks the user's Favorite row.
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import Favorite, FavoriteItem
+from .signals import favorites_changed
+from .utils import MAX_ID
+
+MAX_OPS = 1000          # operations per request
+
+ADD = 'add'
+REMOVE = 'remove'
+
+ADDED = 'added'
+REMOVED = 'removed'
+PRESENT = 'already_present'
+ABSENT = 'not_in_favorites'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+SUPERSEDED = 'superseded'
+
+
+def _items(pairs):
+    """Q matching FavoriteItem rows of (kind, item_id) pairs."""
+    by_kind = defaultdict(set)
+    for kind, item_id in pairs:
+        by_kind[kind].add(item_id)
+    return reduce(or_, (Q(kind=kind, item_id__in=ids) for kind, ids in by_kind.items()), Q(pk__in=[]))
+
+
+# ---------- Single items ----------
+@transaction.atomic
+def add(user_id, kind, item_id):
+    """Favorite one item, False when it already was."""
+    try:
+        with transaction.atomic():
+            FavoriteItem.objects.create(user_id=user_id, kind=kind, item_id=item_id)
+    except IntegrityError:
+        return False
+    favorites_changed.send(sender=Favorite, added=[(user_id, kind, item_id)], removed=[])
+    return True
+
+
+@transaction.atomic
+def remove(user_id, kind, item_id):
+    """Unfavorite one item, False when it was not a favorite."""
+    deleted, _ = FavoriteItem.objects.filter(user_id=user_id, kind=kind, item_id=item_id).delete()
+    if not deleted:
+        return False
+    favorites_changed.send(sender=Favorite, added=[], removed=[(user_id, kind, item_id)])
+    return True
+
+
+# ---------- Batches ----------
+def parse(operations):
+    """
+    [(op, kind, item_id, error)] for the operations of a request, error is
+    INVALID (and the values as sent) for operations that are skipped.
+    ValueError for a malformed request.
+    """
+    if not isinstance(operations, list):
+        raise ValueError('operations must be a list')
+    if len(operations) > MAX_OPS:
+        raise ValueError(f'at most {MAX_OPS} operations per request')
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            parsed.append((None, None, None, INVALID))
+            continue
+        op, kind, value = operation.get('op'), operation.get('kind'), operation.get('id')
+        try:
+            item_id = None if isinstance(value, bool) else int(value)
+        except (TypeError, ValueError):
+            item_id = None
+        if op not in (ADD, REMOVE) or kind not in Favorite.KINDS or item_id is None or abs(item_id) > MAX_ID:
+            parsed.append((op, kind, value, INVALID))
+        else:
+            parsed.append((op, kind, item_id, None))
+    return parsed
+
+
+@transaction.atomic
+def sync(user, operations):
+    parsed = parse(operations)
+    favorite, _ = Favorite.objects.select_for_update().get_or_create(user=user)
+
+    # the last operation on an item wins
+    last = {}
+    for index, (op, kind, item_id, error) in enumerate(parsed):
+        if error is None:
+            last[(kind, item_id)] = index
+    wanted = {item: parsed[index][0] for item, index in last.items()}
+
+    existing = set()
+    for kind, model in Favorite.KINDS.items():
+        ids = [item_id for item_kind, item_id in wanted if item_kind == kind]
+        if ids:
+            existing.update((kind, pk) for pk in model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    stored = set()
+    if wanted:
+        stored = set(FavoriteItem.objects.filter(_items(wanted), user_id=user.pk).values_list('kind', 'item_id'))
+
+    added = [item for item, op in wanted.items() if op == ADD and item in existing and item not in stored]
+    removed = [item for item, op in wanted.items() if op == REMOVE and item in stored]
+    FavoriteItem.objects.bulk_create([FavoriteItem(user_id=user.pk, kind=kind, item_id=pk) for kind, pk in added])
+    if removed:
+        FavoriteItem.objects.filter(_items(removed), user_id=user.pk).delete()
+    if added or removed:
+        favorites_changed.send(
+            sender=Favorite,
+            added=[(user.pk, kind, pk) for kind, pk in added],
+            removed=[(user.pk, kind, pk) for kind, pk in removed],
+        )
+        favorite.refresh_from_db(fields=['version'])
+
+    results = []
+    for index, (op, kind, item_id, error) in enumerate(parsed):
+        item = (kind, item_id)
+        if error is not None:
+            status = error
+        elif last[item] != index:
+            status = SUPERSEDED
+        elif op == ADD:
+            status = NOT_FOUND if item not in existing else PRESENT if item in stored else ADDED
+        else:
+            status = REMOVED if item in stored else ABSENT
+        results.append({'op': op, 'kind': kind, 'id': item_id, 'status': status})
+    return {'version': favorite.version, 'added': len(added), 'removed': len(removed), 'results': results}
@@ -0,0 +1,88 @@
+"""
+Streamed JSON for whole collections.
+
+``?stream=1`` on the catalog list endpoints and the song collections of
+artists, albums and playlists returns every matching row, unpaginated, as
+a StreamingHttpResponse of one JSON array. Rows are read with
+``.iterator(chunk_size=CHUNK_SIZE)`` in the pagination ordering, every
+chunk is rendered by the compiled serializer (the DRF serializer, with
+per-chunk prefetches, when compiled serializers are off) and encoded on
+its own, so worker memory is bounded by the chunk size rather than the
+size of the collection. Streamed responses skip the response cache.
+"""
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from vexify.renderers import ORJSONRenderer
+from .compiled import RenderContext, compiled, is_enabled
+from .eager import eager_load
+from .sparse import from_request
+from .utils import batched
+
+DEFAULTS = {
+    'PARAM': 'stream',
+    'CHUNK_SIZE': 500,      # rows read, rendered and encoded at a time
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'STREAMING', {}).get(name, DEFAULTS[name])
+
+
+def requested(request):
+    return request.method == 'GET' and request.query_params.get(get_setting('PARAM')) in ('1', 'true')
+
+
+def _compiled_chunks(queryset, serializer_class, ordering, request):
+    serializer = compiled(serializer_class, from_request(request))
+    rows = serializer.values(queryset, ordering).order_by(*ordering)
+    for chunk in batched(rows.iterator(chunk_size=get_setting('CHUNK_SIZE')), get_setting('CHUNK_SIZE')):
+        # a context per chunk, its memoized URLs would grow with the collection
+        yield serializer.render(chunk, RenderContext(request))
+
+
+def _drf_chunks(queryset, serializer_class, ordering, request):
+    context = {'request': request}
+    # list querysets come eager loaded already
+    queryset = queryset.select_related(None).prefetch_related(None)
+    objects = eager_load(queryset, serializer_class, context).order_by(*ordering)
+    for chunk in batched(objects.iterator(chunk_size=get_setting('CHUNK_SIZE')), get_setting('CHUNK_SIZE')):
+        yield serializer_class(chunk, many=True, context=context).data
+
+
+def _encode(chunks):
+    renderer = ORJSONRenderer()
+    yield b'['
+    first = True
+    for items in chunks:
+        if items:
+            # the encoded list without its brackets
+            body = renderer.render(items)[1:-1]
+            yield body if first else b',' + body
+            first = False
+    yield b']'
+
+
+def stream(queryset, serializer_class, ordering, request):
+    chunks = _compiled_chunks if is_enabled() else _drf_chunks
+    return StreamingHttpResponse(
+        _encode(chunks(queryset, serializer_class, ordering, request)), content_type='application/json'
+    )
+
+
+class StreamingListMixin:
+    """
+    Viewset mixin streaming ``list`` and ``render_page`` on request, goes
+    before CachedResponseMixin and CompiledListMixin.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not requested(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return stream(queryset, self.get_serializer_class(), self.paginator.ordering, request)
+
+    def render_page(self, queryset, serializer_class, paginator):
+        if not requested(self.request):
+            return super().render_page(queryset, serializer_class, paginator)
+        return stream(queryset, serializer_class, paginator.ordering, self.request)
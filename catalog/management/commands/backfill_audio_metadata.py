@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from catalog import audio
+from catalog.models import Song
+from catalog.utils import batched
+
+QUEUE_BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue the audio metadata of existing songs, those never analyzed unless --all, and run "
+        "the queue on a thread or process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Analyze songs that already have metadata again.")
+        parser.add_argument('--workers', type=int, help="Files analyzed at a time, AUDIO_METADATA['WORKERS'] by default.")
+        parser.add_argument('--processes', action='store_true', help="Analyze on a process pool instead of threads.")
+        parser.add_argument('--batch-size', type=int, help="Jobs claimed at a time.")
+        parser.add_argument('--queue-only', action='store_true', help="Leave the queued jobs to process_audio_jobs.")
+
+    def handle(self, *args, **options):
+        songs = Song.objects.exclude(audio_file='')
+        if not options['all']:
+            songs = songs.filter(content_hash='')
+        queued = 0
+        rows = songs.order_by('id').values_list('id', 'audio_file').iterator(chunk_size=QUEUE_BATCH_SIZE)
+        for batch in batched(rows, QUEUE_BATCH_SIZE):
+            queued += len(audio.enqueue(batch, force=True))
+        self.stdout.write(f"Queued {queued} songs")
+        if options['queue_only']:
+            return
+
+        def report(done, failed, elapsed):
+            self.stdout.write(f"{done + failed}/{queued} ({(done + failed) / elapsed:.1f} files/s)")
+
+        with audio.make_executor(options['workers'], options['processes']) as executor:
+            done, failed, elapsed = audio.drain(executor, options['batch_size'], report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Analyzed {done} files in {elapsed:.1f}s, {failed} failed"
+        ))
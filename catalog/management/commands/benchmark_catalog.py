@@ -0,0 +1,193 @@
+import datetime
+import json
+import math
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from catalog.models import Artist, Album, Song, Playlist, Favorite
+
+ENDPOINTS = ['recommendation', 'search', 'artist', 'album', 'playlist', 'favorites']
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def sample_ids(queryset, count, rng):
+    """Up to ``count`` random primary keys without scanning the table."""
+    bounds = list(queryset.order_by('pk').values_list('pk', flat=True)[:1]) + \
+        list(queryset.order_by('-pk').values_list('pk', flat=True)[:1])
+    if not bounds:
+        return []
+    ids = []
+    for _ in range(count * 3):
+        pk = queryset.filter(pk__gte=rng.randint(bounds[0], bounds[1])).order_by('pk').values_list('pk', flat=True).first()
+        if pk is not None:
+            ids.append(pk)
+        if len(ids) == count:
+            break
+    return ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot catalog endpoints through the test client and report latency percentiles and "
+        "query counts as JSON. Run generate_catalog first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per endpoint.")
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, help="Only these endpoints.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help="Keep the response caches between requests, by default every request renders.",
+        )
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+        parser.add_argument('--compare', help="Previous JSON report to compare against.")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="Flag p50/p95 regressions above this percentage when comparing.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.warm_cache = options['warm_cache']
+        self.client = APIClient(SERVER_NAME='localhost')
+
+        requests = self.requests(rng, options['iterations'] + options['warmup'])
+        endpoints = options['endpoint'] or ENDPOINTS
+        results = {}
+        for name in endpoints:
+            if not requests[name]:
+                self.stderr.write(f"Skipping {name}: no data, run generate_catalog first")
+                continue
+            results[name] = self.run(requests[name], options['warmup'])
+            self.stderr.write(
+                f"{name}: p50 {results[name]['latency_ms']['p50']:.1f}ms "
+                f"p95 {results[name]['latency_ms']['p95']:.1f}ms "
+                f"queries {results[name]['queries']['max']}"
+            )
+
+        report = {
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'warm_cache': self.warm_cache,
+            'iterations': options['iterations'],
+            'dataset': {
+                model.__name__.lower(): model.objects.count()
+                for model in (Song, Album, Artist, Playlist, User)
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    # ---------- Requests ----------
+    def requests(self, rng, count):
+        """Per endpoint a list of (url, user) spread over random rows."""
+        users = self.sample_users(rng, count)
+        words = [
+            name.split()[0]
+            for name in Song.objects.filter(pk__in=sample_ids(Song.objects, count, rng)).values_list('name', flat=True)
+        ]
+
+        def cycle(items, make):
+            return [make(items[i % len(items)]) for i in range(count)] if items else []
+
+        return {
+            'recommendation': cycle(users, lambda user: ('/catalog/recommendation/', user)),
+            'search': cycle(words, lambda word: (f'/catalog/search/?q={word}', None)),
+            'artist': cycle(sample_ids(Artist.objects, count, rng), lambda pk: (f'/catalog/artists/{pk}/', None)),
+            'album': cycle(sample_ids(Album.objects, count, rng), lambda pk: (f'/catalog/albums/{pk}/', None)),
+            'playlist': cycle(sample_ids(Playlist.objects, count, rng),
+                              lambda pk: (f'/catalog/playlists/{pk}/', None)),
+            'favorites': cycle(users, lambda user: ('/catalog/favorites/', user)),
+        }
+
+    def sample_users(self, rng, count):
+        favorite_ids = sample_ids(Favorite.objects, count, rng)
+        return list(User.objects.filter(favorite__in=favorite_ids))
+
+    def run(self, requests, warmup):
+        latencies, queries, sizes, statuses = [], [], [], {}
+        for i, (url, user) in enumerate(requests):
+            self.client.force_authenticate(user)
+            if not self.warm_cache:
+                for alias in settings.CACHES:
+                    caches[alias].clear()
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = self.client.get(url)
+                elapsed = time.perf_counter() - started
+            if i < warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            sizes.append(len(response.content))
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        latencies.sort()
+        return {
+            'latency_ms': {
+                'min': latencies[0],
+                'mean': statistics.fmean(latencies),
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1],
+            },
+            'queries': {'min': min(queries), 'mean': statistics.fmean(queries), 'max': max(queries)},
+            'response_bytes': {'mean': statistics.fmean(sizes), 'max': max(sizes)},
+            'status_codes': {str(code): n for code, n in statuses.items()},
+        }
+
+    # ---------- Comparing ----------
+    def compare(self, report, path, threshold):
+        try:
+            with open(path) as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot read baseline report {path}: {exc}")
+
+        regressions = 0
+        for name, result in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if before is None:
+                continue
+            line = [name]
+            for key in ('p50', 'p95'):
+                old, new = before['latency_ms'][key], result['latency_ms'][key]
+                change = (new - old) / old * 100 if old else 0
+                regressed = change > threshold
+                regressions += regressed
+                line.append(f"{key} {old:.1f} -> {new:.1f}ms ({change:+.0f}%){' !' if regressed else ''}")
+            old_queries, new_queries = before['queries']['max'], result['queries']['max']
+            if new_queries > old_queries:
+                regressions += 1
+            line.append(f"queries {old_queries} -> {new_queries}{' !' if new_queries > old_queries else ''}")
+            self.stderr.write('  '.join(line))
+
+        if regressions:
+            self.stderr.write(self.style.WARNING(f"{regressions} regression(s) against {path}"))
+        else:
+            self.stderr.write(self.style.SUCCESS(f"No regressions against {path}"))
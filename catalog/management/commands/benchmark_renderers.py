@@ -0,0 +1,60 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from catalog.models import Song
+from catalog.serializers import SongSerializer
+from vexify import renderers
+
+
+class Command(BaseCommand):
+    help = (
+        "Time encoding a list of serialized songs with DRF's JSONRenderer and the orjson renderer. "
+        "Run generate_catalog first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1000, help="Songs in the payload.")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed encodings per renderer.")
+
+    def handle(self, *args, **options):
+        songs = list(Song.objects.order_by('pk')[:options['songs']])
+        if len(songs) < options['songs']:
+            raise CommandError(f"Only {len(songs)} songs, run generate_catalog first")
+        request = Request(APIRequestFactory().get('/', SERVER_NAME='localhost'))
+        data = SongSerializer(songs, many=True, context={'request': request}).data
+
+        candidates = [('drf-json', JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(('orjson', renderers.ORJSONRenderer()))
+        else:
+            self.stderr.write("orjson is not installed, ORJSONRenderer falls back to the stdlib")
+
+        reference = candidates[0][1].render(data)
+        results = {}
+        for name, renderer in candidates:
+            output = renderer.render(data)
+            if output != reference:
+                raise CommandError(f"{name} output differs from JSONRenderer")
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                renderer.render(data)
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                'median_ms': statistics.median(timings),
+                'min_ms': min(timings),
+                'bytes': len(output),
+            }
+
+        baseline = results['drf-json']['median_ms']
+        for name, result in results.items():
+            result['speedup'] = baseline / result['median_ms'] if result['median_ms'] else None
+            self.stderr.write(f"{name}: {result['median_ms']:.2f}ms, {result['bytes']} bytes, "
+                              f"{result['speedup']:.1f}x")
+        self.stdout.write(json.dumps({'songs': len(songs), 'renderers': results}, indent=2))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from accounts.models import User
+from catalog import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export a user's favorites and playlist tracks as JSONL or CSV, gzipped unless --no-gzip. "
+        "Streams chunk by chunk, the library is never held in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="User id, email or username.")
+        parser.add_argument('path', nargs='?', help="Output file, library-<id>.<output>[.gz] by default.")
+        parser.add_argument('--output', choices=list(export.OUTPUTS), default='jsonl')
+        parser.add_argument('--no-gzip', action='store_false', dest='gzip', help="Write uncompressed output.")
+
+    def handle(self, *args, **options):
+        value = options['user']
+        lookup = Q(email=value) | Q(username=value)
+        if value.isdigit():
+            lookup |= Q(pk=int(value))
+        user = User.objects.filter(lookup).first()
+        if user is None:
+            raise CommandError(f"No user '{value}'")
+
+        path = options['path'] or export.filename(user.pk, options['output'], options['gzip'])
+        started = time.perf_counter()
+        written = 0
+        with open(path, 'wb') as file:
+            for part in export.export(user.pk, options['output'], options['gzip']):
+                file.write(part)
+                written += len(part)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {user} to {path} ({written} bytes) in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,223 @@
+import datetime
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import User, Profile
+from catalog import counters, recommender, search
+from catalog.models import Category, Artist, Album, Song, Playlist, PlaylistTrack, Favorite, FavoriteItem
+from catalog.playlists import GAP
+from catalog.utils import batched
+
+WORDS = [
+    'blue', 'night', 'fire', 'river', 'echo', 'golden', 'shadow', 'summer', 'storm', 'silver',
+    'heart', 'neon', 'velvet', 'dream', 'paper', 'wild', 'ocean', 'midnight', 'glass', 'electric',
+    'lonely', 'city', 'moon', 'road', 'rain', 'ghost', 'sugar', 'winter', 'broken', 'crystal',
+]
+
+RELEASED_FROM = datetime.date(1970, 1, 1)
+
+
+class Zipf:
+    """
+    Reproducible Zipf sampler over a list of items in rank order. Items are
+    shuffled first unless ``ranked`` so popularity doesn't follow the ids.
+    """
+
+    def __init__(self, items, exponent, rng, ranked=False):
+        self.items = list(items)
+        if not ranked:
+            rng.shuffle(self.items)
+        self.weights = [1 / rank ** exponent for rank in range(1, len(self.items) + 1)]
+        self.cum_weights = list(accumulate(self.weights))
+        self.rng = rng
+
+    def sample(self, k):
+        """Up to k distinct items, popular ones first to be drawn."""
+        if not self.items or k <= 0:
+            return []
+        return list(dict.fromkeys(self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic catalog: Zipf-distributed song popularity, favorites and "
+        "playlists, written with bulk_create and bulk through-table inserts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=10000)
+        parser.add_argument('--artists', type=int, default=1000)
+        parser.add_argument('--albums', type=int, default=None, help="Defaults to one album per 10 songs.")
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--favorites', type=int, default=30, help="Mean favorite songs per user.")
+        parser.add_argument('--playlists', type=int, default=1, help="Playlists per user.")
+        parser.add_argument('--playlist-size', type=int, default=20)
+        parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of item popularity.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='gen', help="Prefix of generated names, must be unique per run.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skip-indexes', action='store_true',
+            help="Don't rebuild the favorite counters, search index and recommendations afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.exponent = options['zipf']
+        self.prefix = options['prefix']
+        started = time.perf_counter()
+
+        categories = self.phase('categories', self.create_categories, options['categories'])
+        artists = self.phase('artists', self.create_artists, options['artists'])
+        albums = self.phase('albums', self.create_albums, options['albums'] or max(1, options['songs'] // 10),
+                            artists, categories)
+        songs = self.phase('songs', self.create_songs, options['songs'], albums, artists, categories)
+        user_ids = self.phase('users', self.create_users, options['users'])
+        playlists = self.phase('playlists', self.create_playlists, user_ids, songs,
+                               options['playlists'], options['playlist_size'])
+        self.phase('favorites', self.create_favorites, user_ids, songs, albums, artists, playlists,
+                   options['favorites'])
+
+        if not options['skip_indexes']:
+            self.phase('favorite counters', self.reconcile_counters)
+            self.phase('search index', search.rebuild)
+            self.phase('recommendations', recommender.rebuild)
+
+        self.stdout.write(self.style.SUCCESS(f"Generated catalog in {time.perf_counter() - started:.1f}s"))
+
+    def phase(self, name, function, *args):
+        started = time.perf_counter()
+        with transaction.atomic():
+            result = function(*args)
+        self.stdout.write(f"{name}: {time.perf_counter() - started:.1f}s")
+        return result
+
+    # ---------- Helpers ----------
+    def name(self, words=2):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).title()
+
+    def release_date(self):
+        return RELEASED_FROM + datetime.timedelta(days=self.rng.randrange(20000))
+
+    def insert(self, model, objects):
+        """bulk_create in batches, returns the primary keys."""
+        pks = []
+        for batch in batched(objects, self.batch_size):
+            pks.extend(obj.pk for obj in model.objects.bulk_create(batch))
+        return pks
+
+    def insert_pairs(self, through, columns, pairs):
+        first, second = columns
+        for batch in batched(pairs, self.batch_size):
+            through.objects.bulk_create([through(**{first: a, second: b}) for a, b in batch])
+
+    def zipf(self, items):
+        return Zipf(items, self.exponent, self.rng)
+
+    # ---------- Catalog ----------
+    def create_categories(self, count):
+        return self.insert(Category, (
+            Category(name=f'{self.name(1)} {i}', cover='categories/generated.jpg') for i in range(count)
+        ))
+
+    def create_artists(self, count):
+        return self.insert(Artist, (
+            Artist(name=f'{self.prefix} {self.name()} {i}', bio=self.name(6)) for i in range(count)
+        ))
+
+    def create_albums(self, count, artists, categories):
+        artist_ids = [self.rng.choice(artists) for _ in range(count)]
+        albums = self.insert(Album, (
+            Album(name=self.name(), artist_id=artist_id, cover='albums/generated.jpg',
+                  release_date=self.release_date())
+            for artist_id in artist_ids
+        ))
+        category_sampler = self.zipf(categories)
+        self.insert_pairs(Album.categories.through, ('album_id', 'category_id'), (
+            (album_id, category_id) for album_id in albums for category_id in category_sampler.sample(2)
+        ))
+        self.album_artists = dict(zip(albums, artist_ids))
+        return albums
+
+    def create_songs(self, count, albums, artists, categories):
+        album_ids = [self.rng.choice(albums) for _ in range(count)]
+        # play counts follow the same long tail as favorites
+        ranks = list(range(count))
+        self.rng.shuffle(ranks)
+        songs = self.insert(Song, (
+            Song(
+                name=self.name(self.rng.randint(1, 4)), album_id=album_id,
+                audio_file=f'audio_file/{self.prefix}-{i}.mp3',
+                duration=datetime.timedelta(seconds=self.rng.randint(90, 420)),
+                release_date=self.release_date(),
+                popularity=int(1_000_000 / (rank + 1) ** self.exponent),
+            )
+            for i, (album_id, rank) in enumerate(zip(album_ids, ranks))
+        ))
+        by_rank = [song_id for _, song_id in sorted(zip(ranks, songs))]
+        self.song_sampler = Zipf(by_rank, self.exponent, self.rng, ranked=True)
+
+        def song_artists():
+            for song_id, album_id in zip(songs, album_ids):
+                main = self.album_artists[album_id]
+                yield song_id, main
+                if self.rng.random() < 0.1:
+                    featured = self.rng.choice(artists)
+                    if featured != main:
+                        yield song_id, featured
+
+        self.insert_pairs(Song.artist.through, ('song_id', 'artist_id'), song_artists())
+        category_sampler = self.zipf(categories)
+        self.insert_pairs(Song.categories.through, ('song_id', 'category_id'), (
+            (song_id, category_id) for song_id in songs
+            for category_id in category_sampler.sample(self.rng.randint(1, 2))
+        ))
+        return songs
+
+    # ---------- Users ----------
+    def create_users(self, count):
+        # hashing is deliberately slow, every generated user shares one hash of "password"
+        password = make_password('password')
+        birthday = datetime.date(1990, 1, 1)
+        user_ids = self.insert(User, (
+            User(email=f'{self.prefix}{i}@vexify.test', username=f'{self.prefix}{i}',
+                 date_of_birth=birthday, password=password)
+            for i in range(count)
+        ))
+        self.insert(Profile, (Profile(user_id=user_id) for user_id in user_ids))
+        self.insert(Favorite, (Favorite(user_id=user_id) for user_id in user_ids))
+        return user_ids
+
+    def create_playlists(self, user_ids, songs, per_user, size):
+        owners = [user_id for user_id in user_ids for _ in range(per_user)]
+        playlists = self.insert(Playlist, (Playlist(name=self.name(), user_id=user_id) for user_id in owners))
+        self.insert(PlaylistTrack, (
+            PlaylistTrack(playlist_id=playlist_id, song_id=song_id, position=(index + 1) * GAP)
+            for playlist_id in playlists
+            for index, song_id in enumerate(self.song_sampler.sample(self.rng.randint(1, 2 * size)))
+        ))
+        return playlists
+
+    def create_favorites(self, user_ids, songs, albums, artists, playlists, mean):
+        samplers = {
+            'song': (self.song_sampler, mean),
+            'album': (self.zipf(albums), mean / 6),
+            'artist': (self.zipf(artists), mean / 6),
+            'playlist': (self.zipf(playlists), mean / 15),
+        }
+        for kind, (sampler, kind_mean) in samplers.items():
+            self.insert(FavoriteItem, (
+                FavoriteItem(user_id=user_id, kind=kind, item_id=item_id) for user_id in user_ids
+                for item_id in sampler.sample(round(self.rng.expovariate(1 / kind_mean)) if kind_mean else 0)
+            ))
+
+    def reconcile_counters(self):
+        for kind in Favorite.KINDS:
+            counters.reconcile(kind)
@@ -0,0 +1,347 @@
+import csv
+import datetime
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date, parse_duration
+
+from catalog import audio, cache, search
+from catalog.models import Category, Artist, Album, Song
+from catalog.utils import batched
+
+FORMATS = ('jsonl', 'csv')
+SEPARATOR = ';'         # between the artists and categories of a CSV cell
+MAX_ERRORS = 10         # invalid rows reported one by one
+# Song fields a delivery updates
+FIELDS = ['name', 'album', 'cover', 'duration', 'release_date']
+# durations are stored as 64-bit microseconds
+MAX_DURATION = datetime.timedelta(microseconds=(1 << 63) - 1)
+# the PositiveIntegerField range every database accepts
+MAX_POPULARITY = (1 << 31) - 1
+
+
+def _limit(model, field):
+    return model._meta.get_field(field).max_length
+
+
+def _text(record, key, max_length=None, required=False):
+    value = record.get(key)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"'{key}' is required")
+    if max_length and len(value) > max_length:
+        raise ValueError(f"'{key}' is longer than {max_length} characters")
+    return value
+
+
+def _names(record, key, max_length):
+    value = record.get(key) or []
+    if isinstance(value, str):
+        value = value.split(SEPARATOR)
+    if not isinstance(value, list):
+        raise ValueError(f"'{key}' must be a list")
+    names = [str(name).strip() for name in value]
+    for name in names:
+        if len(name) > max_length:
+            raise ValueError(f"'{key}' has a name longer than {max_length} characters")
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def _duration(value):
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            duration = datetime.timedelta(seconds=value)
+        else:
+            duration = parse_duration(str(value).strip())
+    except OverflowError:
+        raise ValueError("'duration' is out of range") from None
+    if duration is None:
+        raise ValueError("'duration' must be seconds or [hh:]mm:ss")
+    if abs(duration) > MAX_DURATION:
+        raise ValueError("'duration' is out of range")
+    return duration
+
+
+def _popularity(value):
+    if value is None or value == '':
+        return None
+    popularity = int(value)
+    if popularity < 0:
+        raise ValueError("'popularity' must be positive")
+    if popularity > MAX_POPULARITY:
+        raise ValueError(f"'popularity' must be at most {MAX_POPULARITY}")
+    return popularity
+
+
+def parse(record):
+    """A validated row of an input record, ValueError for an invalid one."""
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    artists = _names(record, 'artists', _limit(Artist, 'name'))
+    if not artists:
+        raise ValueError("'artists' is required")
+    release_date = parse_date(_text(record, 'release_date', required=True))
+    if release_date is None:
+        raise ValueError("'release_date' must be YYYY-MM-DD")
+    return {
+        'name': _text(record, 'name', _limit(Song, 'name'), required=True),
+        'audio_file': _text(record, 'audio_file', _limit(Song, 'audio_file'), required=True),
+        'artists': artists,
+        'album': _text(record, 'album', _limit(Album, 'name')),
+        'album_artist': _text(record, 'album_artist', _limit(Artist, 'name')) or artists[0],
+        'categories': _names(record, 'categories', _limit(Category, 'name')),
+        'cover': _text(record, 'cover', _limit(Song, 'cover')),
+        'duration': _duration(record.get('duration')),
+        'popularity': _popularity(record.get('popularity')),
+        'release_date': release_date,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a catalog delivery, one song per JSONL object or CSV row (optionally gzipped) with "
+        "name, audio_file, artists, album, album_artist, categories, cover, duration, popularity and "
+        "release_date. Artists are upserted by name, categories by name, albums by (album artist, name) "
+        "and songs by audio_file. Rows are committed --batch-size at a time and the position is saved "
+        "to a checkpoint file after every batch, so an interrupted import resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Input format, from the file extension by default.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--checkpoint', help="Checkpoint file, <path>.checkpoint by default.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over.")
+        parser.add_argument(
+            '--skip-indexes', action='store_true',
+            help="Don't index the imported items for search, run rebuild_search_index afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"No file '{path}'")
+        output = options['format'] or os.path.splitext(path.removesuffix('.gz'))[1].lstrip('.')
+        if output not in FORMATS:
+            raise CommandError(f"Unknown format of '{path}', use --format")
+        self.index = not options['skip_indexes']
+        # name -> id maps, filled as names come up
+        self.artists = {}
+        self.categories = {}
+        self.albums = {}        # (artist_id, name) -> id
+        self.counts = defaultdict(int)      # kind -> created, and updated/unchanged songs
+        self.errors = 0
+
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        fingerprint = self.fingerprint(path)
+        done = 0
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as file:
+                checkpoint = json.load(file)
+            if checkpoint['fingerprint'] != fingerprint:
+                raise CommandError(f"'{path}' changed since the checkpoint was written, use --restart")
+            done = checkpoint['rows']
+            self.stdout.write(f"Resuming after row {done}")
+
+        started = time.perf_counter()
+        imported = 0
+        with self.open(path) as file:
+            records = self.records(file, output)
+            for _ in zip(range(done), records):
+                pass
+            for batch in batched(records, options['batch_size']):
+                rows = []
+                for line, record in batch:
+                    try:
+                        rows.append(parse(record))
+                    except (TypeError, ValueError, OverflowError) as error:
+                        self.invalid(line, error)
+                with transaction.atomic():
+                    self.load(rows)
+                done += len(batch)
+                imported += len(batch)
+                self.save_checkpoint(checkpoint_path, fingerprint, done)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{done} rows ({imported / elapsed:.0f} rows/s)")
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elapsed = time.perf_counter() - started
+        counts = self.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} rows in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s): "
+            f"{counts['song']} songs created, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+            f"{counts['artist']} artists, {counts['album']} albums and {counts['category']} categories "
+            f"created, {self.errors} invalid rows skipped"
+        ))
+
+    # ---------- Input ----------
+    def open(self, path):
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding='utf-8', newline='')
+        return open(path, encoding='utf-8', newline='')
+
+    def records(self, file, output):
+        """(line, record) pairs of the input, JSONL lines that don't parse come as None."""
+        if output == 'csv':
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line, text in enumerate(file, 1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+
+    def invalid(self, line, error):
+        self.errors += 1
+        if self.errors <= MAX_ERRORS:
+            self.stderr.write(f"line {line}: {error}")
+
+    def fingerprint(self, path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    def save_checkpoint(self, path, fingerprint, rows):
+        # written aside and renamed, an interrupted write leaves the last checkpoint
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'rows': rows}, file)
+        os.replace(f'{path}.tmp', path)
+
+    # ---------- Batches ----------
+    def load(self, rows):
+        # the last row of a song wins
+        rows = list({row['audio_file']: row for row in rows}.values())
+        self.resolve_artists({name for row in rows for name in (*row['artists'], row['album_artist'])})
+        self.resolve_categories({name for row in rows for name in row['categories']})
+        self.resolve_albums(rows)
+
+        files = [row['audio_file'] for row in rows]
+        stored = {}     # audio_file -> (id, fields)
+        for pk, audio_file, *fields in Song.objects.filter(audio_file__in=files).values_list('id', 'audio_file', *FIELDS):
+            stored[audio_file] = (pk, tuple(fields))
+        stored_ids = [pk for pk, _ in stored.values()]
+        artists, categories = defaultdict(set), defaultdict(set)
+        for song_id, artist_id in Song.artist.through.objects.filter(
+                song_id__in=stored_ids).values_list('song_id', 'artist_id'):
+            artists[song_id].add(artist_id)
+        for song_id, category_id in Song.categories.through.objects.filter(
+                song_id__in=stored_ids).values_list('song_id', 'category_id'):
+            categories[song_id].add(category_id)
+
+        # redeliveries repeat most songs as they are, only the ones that differ are written
+        created, changed, relinked = [], [], []
+        for row in rows:
+            album_id = self.albums[(self.artists[row['album_artist']], row['album'])] if row['album'] else None
+            song = Song(
+                name=row['name'], audio_file=row['audio_file'], album_id=album_id, cover=row['cover'],
+                duration=row['duration'], release_date=row['release_date'], popularity=row['popularity'] or 0,
+            )
+            song.artist_ids = {self.artists[name] for name in row['artists']}
+            song.category_ids = {self.categories[name] for name in row['categories']}
+            if row['audio_file'] not in stored:
+                created.append(song)
+                continue
+            song.pk, fields = stored[row['audio_file']]
+            if tuple(getattr(song, Song._meta.get_field(field).attname) for field in FIELDS) != fields:
+                changed.append(song)
+            if song.artist_ids != artists[song.pk] or song.category_ids != categories[song.pk]:
+                relinked.append(song)
+        updated = {song.pk for song in changed + relinked}
+        # what the updated songs rendered in before, their album or artists may change
+        tags = cache.song_tags(updated)
+
+        # popularity comes from plays once a song exists, it's only imported for new ones
+        Song.objects.bulk_update(changed, FIELDS)
+        Song.objects.bulk_create(created)
+        # bulk_create sends no post_save, run process_audio_jobs to read the new files
+        audio.enqueue((song.pk, song.audio_file.name) for song in created)
+        self.counts['song'] += len(created)
+        self.counts['updated'] += len(updated)
+        self.counts['unchanged'] += len(stored) - len(updated)
+
+        relinked_ids = [song.pk for song in relinked]
+        Song.artist.through.objects.filter(song_id__in=relinked_ids).delete()
+        Song.categories.through.objects.filter(song_id__in=relinked_ids).delete()
+        Song.artist.through.objects.bulk_create([
+            Song.artist.through(song_id=song.pk, artist_id=artist_id)
+            for song in created + relinked for artist_id in song.artist_ids
+        ])
+        Song.categories.through.objects.bulk_create([
+            Song.categories.through(song_id=song.pk, category_id=category_id)
+            for song in created + relinked for category_id in song.category_ids
+        ])
+
+        song_ids = [song.pk for song in created] + list(updated)
+        if self.index:
+            search.index_items('song', song_ids)
+        tags |= cache.song_tags(song_ids)
+        transaction.on_commit(lambda: cache.bump(tags))
+
+    def resolve_artists(self, names):
+        missing = names - self.artists.keys()
+        if not missing:
+            return
+        self.artists.update(Artist.objects.filter(name__in=missing).values_list('name', 'id'))
+        new = missing - self.artists.keys()
+        if new:
+            # a concurrent writer may have added some since, the unique name keeps theirs
+            Artist.objects.bulk_create([Artist(name=name) for name in new], ignore_conflicts=True)
+            created = dict(Artist.objects.filter(name__in=new).values_list('name', 'id'))
+            self.artists.update(created)
+            self.created('artist', created.values())
+
+    def resolve_categories(self, names):
+        missing = names - self.categories.keys()
+        if not missing:
+            return
+        # names aren't unique, the oldest category of a name is the one
+        found = Category.objects.filter(name__in=missing).order_by('-id').values_list('name', 'id')
+        self.categories.update(found)
+        new = missing - self.categories.keys()
+        if new:
+            created = Category.objects.bulk_create([Category(name=name, cover='') for name in new])
+            self.categories.update((category.name, category.pk) for category in created)
+            self.created('category', [category.pk for category in created])
+
+    def resolve_albums(self, rows):
+        missing = {}
+        for row in rows:
+            key = (self.artists[row['album_artist']], row['album'])
+            if row['album'] and key not in self.albums:
+                missing.setdefault(key, []).append(row)
+        if not missing:
+            return
+        found = Album.objects.filter(
+            artist_id__in={artist_id for artist_id, _ in missing}, name__in={name for _, name in missing}
+        ).order_by('-id').values_list('artist_id', 'name', 'id')
+        self.albums.update(((artist_id, name), pk) for artist_id, name, pk in found if (artist_id, name) in missing)
+        new = [key for key in missing if key not in self.albums]
+        if not new:
+            return
+        # a new album takes the release date of its first song and the categories of all of them
+        created = Album.objects.bulk_create([
+            Album(artist_id=artist_id, name=name, cover='', release_date=missing[artist_id, name][0]['release_date'])
+            for artist_id, name in new
+        ])
+        self.albums.update(((album.artist_id, album.name), album.pk) for album in created)
+        Album.categories.through.objects.bulk_create([
+            Album.categories.through(album_id=album.pk, category_id=self.categories[name])
+            for album in created
+            for name in dict.fromkeys(name for row in missing[album.artist_id, album.name] for name in row['categories'])
+        ])
+        self.created('album', [album.pk for album in created])
+
+    def created(self, kind, ids):
+        self.counts[kind] += len(ids)
+        if self.index:
+            search.index_items(kind, ids)
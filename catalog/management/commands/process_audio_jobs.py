@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog import audio
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued audio metadata jobs, polling for new ones until stopped. Any number of "
+        "these workers can share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Files analyzed at a time, AUDIO_METADATA['WORKERS'] by default.")
+        parser.add_argument('--processes', action='store_true', help="Analyze on a process pool instead of threads.")
+        parser.add_argument('--batch-size', type=int, help="Jobs claimed at a time.")
+        parser.add_argument('--poll', type=float, default=5.0, help="Seconds between polls of an empty queue.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        with audio.make_executor(options['workers'], options['processes']) as executor:
+            while True:
+                done, failed, elapsed = audio.drain(executor, options['batch_size'])
+                if done or failed:
+                    self.stdout.write(
+                        f"{done} done, {failed} failed in {elapsed:.1f}s ({(done + failed) / elapsed:.1f} files/s)"
+                    )
+                if options['once']:
+                    break
+                connection.close()
+                time.sleep(options['poll'])
+
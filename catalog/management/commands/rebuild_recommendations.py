@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import recommender
+from catalog.models import Favorite
+
+
+class Command(BaseCommand):
+    help = "Rebuild the item-to-item recommendation index from the Favorite relations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None, help="Neighbours stored per item.")
+        parser.add_argument(
+            '--item', action='append', default=[], metavar='KIND:ID',
+            help="Only refresh the given item (e.g. song:12). Can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        if options['item']:
+            items = [self._parse_item(value) for value in options['item']]
+            recommender.update_items(items, top_k=options['top_k'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated {len(items)} item(s) in {time.perf_counter() - started:.2f}s"
+            ))
+            return
+
+        indexed = recommender.rebuild(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} item(s) in {time.perf_counter() - started:.2f}s"
+        ))
+
+    def _parse_item(self, value):
+        kind, _, item_id = value.partition(':')
+        if kind not in Favorite.KINDS or not item_id.isdigit():
+            raise CommandError(f"Invalid item '{value}', expected KIND:ID with KIND in {', '.join(Favorite.KINDS)}")
+        return kind, int(item_id)
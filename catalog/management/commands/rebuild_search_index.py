@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the catalog full-text search index."
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("The search index needs the SQLite FTS5 backend, other databases use icontains lookups.")
+
+        started = time.perf_counter()
+        total = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {total} document(s) in {time.perf_counter() - started:.2f}s"
+        ))
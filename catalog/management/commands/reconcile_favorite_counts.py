@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog import counters
+from catalog.models import Favorite
+
+
+class Command(BaseCommand):
+    help = "Recompute the favorite_count columns from the Favorite relations and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drift, don't fix it.")
+        parser.add_argument('--examples', type=int, default=5, help="Drifted rows to print per kind.")
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        total_rows = 0
+
+        with transaction.atomic():
+            for kind in Favorite.KINDS:
+                rows, drift = counters.reconcile(kind, fix=fix)
+                total_rows += len(rows)
+                self.stdout.write(f"{kind}: {len(rows)} drifted row(s), total drift {drift}")
+                for pk, stored, actual in rows[:options['examples']]:
+                    self.stdout.write(f"  {kind} {pk}: stored {stored}, actual {actual}")
+
+        if not total_rows:
+            self.stdout.write(self.style.SUCCESS("All favorite counters are consistent."))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {total_rows} row(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{total_rows} row(s) drifted, run without --dry-run to fix."))
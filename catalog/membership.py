@@ -0,0 +1,95 @@
+"""
+Batch membership checks: is this favorited, is this song in the playlist.
+
+The favorite ids of a user (per kind) and the song ids of a playlist are
+cached as sorted ``array('q')``, so checking hundreds of ids costs one
+cache read and a binary search per id. Entries remember the version of
+their tag (``favorites:<user>``, bumped on favorites_changed, and
+``playlist-songs:<playlist>``, see catalog.cache) and are rebuilt once it
+moved. Results are bit strings with one ``1``/``0`` per requested id.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import tag_versions
+from .models import Favorite, FavoriteItem, Playlist
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'CACHE_TIMEOUT': 3600,
+    'MAX_IDS': 500,             # per kind and request
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'MEMBERSHIP', {}).get(name, DEFAULTS[name])
+
+
+def favorite_tag(user_id):
+    return f'favorites:{user_id}'
+
+
+def playlist_tag(playlist_id):
+    return f'playlist-songs:{playlist_id}'
+
+
+def _cached(key, tag, build):
+    store = caches[get_setting('CACHE_ALIAS')]
+    # the stamp is read before building so a concurrent change wins
+    stamp = tag_versions([tag])[tag]
+    entry = store.get(key)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+    value = build()
+    store.set(key, (stamp, value), get_setting('CACHE_TIMEOUT'))
+    return value
+
+
+def _sorted_ids(rows, column):
+    return array('q', rows.order_by(column).values_list(column, flat=True))
+
+
+# ---------- Id sets ----------
+def favorite_ids(user_id):
+    """{kind: sorted array of item ids} of the user's favorites."""
+    def build():
+        ids = {kind: array('q') for kind in Favorite.KINDS}
+        rows = FavoriteItem.objects.filter(user_id=user_id).order_by('kind', 'item_id')
+        for kind, item_id in rows.values_list('kind', 'item_id'):
+            ids[kind].append(item_id)
+        return ids
+
+    return _cached(f'membership:favorites:{user_id}', favorite_tag(user_id), build)
+
+
+def playlist_song_ids(playlist_id):
+    """Sorted array of the song ids of the playlist."""
+    def build():
+        return _sorted_ids(Playlist.songs.through.objects.filter(playlist_id=playlist_id), 'song_id')
+
+    return _cached(f'membership:playlist:{playlist_id}', playlist_tag(playlist_id), build)
+
+
+# ---------- Checks ----------
+def parse_ids(value):
+    """Comma separated ids of a query parameter, ValueError with a message otherwise."""
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError('ids must be comma separated numbers')
+    if len(ids) > get_setting('MAX_IDS'):
+        raise ValueError(f"at most {get_setting('MAX_IDS')} ids per kind")
+    return ids
+
+
+def contains(ids, values):
+    """One '1' or '0' per value of ``values``, whether it is in the sorted array ``ids``."""
+    size = len(ids)
+    bits = []
+    for value in values:
+        index = bisect_left(ids, value)
+        bits.append('1' if index < size and ids[index] == value else '0')
+    return ''.join(bits)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_song_categories'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='favorite',
+            name='songs',
+            field=models.ManyToManyField(blank=True, related_name='favorites', to='catalog.song'),
+        ),
+        migrations.CreateModel(
+            name='ItemNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_kind', models.CharField(choices=[('song', 'Song'), ('album', 'Album'), ('artist', 'Artist'), ('playlist', 'Playlist')], max_length=10)),
+                ('item_id', models.BigIntegerField()),
+                ('neighbor_kind', models.CharField(choices=[('song', 'Song'), ('album', 'Album'), ('artist', 'Artist'), ('playlist', 'Playlist')], max_length=10)),
+                ('neighbor_id', models.BigIntegerField()),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item_kind', 'item_id', '-score'], name='catalog_ite_item_ki_552ae8_idx'), models.Index(fields=['neighbor_kind', 'neighbor_id'], name='catalog_ite_neighbo_26c3fa_idx')],
+            },
+        ),
+    ]
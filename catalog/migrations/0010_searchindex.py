@@ -0,0 +1,75 @@
+from django.db import migrations
+
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS catalog_searchindex USING fts5(
+    kind UNINDEXED,
+    item_id UNINDEXED,
+    name,
+    extra,
+    boost UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '1 2 3'
+)
+"""
+
+POPULATE_INDEX = [
+    """
+    INSERT INTO catalog_searchindex (kind, item_id, name, extra, boost)
+    SELECT 'song', s.id, s.name,
+           coalesce((SELECT group_concat(a.name, ' ') FROM catalog_song_artist sa
+                     JOIN catalog_artist a ON a.id = sa.artist_id WHERE sa.song_id = s.id), ''),
+           s.popularity
+    FROM catalog_song s
+    """,
+    """
+    INSERT INTO catalog_searchindex (kind, item_id, name, extra, boost)
+    SELECT 'artist', a.id, a.name, '',
+           (SELECT count(*) FROM catalog_favorite_artists f WHERE f.artist_id = a.id)
+    FROM catalog_artist a
+    """,
+    """
+    INSERT INTO catalog_searchindex (kind, item_id, name, extra, boost)
+    SELECT 'album', al.id, al.name, a.name,
+           (SELECT count(*) FROM catalog_favorite_albums f WHERE f.album_id = al.id)
+    FROM catalog_album al JOIN catalog_artist a ON a.id = al.artist_id
+    """,
+    """
+    INSERT INTO catalog_searchindex (kind, item_id, name, extra, boost)
+    SELECT 'playlist', p.id, p.name, '',
+           (SELECT count(*) FROM catalog_favorite_playlists f WHERE f.playlist_id = p.id)
+    FROM catalog_playlist p
+    """,
+    """
+    INSERT INTO catalog_searchindex (kind, item_id, name, extra, boost)
+    SELECT 'category', c.id, c.name, '',
+           (SELECT count(*) FROM catalog_song_categories sc WHERE sc.category_id = c.id)
+    FROM catalog_category c
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only, other backends use the icontains fallback in catalog.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    for statement in POPULATE_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS catalog_searchindex')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_itemneighbor'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_searchindex'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['-release_date', 'id'], name='catalog_alb_release_821b86_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['name', 'id'], name='catalog_cat_name_d7c2be_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['-created_at', 'id'], name='catalog_pla_created_f75af0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-popularity', 'id'], name='catalog_son_popular_f9d87d_idx'),
+        ),
+    ]
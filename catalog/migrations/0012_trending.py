@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingLandmark',
+            fields=[
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('week', 'Week')], max_length=10, primary_key=True, serialize=False)),
+                ('landmark', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('song', 'Song'), ('album', 'Album'), ('artist', 'Artist'), ('category', 'Category')], max_length=10)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('week', 'Week')], max_length=10)),
+                ('item_id', models.BigIntegerField()),
+                ('score', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'period', '-score'], name='catalog_tre_kind_b44422_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'period', 'item_id'), name='unique_trending_item')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_favorite_counts(apps, schema_editor):
+    Favorite = apps.get_model('catalog', 'Favorite')
+    for relation, model_name, column in [
+        ('songs', 'Song', 'song_id'),
+        ('albums', 'Album', 'album_id'),
+        ('artists', 'Artist', 'artist_id'),
+        ('playlists', 'Playlist', 'playlist_id'),
+    ]:
+        through = getattr(Favorite, relation).through
+        counts = (
+            through.objects.filter(**{column: OuterRef('pk')})
+            .values(column)
+            .annotate(total=Count('favorite_id'))
+            .values('total')
+        )
+        apps.get_model('catalog', model_name).objects.update(
+            favorite_count=Coalesce(Subquery(counts), Value(0))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_trending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='favorite_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='favorite_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='favorite_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='favorite_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_favorite_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# catalog.playlists.GAP when this migration was written
+GAP = 1 << 20
+BATCH_SIZE = 5000
+
+
+def number_tracks(apps, schema_editor):
+    """Position existing tracks in insertion (id) order, GAP apart."""
+    PlaylistTrack = apps.get_model('catalog', 'PlaylistTrack')
+    last_id, playlist_id, position = 0, None, 0
+    while True:
+        rows = list(
+            PlaylistTrack.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'playlist_id')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        positions = {}
+        for pk, playlist in rows:
+            positions.setdefault(playlist, []).append(pk)
+        tracks = []
+        for playlist, pks in positions.items():
+            # continue after tracks of the playlist numbered by earlier batches
+            position = PlaylistTrack.objects.filter(playlist_id=playlist, id__lt=pks[0]).count() * GAP
+            for pk in pks:
+                position += GAP
+                tracks.append(PlaylistTrack(pk=pk, position=position))
+        PlaylistTrack.objects.bulk_update(tracks, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_favorite_count'),
+    ]
+
+    operations = [
+        # the table of the auto-created through model becomes PlaylistTrack as is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PlaylistTrack',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='catalog.playlist')),
+                        ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_tracks', to='catalog.song')),
+                    ],
+                    options={
+                        'db_table': 'catalog_playlist_songs',
+                        'unique_together': {('playlist', 'song')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='playlist',
+                    name='songs',
+                    field=models.ManyToManyField(related_name='playlists', through='catalog.PlaylistTrack', to='catalog.song'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playlisttrack',
+            name='position',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_tracks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='playlisttrack',
+            index=models.Index(fields=['playlist', 'position'], name='catalog_pla_playlis_084b56_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_playlisttrack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,96 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+# favorite kind -> Favorite M2M relation being replaced
+RELATIONS = {
+    'song': 'songs',
+    'album': 'albums',
+    'artist': 'artists',
+    'playlist': 'playlists',
+}
+
+
+def _batches(queryset, columns):
+    """values_list rows in id order, BATCH_SIZE at a time."""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *columns)[:BATCH_SIZE])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def copy_favorites(apps, schema_editor):
+    Favorite = apps.get_model('catalog', 'Favorite')
+    FavoriteItem = apps.get_model('catalog', 'FavoriteItem')
+    for kind, relation in RELATIONS.items():
+        through = getattr(Favorite, relation).through
+        for rows in _batches(through.objects.all(), ('favorite__user_id', f'{kind}_id')):
+            FavoriteItem.objects.bulk_create([
+                FavoriteItem(user_id=user_id, kind=kind, item_id=item_id) for _, user_id, item_id in rows
+            ])
+
+
+def restore_favorites(apps, schema_editor):
+    Favorite = apps.get_model('catalog', 'Favorite')
+    FavoriteItem = apps.get_model('catalog', 'FavoriteItem')
+    favorite_ids = dict(Favorite.objects.values_list('user_id', 'id'))
+    missing = set(FavoriteItem.objects.exclude(user_id__in=favorite_ids).values_list('user_id', flat=True))
+    for favorite in Favorite.objects.bulk_create([Favorite(user_id=user_id) for user_id in missing]):
+        favorite_ids[favorite.user_id] = favorite.pk
+    for kind, relation in RELATIONS.items():
+        through = getattr(Favorite, relation).through
+        for rows in _batches(FavoriteItem.objects.filter(kind=kind), ('user_id', 'item_id')):
+            through.objects.bulk_create([
+                through(favorite_id=favorite_ids[user_id], **{f'{kind}_id': item_id}) for _, user_id, item_id in rows
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_favorite_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FavoriteItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('song', 'Song'), ('album', 'Album'), ('artist', 'Artist'), ('playlist', 'Playlist')], max_length=10)),
+                ('item_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorite_items', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_favorites, restore_favorites),
+        # indexes are built once the rows are in
+        migrations.AddConstraint(
+            model_name='favoriteitem',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'item_id'), name='catalog_favoriteitem_user_item'),
+        ),
+        migrations.AddIndex(
+            model_name='favoriteitem',
+            index=models.Index(fields=['kind', 'item_id', 'user'], name='catalog_favoriteitem_item_user'),
+        ),
+        migrations.RemoveField(
+            model_name='favorite',
+            name='albums',
+        ),
+        migrations.RemoveField(
+            model_name='favorite',
+            name='artists',
+        ),
+        migrations.RemoveField(
+            model_name='favorite',
+            name='playlists',
+        ),
+        migrations.RemoveField(
+            model_name='favorite',
+            name='songs',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_song_audio_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiometadatajob',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from itertools import islice
+
+from django.db import migrations
+
+
+# name lowercased by Python: SQLite's lower() only folds ASCII, the exact match of catalog.search needs str.lower
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE {table} USING fts5(
+    kind UNINDEXED,
+    item_id UNINDEXED,
+    name,
+    extra,
+    boost UNINDEXED,
+    {folded}
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '1 2 3'
+)
+"""
+
+BATCH_SIZE = 5000
+
+
+def _copy_index(schema_editor, folded):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    columns = 'kind, item_id, name, extra, boost'
+    schema_editor.execute(CREATE_INDEX.format(
+        table='catalog_searchindex_new', folded='folded UNINDEXED,' if folded else '',
+    ))
+    with schema_editor.connection.cursor() as reader, schema_editor.connection.cursor() as writer:
+        reader.execute(f'SELECT {columns} FROM catalog_searchindex')
+        rows = iter(reader.fetchone, None)
+        while batch := list(islice(rows, BATCH_SIZE)):
+            if folded:
+                writer.executemany(
+                    f'INSERT INTO catalog_searchindex_new ({columns}, folded) VALUES (%s, %s, %s, %s, %s, %s)',
+                    [(*row, row[2].lower()) for row in batch],
+                )
+            else:
+                writer.executemany(
+                    f'INSERT INTO catalog_searchindex_new ({columns}) VALUES (%s, %s, %s, %s, %s)', batch,
+                )
+    schema_editor.execute('DROP TABLE catalog_searchindex')
+    schema_editor.execute('ALTER TABLE catalog_searchindex_new RENAME TO catalog_searchindex')
+
+
+def add_folded_names(apps, schema_editor):
+    _copy_index(schema_editor, folded=True)
+
+
+def remove_folded_names(apps, schema_editor):
+    _copy_index(schema_editor, folded=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_audiometadatajob_not_before'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_folded_names, remove_folded_names),
+    ]
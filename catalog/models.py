@@ -1,6 +1,7 @@
 from contextlib import nullcontext
 from accounts.models import  User
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Category(models.Model):
@@ -8,6 +9,8 @@ class Category(models.Model):
     description = models.TextField(max_length=200, blank=True, null=True)
     cover = models.ImageField(upload_to='categories/')
 
+    class Meta:
+        indexes = [models.Index(fields=['name', 'id'])]
 
     def __str__(self):
         return self.name
@@ -18,6 +21,7 @@ class Artist(models.Model):
     bio = models.TextField(max_length=200, blank=True, null=True)
     image = models.ImageField(upload_to='artists/', blank=True, null=True)
     created_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    favorite_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -29,6 +33,10 @@ class Album(models.Model):
     cover = models.ImageField(upload_to='albums/')
     release_date = models.DateField()
     created_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    favorite_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['-release_date', 'id'])]
 
     def __str__(self):
         return self.name
@@ -46,6 +54,15 @@ class Song(models.Model):
     popularity = models.PositiveIntegerField(default=0)
     release_date = models.DateField()
     created_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    favorite_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    # read from the audio file in the background, see catalog.audio
+    bitrate = models.PositiveIntegerField(blank=True, null=True, editable=False)      # bits per second
+    sample_rate = models.PositiveIntegerField(blank=True, null=True, editable=False)  # Hz
+    loudness = models.FloatField(blank=True, null=True, editable=False)               # dBFS
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)       # sha256
+
+    class Meta:
+        indexes = [models.Index(fields=['-popularity', 'id'])]
 
     def __str__(self):
         return self.name
@@ -53,21 +70,178 @@ class Song(models.Model):
 class Playlist(models.Model):
     name = models.CharField(max_length=80)
     user = models.ForeignKey(User,related_name='playlists', on_delete=models.CASCADE)
-    songs= models.ManyToManyField(Song, related_name='playlists')
+    songs= models.ManyToManyField(Song, related_name='playlists', through='PlaylistTrack')
     cover = models.ImageField(upload_to='playlists/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    favorite_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['-created_at', 'id'])]
+
+
+class PlaylistTrack(models.Model):
+    """
+    A song of a playlist. Tracks are ordered by ``position``, gapped ranks
+    maintained by catalog.playlists so moves don't renumber the playlist.
+    """
+    playlist = models.ForeignKey(Playlist, related_name='tracks', on_delete=models.CASCADE)
+    song = models.ForeignKey(Song, related_name='playlist_tracks', on_delete=models.CASCADE)
+    position = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'catalog_playlist_songs'
+        unique_together = [('playlist', 'song')]
+        indexes = [models.Index(fields=['playlist', 'position'])]
+
+    def __str__(self):
+        return f"{self.playlist_id}:{self.position} -> {self.song_id}"
 
 
 class Favorite(models.Model):
+    """Per-user favorites state, the favorited items are FavoriteItem rows."""
+    # favorite kind -> item model
+    KINDS = {
+        'song': Song,
+        'album': Album,
+        'artist': Artist,
+        'playlist': Playlist,
+    }
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    songs = models.ManyToManyField(Song, related_name='favorites', blank=True)
-    albums = models.ManyToManyField(Album, related_name='favorited_by', blank=True)
-    playlists = models.ManyToManyField(Playlist, related_name='favorited_by', blank=True)
-    artists = models.ManyToManyField(Artist, related_name='favorited_by', blank=True)
+    # moved by every change of the favorites, see catalog.favorites
+    version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"{self.user.username}'s favorites"
 
     class Meta:
         verbose_name = "Favorite"
-        verbose_name_plural = "Favorites"
\ No newline at end of file
+        verbose_name_plural = "Favorites"
+
+
+class FavoriteItem(models.Model):
+    """One favorited item of a user, see catalog.favorites."""
+    KIND_CHOICES = [(kind, model.__name__) for kind, model in Favorite.KINDS.items()]
+
+    # the unique constraint leads with user_id, no separate index
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorite_items', db_index=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    item_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # items of a user, read from the index alone
+            models.UniqueConstraint(fields=['user', 'kind', 'item_id'], name='catalog_favoriteitem_user_item'),
+        ]
+        indexes = [
+            # users of an item
+            models.Index(fields=['kind', 'item_id', 'user'], name='catalog_favoriteitem_item_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.kind}:{self.item_id}"
+
+
+class ItemNeighbor(models.Model):
+    """Precomputed top-K neighbour of a favoritable item, see catalog.recommender."""
+    KIND_CHOICES = [
+        ('song', 'Song'),
+        ('album', 'Album'),
+        ('artist', 'Artist'),
+        ('playlist', 'Playlist'),
+    ]
+
+    item_kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    item_id = models.BigIntegerField()
+    neighbor_kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    neighbor_id = models.BigIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item_kind', 'item_id', '-score']),
+            models.Index(fields=['neighbor_kind', 'neighbor_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.item_kind}:{self.item_id} -> {self.neighbor_kind}:{self.neighbor_id}"
+
+
+class TrendingScore(models.Model):
+    """
+    Forward-decayed trending score, see catalog.trending. ``score`` is
+    stored relative to the period's landmark so rows never need rewriting
+    as time passes: ordering by it is ordering by the decayed score.
+    """
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+        ('week', 'Week'),
+    ]
+    KIND_CHOICES = [
+        ('song', 'Song'),
+        ('album', 'Album'),
+        ('artist', 'Artist'),
+        ('category', 'Category'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    item_id = models.BigIntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'period', 'item_id'], name='unique_trending_item'),
+        ]
+        indexes = [models.Index(fields=['kind', 'period', '-score'])]
+
+    def __str__(self):
+        return f"{self.kind}:{self.item_id} ({self.period})"
+
+
+class TrendingLandmark(models.Model):
+    """Time origin of the stored scores of one trending period."""
+    period = models.CharField(max_length=10, primary_key=True, choices=TrendingScore.PERIOD_CHOICES)
+    landmark = models.FloatField()
+
+    def __str__(self):
+        return f"{self.period} @ {self.landmark}"
+
+
+class AudioMetadataJob(models.Model):
+    """
+    Pending metadata extraction of a song's audio file, see catalog.audio.
+    One row per song, queued again when the song gets a new file.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    song = models.OneToOneField(Song, related_name='metadata_job', on_delete=models.CASCADE)
+    # the file the job was queued for
+    audio_file = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # the worker holding a running job
+    token = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # a failed attempt is retried from then on
+    not_before = models.DateTimeField(blank=True, null=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'queued_at'])]
+
+    def __str__(self):
+        return f"{self.song_id}: {self.status}"
@@ -0,0 +1,143 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping the microseconds of datetimes, a cursor cut to milliseconds skips rows."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a stable ordering such as (-popularity, id).
+
+    The cursor carries the ordering values of the last row of the page and
+    the next page is selected with a lexicographic comparison on them, so
+    every page costs an index range scan regardless of how deep it is.
+    The last ordering field must be unique.
+    """
+    ordering = ('id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        rows = list(queryset[:self.size + 1])
+        self.has_next = len(rows) > self.size
+        rows = rows[:self.size]
+        self.next_position = self.position(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position):
+        """Rows strictly after ``position`` in the pagination ordering."""
+        query = Q(pk__in=[])
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            query |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return query
+
+    def position(self, row):
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    def encode_cursor(self, position):
+        raw = json.dumps(position, cls=CursorEncoder, separators=(',', ':'))
+        return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PopularityPagination(KeysetPagination):
+    ordering = ('-popularity', 'id')
+
+
+class ReleaseDatePagination(KeysetPagination):
+    ordering = ('-release_date', 'id')
+
+
+class NamePagination(KeysetPagination):
+    ordering = ('name', 'id')
+
+
+class CreatedAtPagination(KeysetPagination):
+    ordering = ('-created_at', 'id')
+
+
+class IdPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class TrackPagination(KeysetPagination):
+    """Songs of a playlist annotated with their ``track_position``."""
+    ordering = ('track_position', 'id')
+
+
+def first_page(queryset, ordering):
+    """First page of a nested collection, the rest is served by the paginated endpoints."""
+    return queryset.order_by(*ordering)[:KeysetPagination.page_size]
@@ -0,0 +1,266 @@
+"""
+Playlist tracks: ordering, bulk edits and windows.
+
+Tracks (PlaylistTrack) are ordered by gapped integer ranks: appended
+tracks go GAP after the last one and a moved track takes the midpoint of
+its new neighbours, so a move writes one row. When two neighbours are
+adjacent integers, the smallest window of tracks around them (doubling
+from 16) whose bounds leave at least SPACING per track is spread evenly,
+so even repeated moves into the same spot only rewrite a few rows.
+
+Bulk operations check the requested ids with one IN query, diff them
+against the playlist with one more and write the tracks with a single
+bulk_create, bulk_update or delete, inside one transaction. m2m_changed
+is sent the way ``playlist.songs.add()``/``remove()`` send it so caches
+and membership sets follow. Results carry a status per requested id, in
+request order.
+"""
+from django.db import router, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import m2m_changed
+
+from .models import PlaylistTrack, Song
+from .utils import MAX_ID
+
+GAP = 1 << 20
+SPACING = 1 << 10       # smallest gap left by a local renumbering
+MAX_SONGS = 10000       # ids per request
+MAX_WINDOW = 500        # tracks per window
+
+ADDED = 'added'
+REMOVED = 'removed'
+PRESENT = 'already_present'
+ABSENT = 'not_in_playlist'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+
+def parse(values):
+    """
+    [(value, song_id, error)] for the ``song_ids`` of a request, error is
+    INVALID or DUPLICATE (and song_id None) for values that are skipped.
+    ValueError for a malformed request.
+    """
+    if not isinstance(values, list):
+        raise ValueError('song_ids must be a list of song ids')
+    if len(values) > MAX_SONGS:
+        raise ValueError(f'at most {MAX_SONGS} song ids per request')
+    seen = set()
+    parsed = []
+    for value in values:
+        try:
+            song_id = None if isinstance(value, bool) else int(value)
+        except (TypeError, ValueError):
+            song_id = None
+        if song_id is None or abs(song_id) > MAX_ID:
+            parsed.append((value, None, INVALID))
+        elif song_id in seen:
+            parsed.append((value, None, DUPLICATE))
+        else:
+            seen.add(song_id)
+            parsed.append((value, song_id, None))
+    return parsed
+
+
+def _ids(parsed):
+    return [song_id for _, song_id, error in parsed if error is None]
+
+
+def _results(parsed, statuses):
+    return [{'id': value, 'status': error or statuses[song_id]} for value, song_id, error in parsed]
+
+
+def _existing(song_ids):
+    return set(Song.objects.filter(pk__in=song_ids).values_list('pk', flat=True))
+
+
+def _tracks(playlist):
+    return PlaylistTrack.objects.filter(playlist_id=playlist.pk)
+
+
+def _current(playlist, song_ids=None):
+    rows = _tracks(playlist)
+    if song_ids is not None:
+        rows = rows.filter(song_id__in=song_ids)
+    return dict(rows.values_list('song_id', 'id'))
+
+
+def _changed(playlist, action, song_ids):
+    m2m_changed.send(
+        sender=PlaylistTrack, instance=playlist, action=action, reverse=False, model=Song,
+        pk_set=set(song_ids), using=router.db_for_write(PlaylistTrack, instance=playlist),
+    )
+
+
+def tracks_changed(playlist, added, removed):
+    """Send m2m_changed for tracks written directly (the admin inline), after the fact."""
+    if added:
+        _changed(playlist, 'post_add', added)
+    if removed:
+        _changed(playlist, 'post_remove', removed)
+
+
+def _add(playlist, song_ids, positions=None):
+    """Insert tracks at ``positions``, after the last track by default."""
+    if song_ids:
+        if positions is None:
+            last = _tracks(playlist).aggregate(last=Max('position'))['last'] or 0
+            positions = range(last + GAP, last + GAP * (len(song_ids) + 1), GAP)
+        _changed(playlist, 'pre_add', song_ids)
+        PlaylistTrack.objects.bulk_create([
+            PlaylistTrack(playlist_id=playlist.pk, song_id=pk, position=position)
+            for pk, position in zip(song_ids, positions)
+        ])
+        _changed(playlist, 'post_add', song_ids)
+
+
+def _remove(playlist, song_ids):
+    if song_ids:
+        _changed(playlist, 'pre_remove', song_ids)
+        _tracks(playlist).filter(song_id__in=song_ids).delete()
+        _changed(playlist, 'post_remove', song_ids)
+
+
+# ---------- Operations ----------
+@transaction.atomic
+def add_songs(playlist, values):
+    parsed = parse(values)
+    ids = _ids(parsed)
+    existing = _existing(ids)
+    present = _current(playlist, existing)
+    added = [pk for pk in ids if pk in existing and pk not in present]
+    _add(playlist, added)
+
+    statuses = {pk: NOT_FOUND if pk not in existing else PRESENT if pk in present else ADDED for pk in ids}
+    return {'added': len(added), 'results': _results(parsed, statuses)}
+
+
+@transaction.atomic
+def remove_songs(playlist, values):
+    parsed = parse(values)
+    ids = _ids(parsed)
+    present = _current(playlist, ids)
+    _remove(playlist, [pk for pk in ids if pk in present])
+
+    statuses = {pk: REMOVED if pk in present else ABSENT for pk in ids}
+    return {'removed': len(present), 'results': _results(parsed, statuses)}
+
+
+@transaction.atomic
+def set_songs(playlist, values):
+    """Make the playlist hold exactly the requested songs that exist, in that order."""
+    parsed = parse(values)
+    ids = _ids(parsed)
+    existing = _existing(ids)
+    current = _current(playlist)
+    removed = sorted(current.keys() - existing)
+    _remove(playlist, removed)
+
+    wanted = [pk for pk in ids if pk in existing]
+    positions = {pk: GAP * (index + 1) for index, pk in enumerate(wanted)}
+    PlaylistTrack.objects.bulk_update([
+        PlaylistTrack(pk=current[pk], position=positions[pk]) for pk in wanted if pk in current
+    ], ['position'], batch_size=1000)
+    added = [pk for pk in wanted if pk not in current]
+    _add(playlist, added, [positions[pk] for pk in added])
+
+    statuses = {pk: NOT_FOUND if pk not in existing else PRESENT if pk in current else ADDED for pk in ids}
+    return {'added': len(added), 'removed': len(removed), 'results': _results(parsed, statuses)}
+
+
+# ---------- Ordering ----------
+def rebalance(playlist):
+    """Renumber all tracks GAP apart, keeping their order."""
+    ids = _tracks(playlist).order_by('position', 'id').values_list('id', flat=True)
+    PlaylistTrack.objects.bulk_update([
+        PlaylistTrack(pk=pk, position=GAP * (index + 1)) for index, pk in enumerate(ids)
+    ], ['position'], batch_size=1000)
+
+
+def _spread(playlist, center, exclude):
+    """Make room around ``center``, see the module docstring."""
+    others = _tracks(playlist).exclude(pk=exclude)
+    size = 16
+    while True:
+        lower = list(others.filter(position__lte=center).order_by('-position', '-id')[:size + 1])
+        upper = list(others.filter(position__gt=center).order_by('position', 'id')[:size + 1])
+        # the tracks just outside the window bound it and keep their positions
+        low = lower.pop().position if len(lower) > size else None
+        high = upper.pop().position if len(upper) > size else None
+        tracks = lower[::-1] + upper
+        if low is None and high is None:
+            rebalance(playlist)
+            return
+        if low is None:
+            positions = [high - GAP * (len(tracks) - index) for index in range(len(tracks))]
+        elif high is None:
+            positions = [low + GAP * (index + 1) for index in range(len(tracks))]
+        else:
+            step = (high - low) // (len(tracks) + 1)
+            if step < SPACING:
+                size *= 2
+                continue
+            positions = [low + step * (index + 1) for index in range(len(tracks))]
+        for track, position in zip(tracks, positions):
+            track.position = position
+        PlaylistTrack.objects.bulk_update(tracks, ['position'])
+        return
+
+
+def _between(low, high):
+    """A position strictly between two neighbours (None for an open end), None if there is no room."""
+    if low is None and high is None:
+        return GAP
+    if low is None:
+        return high - GAP
+    if high is None:
+        return low + GAP
+    if high - low > 1:
+        return (low + high) // 2
+    return None
+
+
+def _neighbours(playlist, track, anchor_id, before):
+    """Positions around the slot after (or ``before``) the track of song ``anchor_id``, None for an end."""
+    others = _tracks(playlist).exclude(pk=track.pk)
+    if anchor_id is None:
+        # after nothing is the start, before nothing the end
+        edge = others.order_by(*(('-position', '-id') if before else ('position', 'id'))).first()
+        position = edge.position if edge is not None else None
+        return (position, None) if before else (None, position)
+
+    anchor = others.filter(song_id=anchor_id).first()
+    if anchor is None:
+        raise ValueError('Anchor song is not in the playlist')
+    if before:
+        earlier = Q(position__lt=anchor.position) | Q(position=anchor.position, id__lt=anchor.pk)
+        previous = others.filter(earlier).order_by('-position', '-id').first()
+        return (previous.position if previous is not None else None), anchor.position
+    later = Q(position__gt=anchor.position) | Q(position=anchor.position, id__gt=anchor.pk)
+    following = others.filter(later).order_by('position', 'id').first()
+    return anchor.position, (following.position if following is not None else None)
+
+
+@transaction.atomic
+def move(playlist, song_id, anchor_id, before=False):
+    """
+    Move the track of ``song_id`` right after the track of ``anchor_id``
+    (to the start when None), or right before it with ``before`` (to the
+    end when None). ValueError when either song is not in the playlist.
+    """
+    track = _tracks(playlist).select_for_update().filter(song_id=song_id).first()
+    if track is None:
+        raise ValueError('Song is not in the playlist')
+    low, high = _neighbours(playlist, track, anchor_id, before)
+    position = _between(low, high)
+    if position is None:
+        _spread(playlist, low, track.pk)
+        position = _between(*_neighbours(playlist, track, anchor_id, before))
+    track.position = position
+    track.save(update_fields=['position'])
+    return track
+
+
+def window(playlist, offset, limit):
+    """Song ids of tracks [offset, offset + limit) in playlist order, read off the (playlist, position) index."""
+    return list(_tracks(playlist).order_by('position', 'id').values_list('song_id', flat=True)[offset:offset + limit])
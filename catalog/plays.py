@@ -0,0 +1,191 @@
+"""
+Write-behind ingestion of play events.
+
+Plays are counted per song in an in-process buffer and a background thread
+flushes them every few seconds: each batch of songs becomes a single
+``UPDATE ... SET popularity = popularity + CASE id ...`` statement, so a
+burst of plays on a hot song costs one row update per flush instead of one
+per play. The buffer holds at most MAX_PENDING_SONGS distinct songs, once
+full the recording request flushes synchronously. Pending plays are
+flushed at interpreter shutdown.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from .models import Song
+from .signals import plays_flushed
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 5.0,        # seconds, 0 flushes on every play
+    'MAX_PENDING_SONGS': 10000,
+    'BATCH_SIZE': 500,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'PLAY_BUFFER', {}).get(name, DEFAULTS[name])
+
+
+class PlayBuffer:
+
+    def __init__(self, flush_interval, max_pending_songs, batch_size):
+        self.flush_interval = flush_interval
+        self.max_pending_songs = max_pending_songs
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = Counter()
+        self._stop = threading.Event()
+        self._worker = None
+
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_plays = 0
+        self.dropped_plays = 0
+        self.last_flush_duration = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            flush_interval=get_setting('FLUSH_INTERVAL'),
+            max_pending_songs=get_setting('MAX_PENDING_SONGS'),
+            batch_size=get_setting('BATCH_SIZE'),
+        )
+
+    # ---------- Recording ----------
+    def record(self, song_id, count=1):
+        with self._lock:
+            self._pending[song_id] += count
+            full = len(self._pending) >= self.max_pending_songs
+
+        if full or not self.flush_interval:
+            self.flush()
+        else:
+            self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='play-buffer', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            # the worker thread owns its own connection, don't keep it idle
+            connection.close()
+
+    # ---------- Flushing ----------
+    def flush(self):
+        """Write the pending plays, returns the number of plays flushed."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+            if not pending:
+                return 0
+
+            started = time.perf_counter()
+            items = iter(pending.items())
+            flushed = 0
+            while batch := list(islice(items, self.batch_size)):
+                try:
+                    self._apply(batch)
+                except Exception:
+                    # not only DatabaseError, drivers raise OverflowError and the like too
+                    self.failed_flushes += 1
+                    logger.exception("Flushing %d pending song plays failed", len(pending))
+                    self._restore([*batch, *items])
+                    break
+                flushed += sum(count for _, count in batch)
+                self._notify(batch)
+            else:
+                self.flushes += 1
+
+            self.flushed_plays += flushed
+            self.last_flush_duration = time.perf_counter() - started
+            return flushed
+
+    def _apply(self, batch):
+        increment = Case(
+            *(When(pk=song_id, then=Value(count)) for song_id, count in batch),
+            default=Value(0),
+            output_field=PositiveIntegerField(),
+        )
+        Song.objects.filter(pk__in=[song_id for song_id, _ in batch]).update(
+            popularity=F('popularity') + increment
+        )
+
+    def _notify(self, batch):
+        # the plays are already written, listeners must not fail the flush
+        for receiver, result in plays_flushed.send_robust(sender=type(self), counts=batch):
+            if isinstance(result, Exception):
+                logger.error("plays_flushed receiver %r failed", receiver, exc_info=result)
+
+    def _restore(self, items):
+        # keep unwritten plays for the next flush as long as the buffer has room
+        with self._lock:
+            for song_id, count in items:
+                if song_id in self._pending or len(self._pending) < self.max_pending_songs:
+                    self._pending[song_id] += count
+                else:
+                    self.dropped_plays += count
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+    # ---------- Metrics ----------
+    def stats(self):
+        with self._lock:
+            pending_songs = len(self._pending)
+            pending_plays = sum(self._pending.values())
+        return {
+            'pending_songs': pending_songs,
+            'pending_plays': pending_plays,
+            'max_pending_songs': self.max_pending_songs,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'flushed_plays': self.flushed_plays,
+            'dropped_plays': self.dropped_plays,
+            'last_flush_duration': self.last_flush_duration,
+        }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_play_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = PlayBuffer.from_settings()
+                atexit.register(_buffer.shutdown)
+    return _buffer
+
+
+
+def collect_metrics():
+    """Play buffer samples for vexify.metrics."""
+    counters = {'flushes', 'failed_flushes', 'flushed_plays', 'dropped_plays'}
+    samples = []
+    for name, value in get_play_buffer().stats().items():
+        if name in counters:
+            samples.append((f'vexify_play_buffer_{name}_total', 'counter', f'Play buffer {name}.', [({}, value)]))
+        else:
+            samples.append((f'vexify_play_buffer_{name}', 'gauge', f'Play buffer {name}.', [({}, value)]))
+    return samples
@@ -0,0 +1,353 @@
+"""
+Item-to-item recommendation engine.
+
+The FavoriteItem rows are read into a sparse co-occurrence matrix (one
+Counter row per item) where every favoritable item is keyed as
+``(kind, id)``, REBUILD_ITEMS rows at a time from the baskets of the users
+of those items. Each row is normalised with cosine similarity and only the
+top-K neighbours are stored in ``ItemNeighbor``. At request time the
+neighbour lists of the user's favorites are merged in memory, so the cost
+no longer depends on how many users share a favorite.
+
+Items whose favorites changed are refreshed by a background thread every
+UPDATE_INTERVAL seconds, once however many requests changed them since.
+
+Rendered recommendations are cached per user (one shared entry for
+anonymous users) in a bounded cache, stamped with the ``favorites:<user>``
+and ``recommendations`` tags of catalog.cache: they are dropped when the
+user's favorites change or the index is rebuilt.
+"""
+import hashlib
+import heapq
+import logging
+import math
+import threading
+from collections import Counter, defaultdict
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count, Exists, Min, OuterRef, Q
+
+from .cache import bump, tag_versions
+from .models import Favorite, FavoriteItem, ItemNeighbor
+from .utils import batched
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TOP_K': 50,           # neighbours stored per item
+    'MAX_RESULTS': 50,     # recommendations returned per kind
+    'INCREMENTAL': True,   # refresh neighbour lists when favorites change
+    'UPDATE_INTERVAL': 10.0,  # seconds between refreshes of changed items, 0 refreshes on commit
+    'REBUILD_ITEMS': 10000,   # co-occurrence rows held in memory by a rebuild
+    'BATCH_SIZE': 1000,
+    'CACHE_ALIAS': 'recommendations',
+    'CACHE_TIMEOUT': 600,  # bounds staleness from incremental updates and popularity
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'RECOMMENDER', {}).get(name, DEFAULTS[name])
+
+
+# ---------- Full rebuild ----------
+def item_counts():
+    """Return {(kind, item_id): users} for every favorited item."""
+    rows = FavoriteItem.objects.values('kind', 'item_id').annotate(n=Count('user_id'))
+    return {(kind, item_id): n for kind, item_id, n in rows.values_list('kind', 'item_id', 'n')}
+
+
+def item_ranges(items, size):
+    """Split items into (kind, low, high) ranges of at most ``size`` items."""
+    by_kind = defaultdict(list)
+    for kind, item_id in items:
+        by_kind[kind].append(item_id)
+    for kind, ids in by_kind.items():
+        for chunk in batched(sorted(ids), size):
+            yield kind, chunk[0], chunk[-1]
+
+
+def build_cooccurrence(kind, low, high, chunk_size=5000):
+    """Sparse co-occurrence rows of the items of a range, one basket in memory at a time."""
+    users = FavoriteItem.objects.filter(kind=kind, item_id__range=(low, high)).values('user_id')
+    baskets = (
+        FavoriteItem.objects.filter(user_id__in=users)
+        .order_by('user_id')
+        .values_list('user_id', 'kind', 'item_id')
+    )
+    rows = defaultdict(Counter)
+    for _, basket in groupby(baskets.iterator(chunk_size=chunk_size), key=itemgetter(0)):
+        items = [(other_kind, item_id) for _, other_kind, item_id in basket]
+        for item in items:
+            if item[0] == kind and low <= item[1] <= high:
+                rows[item].update(other for other in items if other != item)
+    return rows
+
+
+def top_neighbors(item, row, counts, top_k):
+    scored = (
+        (other, together / math.sqrt(counts[item] * counts[other]))
+        for other, together in row.items()
+    )
+    return heapq.nlargest(top_k, scored, key=itemgetter(1))
+
+
+def _neighbor_objects(item, neighbors):
+    for (kind, item_id), score in neighbors:
+        yield ItemNeighbor(
+            item_kind=item[0], item_id=item[1],
+            neighbor_kind=kind, neighbor_id=item_id,
+            score=score,
+        )
+
+
+def _bulk_insert(objects):
+    batch_size = get_setting('BATCH_SIZE')
+    objects = iter(objects)
+    while batch := list(islice(objects, batch_size)):
+        ItemNeighbor.objects.bulk_create(batch)
+
+
+def rebuild(top_k=None):
+    """Recompute every neighbour list from scratch. Returns the number of items indexed."""
+    top_k = top_k or get_setting('TOP_K')
+    counts = item_counts()
+    indexed = 0
+
+    with transaction.atomic():
+        ItemNeighbor.objects.all().delete()
+        for kind, low, high in item_ranges(counts, get_setting('REBUILD_ITEMS')):
+            rows = build_cooccurrence(kind, low, high)
+            _bulk_insert(
+                neighbor
+                for item, row in rows.items()
+                for neighbor in _neighbor_objects(item, top_neighbors(item, row, counts, top_k))
+            )
+            indexed += len(rows)
+    bump(['recommendations'])
+    return indexed
+
+
+# ---------- Incremental update ----------
+def _item_row(item):
+    """Co-occurrence row and user counts for a single item, computed in the database."""
+    kind, item_id = item
+    user_ids = FavoriteItem.objects.filter(kind=kind, item_id=item_id).values('user_id')
+    together = FavoriteItem.objects.filter(user_id__in=user_ids)
+
+    row, counts = Counter(), Counter()
+    pairs = together.values('kind', 'item_id').annotate(n=Count('user_id'))
+    for other_kind, other_id, n in pairs.values_list('kind', 'item_id', 'n'):
+        row[(other_kind, other_id)] = n
+
+    # users of every item in the row, read off the (kind, item_id, user) index
+    shared = together.filter(kind=OuterRef('kind'), item_id=OuterRef('item_id'))
+    totals = FavoriteItem.objects.filter(Exists(shared)).values('kind', 'item_id').annotate(n=Count('user_id'))
+    for other_kind, other_id, n in totals.values_list('kind', 'item_id', 'n'):
+        counts[(other_kind, other_id)] = n
+
+    # an item always co-occurs with itself once per user
+    row.pop(item, None)
+    return row, counts
+
+
+def _items_filter(items):
+    by_kind = defaultdict(set)
+    for kind, item_id in items:
+        by_kind[kind].add(item_id)
+    query = Q(pk__in=[])
+    for kind, ids in by_kind.items():
+        query |= Q(item_kind=kind, item_id__in=ids)
+    return query
+
+
+def update_item(item, top_k=None):
+    """
+    Refresh the neighbour list of one item and patch its score into the
+    lists of the items it co-occurs with. Lists that would only change
+    through truncation are left to the next full rebuild.
+    """
+    top_k = top_k or get_setting('TOP_K')
+    kind, item_id = item
+    row, counts = _item_row(item)
+    neighbors = top_neighbors(item, row, counts, top_k) if row else []
+
+    with transaction.atomic():
+        ItemNeighbor.objects.filter(item_kind=kind, item_id=item_id).delete()
+        ItemNeighbor.objects.filter(neighbor_kind=kind, neighbor_id=item_id).delete()
+        _bulk_insert(_neighbor_objects(item, neighbors))
+
+        # symmetric scores: insert this item into the neighbours' lists
+        scores = dict(top_neighbors(item, row, counts, len(row))) if row else {}
+        if not scores:
+            return
+        current = {
+            (k, i): (size, low)
+            for k, i, size, low in ItemNeighbor.objects.filter(_items_filter(scores))
+            .values('item_kind', 'item_id')
+            .annotate(size=Count('id'), low=Min('score'))
+            .values_list('item_kind', 'item_id', 'size', 'low')
+        }
+
+        inserts = []
+        for other, score in scores.items():
+            size, low = current.get(other, (0, 0.0))
+            if size < top_k:
+                inserts.append((other, score))
+            elif score > low:
+                # replace the weakest neighbour of a full list
+                weakest = ItemNeighbor.objects.filter(
+                    item_kind=other[0], item_id=other[1], score=low
+                ).values_list('pk', flat=True).first()
+                ItemNeighbor.objects.filter(pk=weakest).delete()
+                inserts.append((other, score))
+
+        _bulk_insert(
+            ItemNeighbor(
+                item_kind=other[0], item_id=other[1],
+                neighbor_kind=kind, neighbor_id=item_id,
+                score=score,
+            )
+            for other, score in inserts
+        )
+
+
+def update_items(items, top_k=None):
+    for item in items:
+        update_item(item, top_k=top_k)
+
+
+# ---------- Queued updates ----------
+class UpdateQueue:
+    """
+    Items waiting for update_item. A background thread refreshes them every
+    ``interval`` seconds, items still queued at exit are left to the next
+    rebuild.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = set()
+        self._stop = threading.Event()
+        self._worker = None
+
+    def add(self, items):
+        with self._lock:
+            self._pending.update(items)
+        if self.interval:
+            self._ensure_worker()
+        else:
+            self.flush()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='recommender-updates', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+            connection.close()
+
+    def flush(self):
+        """Refresh the queued items, returns how many were."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for item in pending:
+                try:
+                    update_item(item)
+                except Exception:
+                    # left to the next change of the item or the next rebuild
+                    logger.exception("Updating the neighbours of %s:%s failed", *item)
+            return len(pending)
+
+    def shutdown(self):
+        self._stop.set()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_update_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = UpdateQueue(get_setting('UPDATE_INTERVAL'))
+    return _queue
+
+
+# ---------- Serving ----------
+def user_favorites(user):
+    """Return {kind: set(ids)} of everything the user has favorited."""
+    favorites = {kind: set() for kind in Favorite.KINDS}
+    for kind, item_id in FavoriteItem.objects.filter(user_id=user.pk).values_list('kind', 'item_id'):
+        favorites[kind].add(item_id)
+    return favorites
+
+
+def recommend(favorites, limit=None):
+    """
+    Merge the neighbour lists of the given favorites.
+    Returns {kind: [ids ordered by score]} excluding already favorited items.
+    """
+    limit = limit or get_setting('MAX_RESULTS')
+    favorites = {kind: favorites.get(kind) or set() for kind in Favorite.KINDS}
+    items = [(kind, item_id) for kind, ids in favorites.items() for item_id in ids]
+    scores = {kind: defaultdict(float) for kind in Favorite.KINDS}
+
+    if items:
+        rows = ItemNeighbor.objects.filter(_items_filter(items)).values_list(
+            'neighbor_kind', 'neighbor_id', 'score'
+        )
+        for kind, item_id, score in rows:
+            if item_id not in favorites[kind]:
+                scores[kind][item_id] += score
+
+    return {
+        kind: [item_id for item_id, _ in heapq.nlargest(
+            limit, scored.items(), key=lambda pair: (pair[1], -pair[0])
+        )]
+        for kind, scored in scores.items()
+    }
+
+
+
+# ---------- Result cache ----------
+def _cache_tags(user):
+    return ['recommendations', f'favorites:{user.pk}'] if user else ['recommendations']
+
+
+def cached(user, build, variant=None, origin=''):
+    """
+    Return build() for the user (None for anonymous), cached until its stamp changes.
+    ``variant`` tells apart differently shaped payloads of the same user and
+    ``origin`` (scheme://host) the absolute URLs rendered into them.
+    """
+    store = caches[get_setting('CACHE_ALIAS')]
+    key = f'recommendations:{user.pk if user else "anonymous"}'
+    if variant is not None or origin:
+        key += ':' + hashlib.md5(repr((variant, origin)).encode()).hexdigest()
+    # the stamp is read before building so a concurrent change wins
+    stamp = tag_versions(_cache_tags(user))
+
+    entry = store.get(key)
+    if entry is not None and entry['stamp'] == stamp:
+        return entry['data']
+    data = build()
+    store.set(key, {'stamp': stamp, 'data': data}, get_setting('CACHE_TIMEOUT'))
+    return data
+
+
+def invalidate_users(user_ids):
+    bump([f'favorites:{user_id}' for user_id in user_ids])
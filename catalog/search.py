@@ -0,0 +1,204 @@
+"""
+Catalog search index.
+
+On SQLite the names of songs, albums, artists, playlists and categories are
+kept in an FTS5 table (``catalog_searchindex``) maintained from model
+signals, song boosts (their popularity) also after every flush of played
+songs. A query is turned into ranked prefix matches and one pass over the
+index returns the best hits of every kind together with the top result.
+Other database backends fall back to ``icontains`` lookups.
+"""
+import re
+from itertools import islice
+
+from django.db import connection
+from django.db.models import Count, Q
+
+from .models import Category, Artist, Song, Album, Playlist
+
+TABLE = 'catalog_searchindex'
+
+# kind -> model, in top result priority order
+MODELS = {
+    'song': Song,
+    'artist': Artist,
+    'album': Album,
+    'playlist': Playlist,
+    'category': Category,
+}
+
+LIMITS = {
+    'song': 20,
+    'artist': 10,
+    'album': 10,
+    'playlist': 10,
+    'category': 10,
+}
+
+# bm25 weights of the name and extra (artist names) columns
+NAME_WEIGHT = 10.0
+EXTRA_WEIGHT = 2.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+BATCH_SIZE = 5000
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(q):
+    """'daft pu' -> '"daft"* "pu"*' (every token as a prefix, all required)."""
+    tokens = TOKEN_RE.findall(q.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+# ---------- Indexing ----------
+def _documents(kind, ids=None):
+    """Yield (kind, item_id, name, extra, boost) rows for the given kind."""
+    model = MODELS[kind]
+    queryset = model.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+
+    if kind == 'song':
+        songs = queryset.values_list('id', 'name', 'popularity')
+        artists = {}
+        for song_id, artist_name in Song.artist.through.objects.filter(
+            song_id__in=queryset.values('id')
+        ).values_list('song_id', 'artist__name'):
+            artists.setdefault(song_id, []).append(artist_name)
+        for song_id, name, popularity in songs.iterator():
+            yield kind, song_id, name, ' '.join(artists.get(song_id, [])), popularity
+        return
+
+    if kind == 'category':
+        rows = queryset.annotate(boost=Count('songs')).values_list('id', 'name', 'boost')
+        for item_id, name, boost in rows.iterator():
+            yield kind, item_id, name, '', boost
+        return
+
+    if kind == 'album':
+        rows = queryset.values_list('id', 'name', 'artist__name', 'favorite_count')
+        for item_id, name, artist_name, boost in rows.iterator():
+            yield kind, item_id, name, artist_name, boost
+        return
+
+    rows = queryset.values_list('id', 'name', 'favorite_count')
+    for item_id, name, boost in rows.iterator():
+        yield kind, item_id, name, '', boost
+
+
+def _insert(cursor, documents):
+    """Insert documents in batches, returns how many were inserted."""
+    documents = iter(documents)
+    total = 0
+    while batch := list(islice(documents, BATCH_SIZE)):
+        # folded is the name lowercased here, SQLite's lower() only folds ASCII
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (kind, item_id, name, extra, boost, folded) VALUES (%s, %s, %s, %s, %s, %s)',
+            [(*document, document[2].lower()) for document in batch],
+        )
+        total += len(batch)
+    return total
+
+
+def remove_items(kind, ids):
+    if not is_available() or not ids:
+        return
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f'DELETE FROM {TABLE} WHERE kind = %s AND item_id IN ({placeholders})', [kind, *ids])
+
+
+def index_items(kind, ids):
+    """(Re)index the given items of one kind."""
+    if not is_available() or not ids:
+        return
+    ids = list(ids)
+    remove_items(kind, ids)
+    with connection.cursor() as cursor:
+        _insert(cursor, _documents(kind, ids))
+
+
+def rebuild():
+    """Recreate the whole index. Returns the number of indexed documents."""
+    if not is_available():
+        return 0
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        for kind in MODELS:
+            total += _insert(cursor, _documents(kind))
+    return total
+
+
+# ---------- Searching ----------
+def _search_index(q):
+    match = match_expression(q)
+    if not match:
+        return []
+
+    limit_cases = ' '.join(f"WHEN '{kind}' THEN {limit}" for kind, limit in LIMITS.items())
+    priority_cases = ' '.join(f"WHEN '{kind}' THEN {priority}" for priority, kind in enumerate(MODELS))
+    sql = f'''
+        WITH matches AS (
+            SELECT kind, item_id, folded = %s AS exact,
+                   bm25({TABLE}, 0, 0, {NAME_WEIGHT}, {EXTRA_WEIGHT}, 0) AS rank, boost
+            FROM {TABLE}
+            WHERE {TABLE} MATCH %s
+        ),
+        ranked AS (
+            SELECT kind, item_id, exact, rank,
+                   row_number() OVER (PARTITION BY kind ORDER BY exact DESC, rank, boost DESC) AS position
+            FROM matches
+        )
+        SELECT kind, item_id, exact, position
+        FROM ranked
+        WHERE position <= CASE kind {limit_cases} END
+        ORDER BY CASE kind {priority_cases} END, position
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [q, match])
+        return cursor.fetchall()
+
+
+def _search_fallback(q):
+    if not q:
+        return []
+    querysets = {
+        'song': Song.objects.filter(Q(name__icontains=q) | Q(artist__name__icontains=q))
+        .order_by('-popularity').distinct(),
+        'artist': Artist.objects.filter(name__icontains=q).order_by('-favorite_count'),
+        'album': Album.objects.filter(Q(name__icontains=q) | Q(artist__name__icontains=q)).order_by('-favorite_count'),
+        'playlist': Playlist.objects.filter(name__icontains=q).order_by('-favorite_count'),
+        'category': Category.objects.filter(name__icontains=q).annotate(score=Count('songs')).order_by('-score'),
+    }
+    rows = []
+    for kind, queryset in querysets.items():
+        for position, (item_id, name) in enumerate(queryset.values_list('id', 'name')[:LIMITS[kind]], start=1):
+            rows.append((kind, item_id, name.lower() == q, position))
+    return rows
+
+
+def search(q):
+    """
+    Return ({kind: [ids in rank order]}, top) where top is the (kind, id)
+    of the top result or None.
+    """
+    q = (q or '').strip().lower()
+    rows = _search_index(q) if is_available() else _search_fallback(q)
+
+    results = {kind: [] for kind in MODELS}
+    top = None
+    for kind, item_id, exact, position in rows:
+        results[kind].append(item_id)
+        # rows come in priority order: the first exact name match wins,
+        # otherwise the best hit of the first kind that has any
+        if exact and (top is None or not top[2]):
+            top = (kind, item_id, True)
+        elif top is None:
+            top = (kind, item_id, False)
+    return results, top[:2] if top else None
@@ -1,61 +1,70 @@
 from rest_framework import serializers
 from accounts.serializers import UserSerializer
+from . import membership
+from .compiled import render_in_order
 from .models import Category, Artist, Song, Album, Playlist, Favorite
+from .eager import NestedList, NestedPage, prefetched
+from .pagination import first_page
+from .sparse import SparseFieldsMixin
 # Lightweight Song for artist page
-class SongLightSerializer(serializers.ModelSerializer):
+class SongLightSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     categories = serializers.StringRelatedField(many=True)
     class Meta:
         model = Song
         fields = ['id', 'name', 'duration', 'popularity','cover','categories']
 
 # Lightweight Album for artist page
-class AlbumLightSerializer(serializers.ModelSerializer):
+class AlbumLightSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Album
         fields = ['id', 'name', 'cover']
 
 
-class ArtistLightSerializer(serializers.ModelSerializer):
+class ArtistLightSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Artist
         fields = ['id', 'name', 'image','bio']
 
-class PlaylistLightSerializer(serializers.ModelSerializer):
+class PlaylistLightSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Playlist
         fields = ['id', 'name', 'cover']
 
 
 # ---------- CATEGORY ----------
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'cover']
 
 
 # ---------- ARTIST ----------
-class ArtistSerializer(serializers.ModelSerializer):
+class ArtistSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     top_songs = serializers.SerializerMethodField()
     albums = serializers.SerializerMethodField()
 
     class Meta:
         model = Artist
         fields = ['id', 'name', 'bio','image', 'top_songs', 'albums']
+        prefetch_related = {
+            'top_songs': NestedPage('songs', SongLightSerializer, ('-popularity', 'id'), to_attr='top_songs_page'),
+            'albums': NestedList('albums', AlbumLightSerializer, ('id',), to_attr='albums_list'),
+        }
 
 
     def get_top_songs(self, obj):
-        songs = obj.songs.order_by('-popularity')
-        return SongLightSerializer(songs, many=True, context=self.context).data
+        songs = prefetched(obj, 'top_songs_page', first_page(obj.songs.all(), ('-popularity', 'id')))
+        return SongLightSerializer(songs, many=True, context=self.nested_context('top_songs')).data
 
     def get_albums(self, obj):
-        albums = obj.albums.all()
-        return AlbumLightSerializer(albums, many=True, context=self.context).data
+        albums = prefetched(obj, 'albums_list', obj.albums.order_by('id'))
+        return AlbumLightSerializer(albums, many=True, context=self.nested_context('albums')).data
 
 
 
 
 # ---------- ALBUM ----------
-class AlbumSerializer(serializers.ModelSerializer):
+class AlbumSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     categories = serializers.StringRelatedField(many=True,read_only=True)
     songs = serializers.SerializerMethodField()
     artist = serializers.StringRelatedField(read_only=True)
@@ -63,16 +72,18 @@ class AlbumSerializer(serializers.ModelSerializer):
     class Meta:
         model = Album
         fields = ['id', 'name', 'artist', 'categories', 'songs', 'cover', 'release_date']
+        prefetch_related = {
+            'songs': NestedPage('songs', SongLightSerializer, ('-popularity', 'id'), to_attr='songs_page'),
+        }
 
     def get_songs(self, obj):
-        from .serializers import SongLightSerializer
-        songs = obj.songs.all().order_by('-popularity')
-        return SongLightSerializer(songs,many=True,context=self.context).data
+        songs = prefetched(obj, 'songs_page', first_page(obj.songs.all(), ('-popularity', 'id')))
+        return SongLightSerializer(songs,many=True,context=self.nested_context('songs')).data
 
 
 
 # ---------- SONG ----------
-class SongSerializer(serializers.ModelSerializer):
+class SongSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     artist = serializers.PrimaryKeyRelatedField(queryset=Artist.objects.all(), many=True)
     album = serializers.PrimaryKeyRelatedField(queryset=Album.objects.all(), required=False, allow_null=True)
     categories = serializers.StringRelatedField(many=True, required=False, allow_null=True,read_only=True)
@@ -81,28 +92,68 @@ class SongSerializer(serializers.ModelSerializer):
         model = Song
         fields = [
             'id', 'name', 'artist', 'album', 'duration', 'popularity','categories',
-            'cover', 'audio_file', 'release_date','created_date'
+            'cover', 'audio_file', 'release_date','created_date', 'bitrate', 'sample_rate', 'loudness'
         ]
 
 
 # ---------- PLAYLIST ----------
-class PlaylistSerializer(serializers.ModelSerializer):
+# playlist order, the join through PlaylistTrack is shared with the songs relation
+TRACK_ORDER = ('playlist_tracks__position', 'id')
+
+
+class PlaylistSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    songs = SongSerializer(many=True, read_only=True)
+    songs = serializers.SerializerMethodField()
 
     class Meta:
         model = Playlist
         fields = ['id', 'name', 'user', 'songs', 'cover', 'created_at']
+        prefetch_related = {
+            'songs': NestedPage('songs', SongSerializer, TRACK_ORDER, to_attr='songs_page'),
+        }
+
+    def get_songs(self, obj):
+        songs = prefetched(obj, 'songs_page', first_page(obj.songs.all(), TRACK_ORDER))
+        return SongSerializer(songs, many=True, context=self.nested_context('songs')).data
 
 
 
 # ---------- FAVORITE ----------
-class FavoriteSerializer(serializers.ModelSerializer):
-    songs = SongSerializer(many=True, read_only=True)
-    albums = AlbumSerializer(many=True, read_only=True)
-    playlists = PlaylistSerializer(many=True, read_only=True)
-    artists = ArtistSerializer(many=True, read_only=True)
+class FavoriteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    songs = serializers.SerializerMethodField()
+    albums = serializers.SerializerMethodField()
+    playlists = serializers.SerializerMethodField()
+    artists = serializers.SerializerMethodField()
 
     class Meta:
         model = Favorite
-        fields = ['id', 'songs', 'albums', 'playlists', 'artists']
+        fields = ['id', 'version', 'songs', 'albums', 'playlists', 'artists']
+        # field -> (favorite kind, serializer), primary keys unless requested with ?expand=
+        items = {
+            'songs': ('song', SongSerializer),
+            'albums': ('album', AlbumSerializer),
+            'playlists': ('playlist', PlaylistSerializer),
+            'artists': ('artist', ArtistSerializer),
+        }
+
+    def get_songs(self, obj):
+        return self.get_items(obj, 'songs')
+
+    def get_albums(self, obj):
+        return self.get_items(obj, 'albums')
+
+    def get_playlists(self, obj):
+        return self.get_items(obj, 'playlists')
+
+    def get_artists(self, obj):
+        return self.get_items(obj, 'artists')
+
+    def get_items(self, obj, name):
+        kind, serializer_class = self.Meta.items[name]
+        # the cached id sets of catalog.membership, ascending
+        ids = list(membership.favorite_ids(obj.user_id)[kind])
+        if not self.selection.expands(name):
+            return ids
+        queryset = Favorite.KINDS[kind].objects.all()
+        return render_in_order(serializer_class, queryset, ids, self.context.get('request'),
+                               self.selection.child(name))
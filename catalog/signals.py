@@ -0,0 +1,252 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from accounts.models import User
+from . import audio, cache, counters, membership, recommender, search, trending
+from .models import Album, Artist, Category, Song, Favorite, FavoriteItem, Playlist
+
+# Sent once the favorites of one or more users changed.
+# ``added`` and ``removed`` are lists of (user_id, kind, item_id) tuples.
+favorites_changed = Signal()
+
+# Sent by the play buffer after a batch of plays was written.
+# ``counts`` is a list of (song_id, plays) tuples.
+plays_flushed = Signal()
+
+
+# ---------- Deleted items -> favorites_changed ----------
+def _forget_deleted_item(sender, instance, kind, **kwargs):
+    # favorite items point at their item by id only, nothing cascades
+    rows = FavoriteItem.objects.filter(kind=kind, item_id=instance.pk)
+    user_ids = list(rows.values_list('user_id', flat=True))
+    if user_ids:
+        rows.delete()
+        removed = [(user_id, kind, instance.pk) for user_id in user_ids]
+        favorites_changed.send(sender=Favorite, added=[], removed=removed)
+
+
+def _connect_favorite_items():
+    for kind, model in Favorite.KINDS.items():
+
+        def handler(sender, kind=kind, **kwargs):
+            _forget_deleted_item(sender, kind=kind, **kwargs)
+
+        post_delete.connect(handler, sender=model, weak=False, dispatch_uid=f'favorite-{kind}-deleted')
+
+
+_connect_favorite_items()
+
+
+@receiver(pre_delete, sender=User, dispatch_uid='favorite-user-deleted')
+def forget_deleted_user(sender, instance, **kwargs):
+    # the cascade would delete the rows without a signal, the counters of the items would keep them
+    rows = FavoriteItem.objects.filter(user=instance)
+    removed = [(instance.pk, kind, item_id) for kind, item_id in rows.values_list('kind', 'item_id')]
+    if removed:
+        rows.delete()
+        favorites_changed.send(sender=Favorite, added=[], removed=removed)
+
+
+# ---------- Receivers ----------
+@receiver(favorites_changed, dispatch_uid='favorite-counters')
+def update_favorite_counters(sender, added, removed, **kwargs):
+    # runs inside the transaction that changed the favorites
+    counters.apply(added, removed)
+
+
+@receiver(favorites_changed, dispatch_uid='favorite-version')
+def bump_favorite_version(sender, added, removed, **kwargs):
+    user_ids = {user_id for user_id, _, _ in [*added, *removed]}
+    if Favorite.objects.filter(user_id__in=user_ids).update(version=F('version') + 1) < len(user_ids):
+        # users whose first favorite this is
+        missing = user_ids - set(Favorite.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        Favorite.objects.bulk_create(
+            [Favorite(user_id=user_id, version=1) for user_id in missing], ignore_conflicts=True
+        )
+
+
+@receiver(favorites_changed, dispatch_uid='recommender-cache')
+def invalidate_user_recommendations(sender, added, removed, **kwargs):
+    user_ids = {user_id for user_id, _, _ in [*added, *removed]}
+    recommender.invalidate_users(user_ids)
+    transaction.on_commit(lambda: recommender.invalidate_users(user_ids))
+
+
+@receiver(favorites_changed, dispatch_uid='recommender-update')
+def update_recommendations(sender, added, removed, **kwargs):
+    if not recommender.get_setting('INCREMENTAL'):
+        return
+    items = {(kind, item_id) for _, kind, item_id in [*added, *removed]}
+    # refreshed off the request, see recommender.UpdateQueue
+    transaction.on_commit(lambda: recommender.get_update_queue().add(items))
+
+
+# ---------- Search index ----------
+SEARCH_KINDS = {model: kind for kind, model in search.MODELS.items()}
+
+
+@receiver(post_save, dispatch_uid='search-index-save')
+def index_saved_item(sender, instance, raw=False, **kwargs):
+    kind = SEARCH_KINDS.get(sender)
+    if kind is None or raw:
+        return
+    search.index_items(kind, [instance.pk])
+    if kind == 'artist':
+        # artist names are indexed alongside their songs and albums
+        search.index_items('song', instance.songs.values_list('id', flat=True))
+        search.index_items('album', instance.albums.values_list('id', flat=True))
+
+
+@receiver(post_delete, dispatch_uid='search-index-delete')
+def unindex_deleted_item(sender, instance, **kwargs):
+    kind = SEARCH_KINDS.get(sender)
+    if kind is not None:
+        search.remove_items(kind, [instance.pk])
+
+
+@receiver(m2m_changed, sender=Song.artist.through, dispatch_uid='search-index-song-artists')
+def index_song_artists(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        search.index_items('song', pk_set if pk_set is not None else instance.songs.values_list('id', flat=True))
+    else:
+        search.index_items('song', [instance.pk])
+
+
+@receiver(m2m_changed, sender=Song.categories.through, dispatch_uid='search-index-song-categories')
+def index_song_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove') and pk_set:
+        search.index_items('category', [instance.pk] if reverse else pk_set)
+
+
+@receiver(favorites_changed, dispatch_uid='search-index-favorites')
+def index_favorite_boosts(sender, added, removed, **kwargs):
+    touched = {}
+    for _, kind, item_id in [*added, *removed]:
+        if kind != 'song':
+            touched.setdefault(kind, set()).add(item_id)
+    for kind, ids in touched.items():
+        search.index_items(kind, ids)
+
+
+@receiver(plays_flushed, dispatch_uid='search-index-plays')
+def index_played_songs(sender, counts, **kwargs):
+    # popularity is the boost of songs
+    search.index_items('song', [song_id for song_id, _ in counts])
+
+
+# ---------- Audio metadata ----------
+@receiver(post_save, sender=Song, dispatch_uid='audio-metadata-queue')
+def queue_audio_metadata(sender, instance, raw=False, **kwargs):
+    # a no-op unless the song is new or got a new file
+    if not raw and audio.enqueue([(instance.pk, instance.audio_file.name)]) and audio.get_setting('IN_PROCESS'):
+        transaction.on_commit(audio.get_dispatcher().wake)
+
+
+# ---------- Trending ----------
+@receiver(plays_flushed, dispatch_uid='trending-plays')
+def trend_plays(sender, counts, **kwargs):
+    trending.record_plays(counts)
+
+
+@receiver(favorites_changed, dispatch_uid='trending-favorites')
+def trend_favorites(sender, added, removed, **kwargs):
+    items = [(kind, item_id) for _, kind, item_id in added]
+    if items:
+        transaction.on_commit(lambda: trending.record_favorites(items))
+
+
+# ---------- Response cache ----------
+CACHE_TAGS = {
+    Song: cache.song_tags,
+    Album: cache.album_tags,
+    Artist: cache.artist_tags,
+    Category: cache.category_tags,
+}
+
+
+def _invalidate(tags):
+    # also after commit: a response rendered before then still saw the old rows
+    cache.bump(tags)
+    transaction.on_commit(lambda: cache.bump(tags))
+
+
+@receiver(pre_save, sender=Song, dispatch_uid='response-cache-song-moved')
+def remember_song_album(sender, instance, raw=False, **kwargs):
+    # the album a song is moved away from renders it too
+    if not raw and not instance._state.adding:
+        old_album = Song.objects.filter(pk=instance.pk).values_list('album_id', flat=True).first()
+        if old_album is not None and old_album != instance.album_id:
+            _invalidate({f'album:{old_album}'})
+
+
+@receiver(post_save, dispatch_uid='response-cache-save')
+def invalidate_saved_item(sender, instance, raw=False, **kwargs):
+    if sender in CACHE_TAGS and not raw:
+        _invalidate(CACHE_TAGS[sender]([instance.pk]))
+
+
+@receiver(pre_delete, dispatch_uid='response-cache-delete')
+def invalidate_deleted_item(sender, instance, **kwargs):
+    # collected before the delete, relations are gone afterwards
+    if sender in CACHE_TAGS:
+        tags = CACHE_TAGS[sender]([instance.pk])
+        if sender in (Album, Artist):
+            # their songs lose the album or artist id without a signal
+            tags |= cache.song_tags(instance.songs.values_list('id', flat=True))
+        _invalidate(tags)
+
+
+@receiver(m2m_changed, sender=Song.artist.through, dispatch_uid='response-cache-song-artists')
+@receiver(m2m_changed, sender=Song.categories.through, dispatch_uid='response-cache-song-categories')
+def invalidate_song_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    # pre_ sees the old artists, post_ the new ones
+    if action not in ('pre_add', 'post_add', 'pre_remove', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        song_ids = [instance.pk]
+    elif pk_set is not None:
+        song_ids = pk_set
+    else:
+        song_ids = instance.songs.values_list('id', flat=True)
+    tags = cache.song_tags(song_ids)
+    if reverse and sender is Song.artist.through:
+        tags.add(f'artist:{instance.pk}')
+    _invalidate(tags)
+
+
+@receiver(m2m_changed, sender=Album.categories.through, dispatch_uid='response-cache-album-categories')
+def invalidate_album_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        album_ids = [instance.pk]
+    elif pk_set is not None:
+        album_ids = pk_set
+    else:
+        album_ids = instance.albums.values_list('id', flat=True)
+    _invalidate(cache.album_tags(album_ids))
+
+
+@receiver(plays_flushed, dispatch_uid='response-cache-plays')
+def invalidate_played_songs(sender, counts, **kwargs):
+    # popularity is rendered and orders the song lists
+    cache.bump(cache.song_tags(song_id for song_id, _ in counts))
+
+
+# ---------- Membership ----------
+# favorites share the favorites:<user> tag bumped by invalidate_user_recommendations
+@receiver(m2m_changed, sender=Playlist.songs.through, dispatch_uid='membership-playlist-songs')
+def invalidate_playlist_songs(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        playlist_ids = [instance.pk]
+    elif pk_set is not None:
+        playlist_ids = pk_set
+    else:
+        playlist_ids = instance.playlists.values_list('id', flat=True)
+    _invalidate({membership.playlist_tag(pk) for pk in playlist_ids})
@@ -0,0 +1,94 @@
+"""
+Sparse fieldsets and expansion.
+
+``?fields=id,name,albums.name`` limits the rendered fields, dotted paths
+select inside nested serializers (``albums`` alone keeps all of its
+fields). ``?expand=songs`` asks for a field a serializer renders as primary
+keys by default (FavoriteSerializer's items) in full, serializers check it
+with ``selection.expands(name)``. Both parameters only apply to safe
+requests.
+
+SparseFieldsMixin prunes ``serializer.fields``, and eager loading and the
+compiled serializers only look at those fields, so whatever is not
+rendered is not queried either. Serializers built inside a
+SerializerMethodField get their part of the selection through
+``nested_context(name)``.
+"""
+from collections import namedtuple
+from functools import cached_property
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _paths(value):
+    return tuple(sorted({path.strip() for path in value.split(',') if path.strip()}))
+
+
+def _roots(paths):
+    return {path.split('.', 1)[0] for path in paths}
+
+
+def _children(paths, name):
+    prefix = name + '.'
+    return tuple(path[len(prefix):] for path in paths if path.startswith(prefix))
+
+
+class Selection(namedtuple('Selection', 'fields expand')):
+    """Requested ``fields`` (dotted paths, None for all) and ``expand`` paths of a serializer."""
+    __slots__ = ()
+
+    def includes(self, name):
+        return self.fields is None or name in _roots(self.fields) or self.expands(name)
+
+    def expands(self, name):
+        return name in _roots(self.expand)
+
+    def child(self, name):
+        """Selection of the serializer rendering field ``name``."""
+        if self.fields is None or name in self.fields:
+            fields = None
+        else:
+            fields = _children(self.fields, name) or None
+        return Selection(fields, _children(self.expand, name))
+
+
+ALL = Selection(None, ())
+
+
+def from_request(request):
+    if request is None or request.method not in SAFE_METHODS:
+        return ALL
+    params = getattr(request, 'query_params', request.GET)
+    fields = params.get(FIELDS_PARAM)
+    return Selection(_paths(fields) if fields else None, _paths(params.get(EXPAND_PARAM, '')))
+
+
+class SparseFieldsMixin:
+    """Serializer mixin applying the fields and expand parameters, see the module docstring."""
+
+    @cached_property
+    def selection(self):
+        parent, name = self.parent, self.field_name
+        if isinstance(parent, ListSerializer):
+            parent, name = parent.parent, parent.field_name
+        if parent is not None:
+            return getattr(parent, 'selection', ALL).child(name)
+        if 'selection' in self.context:
+            return self.context['selection']
+        return from_request(self.context.get('request'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.selection
+        for name in list(fields):
+            if not selection.includes(name):
+                del fields[name]
+        return fields
+
+    def nested_context(self, name):
+        """Context for a serializer rendering field ``name`` from a SerializerMethodField."""
+        return {**self.context, 'selection': self.selection.child(name)}
@@ -0,0 +1,127 @@
+"""
+Byte-range file responses for audio streaming.
+
+Full responses are plain FileResponses so WSGI servers with a
+``wsgi.file_wrapper`` (gunicorn, uwsgi) send them with ``sendfile``.
+Range requests wrap the open file in ``RangedFile`` which still exposes the
+real file descriptor positioned at the range start; servers using sendfile
+cap the transfer at Content-Length and everything else reads only the
+requested bytes.
+"""
+import io
+import mimetypes
+import re
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.negotiation import DefaultContentNegotiation
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PassthroughContentNegotiation(DefaultContentNegotiation):
+    """Skip Accept based renderer selection for views returning raw HttpResponses."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class RangedFile:
+    """File-like view of the bytes [start, start + length) of an open file."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.length = length
+        self.name = getattr(file, 'name', '')
+        self.file.seek(start)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.file.tell() - self.start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.file.seek(self.start + max(0, min(offset, self.length)))
+        return self.tell()
+
+    def read(self, size=-1):
+        remaining = self.length - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        return self.file.read(size) if size > 0 else b''
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive (start, end) of a single byte range, None when the
+    header should be ignored. Raises ValueError when it cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # malformed or multiple ranges: serve the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def file_response(request, field_file):
+    """Serve a FieldFile honouring Range, If-Range and conditional headers."""
+    storage, name = field_file.storage, field_file.name
+    size = storage.size(name)
+    modified = storage.get_modified_time(name)
+    etag = f'"{size:x}-{int(modified.timestamp() * 1_000_000):x}"'
+    last_modified = http_date(modified.timestamp())
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(modified.timestamp()))
+    if not_modified is not None:
+        return not_modified
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    file = storage.open(name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangedFile(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
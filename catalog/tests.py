@@ -1,3 +1,1200 @@
-from django.test import TestCase
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import json
+import math
+import os
+import tempfile
+import wave
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from accounts.models import User, Profile
+from vexify import metrics, profiling
+from vexify.renderers import ORJSONRenderer
+from . import audio, counters, favorites, recommender, search, trending
+from .management.commands import benchmark_catalog
+from .plays import PlayBuffer
+from .models import (
+    Category, Artist, Song, Album, Playlist, PlaylistTrack, Favorite, FavoriteItem, AudioMetadataJob, ItemNeighbor,
+    TrendingLandmark,
+)
+
+
+def make_catalog(size, prefix='x'):
+    """Create `size` artists, each with an album, songs, a category and a playlist."""
+    today = datetime.date(2024, 1, 1)
+    user = User.objects.create_user(f'{prefix}@vexify.test', prefix, today, 'password')
+    Profile.objects.create(user=user)
+    Favorite.objects.create(user=user)
+    for i in range(size):
+        artist = Artist.objects.create(name=f'{prefix} artist {i}')
+        category = Category.objects.create(name=f'{prefix} category {i}', cover='categories/c.jpg')
+        album = Album.objects.create(name=f'{prefix} album {i}', artist=artist, cover='albums/a.jpg', release_date=today)
+        playlist = Playlist.objects.create(name=f'{prefix} playlist {i}', user=user)
+        for j in range(3):
+            song = Song.objects.create(
+                name=f'{prefix} song {i}-{j}', album=album, audio_file='audio_file/s.mp3',
+                release_date=today, popularity=j,
+            )
+            song.artist.add(artist)
+            song.categories.add(category)
+            playlist.songs.add(song, through_defaults={'position': j})
+            favorites.add(user.pk, 'song', song.pk)
+        favorites.add(user.pk, 'album', album.pk)
+        favorites.add(user.pk, 'artist', artist.pk)
+        favorites.add(user.pk, 'playlist', playlist.pk)
+    return user
+
+
+class QueryBudgetTests(APITestCase):
+    """The number of queries of an endpoint must not grow with the number of rows."""
+
+    # endpoint -> maximum number of queries
+    # compiled lists (catalog.compiled) load string and nested serializer
+    # relations with a lookup of their own instead of a join
+    budgets = {
+        '/catalog/categories/': 1,
+        '/catalog/artists/': 4,
+        '/catalog/artists/1/': 4,
+        '/catalog/albums/': 5,
+        '/catalog/albums/1/': 4,
+        '/catalog/songs/': 3,
+        '/catalog/playlists/': 5,
+        '/catalog/favorites/': 2,
+        '/catalog/favorites/?expand=songs,albums,artists,playlists': 19,
+        '/catalog/artists/?fields=id,name': 1,
+        '/catalog/recommendation/': 9,
+        '/catalog/search/?q=song': 3,
+    }
+
+    def count_queries(self, url):
+        # measure rendering, not the response cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def test_query_counts_are_constant(self):
+        user = make_catalog(2, prefix='small')
+        self.client.force_authenticate(user)
+        small = {url: self.count_queries(url) for url in self.budgets}
+
+        make_catalog(6, prefix='large')
+        large = {url: self.count_queries(url) for url in self.budgets}
+
+        for url, budget in self.budgets.items():
+            with self.subTest(url=url):
+                self.assertEqual(small[url], large[url])
+                self.assertLessEqual(large[url], budget)
+
+
+class CompiledSerializerParityTests(APITestCase):
+    """Compiled serializers must render byte-identical responses."""
+
+    urls = [
+        '/catalog/categories/',
+        '/catalog/artists/',
+        '/catalog/albums/',
+        '/catalog/songs/',
+        '/catalog/songs/?page_size=2',
+        '/catalog/playlists/',
+        '/catalog/favorites/',
+        '/catalog/favorites/?expand=songs,albums,artists,playlists',
+        '/catalog/artists/?fields=id,top_songs.name,top_songs.categories',
+        '/catalog/playlists/?fields=user,songs.artist',
+        '/catalog/recommendation/',
+        '/catalog/recommendation/?fields=id,name',
+        '/catalog/artists/{artist}/top_songs/',
+        '/catalog/albums/{album}/songs/',
+        '/catalog/playlists/{playlist}/songs/',
+    ]
+
+    def setUp(self):
+        self.user = make_catalog(3)
+        self.song = Song.objects.first()
+        # nullable and empty values
+        Song.objects.create(name='single', audio_file='', release_date=datetime.date(2024, 1, 1))
+        Song.objects.filter(pk=self.song.pk).update(cover='songs/été #1.jpg', audio_file='audio_file/../a b.mp3')
+        self.song.artist.add(Artist.objects.last())
+        self.user.profile.bio = 'bio'
+        self.user.profile.save()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.content
+
+    def test_responses_match_drf(self):
+        ids = {
+            'artist': self.song.artist.order_by('id').last().pk,
+            'album': self.song.album_id,
+            'playlist': Playlist.objects.first().pk,
+        }
+        for url in self.urls:
+            url = url.format(**ids)
+            with self.subTest(url=url):
+                compiled = self.get(url)
+                with override_settings(COMPILED_SERIALIZERS=False):
+                    self.assertEqual(compiled, self.get(url))
+
+
+class SparseFieldsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_catalog(2)
+        self.client.force_authenticate(self.user)
+
+    def test_favorites_are_ids_unless_expanded(self):
+        favorite = self.client.get('/catalog/favorites/').json()[0]
+        items = FavoriteItem.objects.filter(user=self.user).order_by('item_id')
+        self.assertEqual(favorite['songs'], list(items.filter(kind='song').values_list('item_id', flat=True)))
+        self.assertEqual(favorite['artists'], list(items.filter(kind='artist').values_list('item_id', flat=True)))
+
+        favorite = self.client.get('/catalog/favorites/?expand=artists&fields=artists.id,artists.albums').json()[0]
+        self.assertEqual(list(favorite), ['artists'])
+        self.assertEqual(list(favorite['artists'][0]), ['id', 'albums'])
+
+    def test_unrequested_fields_are_not_loaded(self):
+        for compiled in (True, False):
+            with self.subTest(compiled=compiled), override_settings(COMPILED_SERIALIZERS=compiled):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get('/catalog/artists/?fields=id,name')
+                self.assertEqual(list(response.json()['results'][0]), ['id', 'name'])
+                self.assertEqual(len(queries), 1)
+
+                cache.clear()
+                response = self.client.get(f'/catalog/artists/{Artist.objects.first().pk}/?fields=name,albums.name')
+                self.assertEqual(response.json()['albums'], [{'name': 'x album 0'}])
+
+
+class MembershipTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_catalog(2)
+        self.client.force_authenticate(self.user)
+        self.song, self.other = Song.objects.order_by('id')[:2]
+
+    def test_favorites_contains(self):
+        self.client.post('/catalog/favorites/remove_song/', {'id': self.other.pk})
+        url = f'/catalog/favorites/contains/?song={self.song.pk},{self.other.pk},0&artist={Artist.objects.first().pk}'
+        self.assertEqual(self.client.get(url).json(), {'song': '100', 'artist': '1'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual(len(queries), 0)
+
+        self.client.post('/catalog/favorites/add_song/', {'id': self.other.pk})
+        self.assertEqual(self.client.get(url).json()['song'], '110')
+        self.assertEqual(self.client.get('/catalog/favorites/contains/?song=x').status_code, 400)
+
+    def test_favorites_sync(self):
+        album = Album.objects.first()
+        operations = [
+            {'op': 'remove', 'kind': 'song', 'id': self.song.pk},
+            {'op': 'remove', 'kind': 'song', 'id': self.other.pk},
+            {'op': 'add', 'kind': 'song', 'id': self.song.pk},
+            {'op': 'remove', 'kind': 'album', 'id': album.pk},
+            {'op': 'add', 'kind': 'song', 'id': 0},
+            {'op': 'toggle', 'kind': 'song', 'id': 1},
+            {'op': 'add', 'kind': 'song', 'id': 10 ** 20},
+        ]
+        data = self.client.post('/catalog/favorites/sync/', {'operations': operations}, format='json').json()
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['superseded', 'removed', 'already_present', 'removed', 'not_found', 'invalid', 'invalid'])
+        self.assertEqual((data['added'], data['removed']), (0, 2))
+        self.assertEqual(Song.objects.get(pk=self.other.pk).favorite_count, 0)
+        url = f'/catalog/favorites/contains/?song={self.song.pk},{self.other.pk}&album={album.pk}'
+        self.assertEqual(self.client.get(url).json(), {'song': '10', 'album': '0'})
+
+        # replaying the batch changes nothing and keeps the version
+        again = self.client.post('/catalog/favorites/sync/', {'operations': operations}, format='json').json()
+        self.assertEqual((again['version'], again['removed']), (data['version'], 0))
+        response = self.client.post('/catalog/favorites/sync/', {'operations': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_favorite_ids_are_validated(self):
+        for item_id in ('abc', '1.5', 1.5, 10 ** 20, str(10 ** 20), -1, True):
+            with self.subTest(item_id=item_id):
+                response = self.client.post('/catalog/favorites/add_song/', {'id': item_id}, format='json')
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post('/catalog/favorites/remove_song/', {'id': item_id}, format='json')
+                self.assertEqual(response.status_code, 400)
+        response = self.client.post('/catalog/favorites/remove_song/', {'id': str(self.song.pk)}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_cannot_edit_favorite_items(self):
+        self.user.is_admin = True
+        self.user.save()
+        self.client.force_login(self.user)
+        item = FavoriteItem.objects.filter(user=self.user).first()
+        self.assertEqual(self.client.get('/admin/catalog/favoriteitem/').status_code, 200)
+        self.assertEqual(self.client.get('/admin/catalog/favoriteitem/add/').status_code, 403)
+        self.assertEqual(self.client.post(f'/admin/catalog/favoriteitem/{item.pk}/delete/', {'post': 'yes'}).status_code, 403)
+        self.assertTrue(FavoriteItem.objects.filter(pk=item.pk).exists())
+
+    def test_deleted_user_leaves_the_counters(self):
+        fan = User.objects.create_user('fan@vexify.test', 'fan', datetime.date(2024, 1, 1), 'password')
+        favorites.add(fan.pk, 'song', self.song.pk)
+        favorites.add(fan.pk, 'album', Album.objects.first().pk)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).favorite_count, 2)
+        fan.delete()
+        self.assertEqual(Song.objects.get(pk=self.song.pk).favorite_count, 1)
+        self.assertEqual(Album.objects.first().favorite_count, 1)
+        self.assertFalse(FavoriteItem.objects.filter(user_id=fan.pk).exists())
+
+    def test_playlist_contains(self):
+        playlist = Playlist.objects.filter(songs=self.song).first()
+        url = f'/catalog/playlists/{playlist.pk}/contains/?song={self.song.pk},{self.other.pk}'
+        self.assertEqual(self.client.get(url).json(), {'song': '11'})
+        playlist.songs.remove(self.other)
+        self.assertEqual(self.client.get(url).json(), {'song': '10'})
+
+
+class SearchTests(APITestCase):
+
+    def setUp(self):
+        today = datetime.date(2024, 1, 1)
+        user = User.objects.create_user('fan@vexify.test', 'fan', today, 'password')
+        self.artist = Artist.objects.create(name='Daft Punk')
+        album = Album.objects.create(name='Discovery', artist=self.artist, cover='albums/a.jpg', release_date=today)
+        self.songs = {}
+        for name, popularity in (('One More Time', 5), ('Around the World', 9), ('Punky Reggae Party', 1)):
+            self.songs[name] = Song.objects.create(
+                name=name, album=album, audio_file='audio_file/s.mp3', release_date=today, popularity=popularity,
+            )
+        for name in ('One More Time', 'Around the World'):
+            self.songs[name].artist.add(self.artist)
+        self.playlist = Playlist.objects.create(name='World tour', user=user)
+
+    def search(self, q):
+        data = self.client.get('/catalog/search/', {'q': q}).json()
+        top = data['top_result'] and (data['top_result']['type'], data['top_result']['name'])
+        names = {kind: [item['name'] for item in data[kind]] for kind in ('songs', 'artists', 'albums', 'playlists')}
+        return top, names
+
+    def test_ranked_prefix_matches(self):
+        # prefixes of every word, songs match their artists' names too
+        top, names = self.search('daft pu')
+        self.assertEqual(names['artists'], ['Daft Punk'])
+        # equal ranks go to the more popular
+        self.assertEqual(names['songs'], ['Around the World', 'One More Time'])
+        self.assertEqual(top, ('song', 'Around the World'))
+        # an exact name is the top result whatever its kind
+        self.assertEqual(self.search('Daft Punk')[0], ('artist', 'Daft Punk'))
+
+        top, names = self.search('worl')
+        self.assertEqual((names['songs'], names['playlists']), (['Around the World'], ['World tour']))
+        # name matches rank before matches of the artist names
+        self.assertEqual(self.search('punk')[1]['songs'], ['Punky Reggae Party', 'Around the World', 'One More Time'])
+        self.assertEqual(self.search('?!')[1], {'songs': [], 'artists': [], 'albums': [], 'playlists': []})
+
+    def test_index_follows_changes(self):
+        self.artist.name = 'Thomas Bangalter'
+        self.artist.save()
+        self.assertEqual(self.search('daft')[1]['songs'], [])
+        self.assertEqual(self.search('bangal')[1]['songs'], ['Around the World', 'One More Time'])
+
+        self.songs['Around the World'].delete()
+        self.playlist.name = 'Road trip'
+        self.playlist.save()
+        self.assertEqual(self.search('world')[1], {'songs': [], 'artists': [], 'albums': [], 'playlists': []})
+        self.assertEqual(self.search('road')[1]['playlists'], ['Road trip'])
+
+    def test_plays_refresh_song_boosts(self):
+        buffer = PlayBuffer(flush_interval=0, max_pending_songs=100, batch_size=500)
+        buffer.record(self.songs['One More Time'].pk, 10)
+        buffer.flush()
+        self.assertEqual(self.search('daft pu')[1]['songs'], ['One More Time', 'Around the World'])
+
+    def test_exact_names_fold_non_ascii(self):
+        Song.objects.create(
+            name='Été indien', album=Album.objects.get(), audio_file='audio_file/s.mp3',
+            release_date=datetime.date(2024, 1, 1),
+        )
+        Playlist.objects.create(name='Été', user=self.playlist.user)
+        self.assertEqual(self.search('été')[0], ('playlist', 'Été'))
+
+    def test_fallback_without_fts(self):
+        with mock.patch.object(search, 'is_available', return_value=False):
+            top, names = self.search('world')
+        self.assertEqual((names['songs'], names['playlists']), (['Around the World'], ['World tour']))
+        self.assertEqual(top, ('song', 'Around the World'))
+
+
+class FavoriteCounterTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(2)
+        self.fan = User.objects.create_user('fan@vexify.test', 'fan', datetime.date(2024, 1, 1), 'password')
+        self.song = Song.objects.order_by('id').first()
+        self.album = Album.objects.order_by('id').first()
+
+    def counts(self):
+        return Song.objects.get(pk=self.song.pk).favorite_count, Album.objects.get(pk=self.album.pk).favorite_count
+
+    def test_changes_move_counters(self):
+        self.assertEqual(self.counts(), (1, 1))
+        favorites.add(self.fan.pk, 'song', self.song.pk)
+        favorites.add(self.fan.pk, 'song', self.song.pk)
+        favorites.add(self.fan.pk, 'album', self.album.pk)
+        self.assertEqual(self.counts(), (2, 2))
+        favorites.remove(self.user.pk, 'song', self.song.pk)
+        favorites.remove(self.user.pk, 'song', self.song.pk)
+        self.assertEqual(self.counts(), (1, 2))
+
+        self.client.force_authenticate(self.fan)
+        operations = [
+            {'op': 'remove', 'kind': 'song', 'id': self.song.pk},
+            {'op': 'remove', 'kind': 'album', 'id': self.album.pk},
+            {'op': 'add', 'kind': 'album', 'id': self.album.pk},
+        ]
+        self.client.post('/catalog/favorites/sync/', {'operations': operations}, format='json')
+        self.assertEqual(self.counts(), (0, 2))
+
+    def test_reconcile(self):
+        Song.objects.filter(pk=self.song.pk).update(favorite_count=7)
+        Album.objects.filter(pk=self.album.pk).update(favorite_count=0)
+        self.assertEqual(counters.reconcile('song', fix=False), ([(self.song.pk, 7, 1)], 6))
+
+        output = io.StringIO()
+        call_command('reconcile_favorite_counts', dry_run=True, stdout=output)
+        self.assertIn(f'song {self.song.pk}: stored 7, actual 1', output.getvalue())
+        self.assertIn('album: 1 drifted row(s), total drift 1', output.getvalue())
+        self.assertEqual(self.counts(), (7, 0))
+
+        call_command('reconcile_favorite_counts', stdout=output)
+        self.assertEqual(self.counts(), (1, 1))
+        output = io.StringIO()
+        call_command('reconcile_favorite_counts', stdout=output)
+        self.assertIn('All favorite counters are consistent.', output.getvalue())
+
+
+class PlaylistAdminTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_catalog(2)
+        self.user.is_admin = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.playlist = Playlist.objects.order_by('id').first()
+        self.song, self.other = self.playlist.songs.order_by('id')[:2]
+        self.outsider = Song.objects.exclude(playlists=self.playlist).first()
+
+    def form_data(self, url):
+        """POST data of an admin change form as rendered."""
+        context = self.client.get(url).context
+        forms = [context['adminform'].form]
+        for inline in context['inline_admin_formsets']:
+            forms += [inline.formset.management_form, *inline.formset.forms]
+        data = {}
+        for form in forms:
+            for field in form:
+                value = field.value()
+                # unchanged files are left out of the POST
+                if value is not None and value is not False and not field.field.widget.needs_multipart_form:
+                    data[field.html_name] = value
+        return data
+
+    def test_inline_edits_refresh_membership(self):
+        url = f'/catalog/playlists/{self.playlist.pk}/contains/?song={self.song.pk},{self.other.pk},{self.outsider.pk}'
+        self.assertEqual(self.client.get(url).json(), {'song': '110'})
+
+        change = f'/admin/catalog/playlist/{self.playlist.pk}/change/'
+        data = self.form_data(change)
+        rows = {int(data[f'tracks-{i}-song']): i for i in range(int(data['tracks-INITIAL_FORMS']))}
+        data[f'tracks-{rows[self.song.pk]}-DELETE'] = 'on'
+        # the empty extra form adds the outsider
+        extra = data['tracks-INITIAL_FORMS']
+        data.update({f'tracks-{extra}-song': self.outsider.pk, f'tracks-{extra}-position': 1 << 30})
+        response = self.client.post(change, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(url).json(), {'song': '011'})
+
+
+class PlaylistBulkTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(3)
+        self.client.force_authenticate(self.user)
+        self.playlist = Playlist.objects.create(name='bulk', user=self.user)
+        self.songs = list(Song.objects.order_by('id').values_list('id', flat=True))
+
+    def post(self, action, song_ids):
+        response = self.client.post(f'/catalog/playlists/{self.playlist.pk}/{action}/', {'song_ids': song_ids},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_add_remove_set(self):
+        first, second, third = self.songs[:3]
+        self.post('add_songs', [first])
+        with CaptureQueriesContext(connection) as queries:
+            data = self.post('add_songs', [first, second, 0, 'x', second, 10 ** 20, *self.songs[3:]])
+        # playlist, owner check, songs IN, membership diff, last position, bulk insert, savepoint
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual([result['status'] for result in data['results'][:6]],
+                         ['already_present', 'added', 'not_found', 'invalid', 'duplicate', 'invalid'])
+        self.assertEqual(set(self.playlist.songs.values_list('id', flat=True)), set(self.songs) - {third})
+
+        data = self.post('remove_songs', [first, third, 10 ** 20])
+        self.assertEqual(data['results'], [{'id': first, 'status': 'removed'}, {'id': third, 'status': 'not_in_playlist'},
+                                           {'id': 10 ** 20, 'status': 'invalid'}])
+
+        data = self.post('set_songs', [third, second])
+        self.assertEqual((data['added'], data['removed']), (1, len(self.songs) - 3))
+        self.assertEqual(set(self.playlist.songs.values_list('id', flat=True)), {second, third})
+        response = self.client.get(f'/catalog/playlists/{self.playlist.pk}/contains/?song={first},{second}')
+        self.assertEqual(response.json(), {'song': '01'})
+
+    def order(self, query='limit=10'):
+        response = self.client.get(f'/catalog/playlists/{self.playlist.pk}/tracks/?{query}')
+        return [song['id'] for song in response.json()['results']]
+
+    def move(self, song_id, **anchor):
+        response = self.client.post(f'/catalog/playlists/{self.playlist.pk}/move/', {'song_id': song_id, **anchor},
+                                    format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_order_and_moves(self):
+        a, b, c, d = self.songs[:4]
+        self.post('set_songs', [c, a, d, b])
+        self.assertEqual(self.order(), [c, a, d, b])
+        self.assertEqual(self.order('offset=1&limit=2'), [a, d])
+
+        self.move(b, after=None)
+        self.move(d, before=a)
+        self.assertEqual(self.order(), [b, c, d, a])
+        self.move(b, before=None)
+        self.assertEqual(self.order(), [c, d, a, b])
+
+        # adjacent positions leave no room, the playlist is renumbered
+        for position, song_id in enumerate([c, d, a, b]):
+            PlaylistTrack.objects.filter(playlist=self.playlist, song=song_id).update(position=position)
+        self.move(b, after=c)
+        self.assertEqual(self.order(), [c, b, d, a])
+        positions = list(self.playlist.tracks.order_by('position').values_list('position', flat=True))
+        self.assertEqual(len(set(positions)), 4)
+
+        self.assertEqual(self.order('offset=100000000000000000000'), [])
+        for payload in ({'song_id': 10 ** 20, 'after': None}, {'song_id': [c], 'after': None}, {'song_id': c, 'before': [d]}):
+            response = self.client.post(f'/catalog/playlists/{self.playlist.pk}/move/', payload, format='json')
+            self.assertEqual(response.status_code, 400, payload)
+
+        first = self.client.get(f'/catalog/playlists/{self.playlist.pk}/songs/?page_size=2').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([song['id'] for song in first['results'] + second['results']], [c, b, d, a])
+
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        make_catalog(2)
+        self.song = Song.objects.first()
+
+    def test_hits_skip_the_database(self):
+        url = f'/catalog/albums/{self.song.album_id}/'
+        first = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    @override_settings(ALLOWED_HOSTS=['a.test', 'b.test'])
+    def test_hosts_get_their_own_links(self):
+        for host, secure in [('a.test', False), ('b.test', False), ('b.test', True)]:
+            with self.subTest(host=host, secure=secure):
+                data = self.client.get('/catalog/songs/?page_size=1', HTTP_HOST=host, secure=secure).json()
+                self.assertTrue(data['next'].startswith(f"{'https' if secure else 'http'}://{host}/"))
+
+    def test_if_none_match(self):
+        url = f'/catalog/songs/{self.song.pk}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_song_edit_invalidates_its_pages(self):
+        artist = self.song.artist.get()
+        urls = [
+            f'/catalog/songs/{self.song.pk}/',
+            f'/catalog/albums/{self.song.album_id}/',
+            f'/catalog/artists/{artist.pk}/',
+            '/catalog/songs/',
+        ]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.song.name = 'renamed'
+        self.song.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('renamed', response.content.decode())
+
+
+class PaginationTests(APITestCase):
+
+    def test_cursor_keeps_microseconds(self):
+        user = make_catalog(6)
+        created_at = datetime.datetime(2024, 1, 1, 12, 0, 0, 250000, tzinfo=datetime.timezone.utc)
+        for i, playlist in enumerate(Playlist.objects.order_by('id')):
+            # all in the same millisecond
+            Playlist.objects.filter(pk=playlist.pk).update(created_at=created_at + datetime.timedelta(microseconds=i * 100))
+        self.client.force_authenticate(user)
+        url, ids = '/catalog/playlists/?page_size=2', []
+        while url:
+            data = self.client.get(url).json()
+            ids += [playlist['id'] for playlist in data['results']]
+            url = data['next']
+        self.assertEqual(ids, list(Playlist.objects.order_by('-created_at', 'id').values_list('id', flat=True)))
+
+
+class PlayBufferTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(1)
+        self.songs = list(Song.objects.order_by('id'))
+
+    def test_flush_writes_plays(self):
+        buffer = PlayBuffer(flush_interval=0, max_pending_songs=100, batch_size=2)
+        buffer._pending.update({song.pk: 2 for song in self.songs})
+        self.assertEqual(buffer.flush(), 6)
+        self.assertEqual(
+            [song.popularity + 2 for song in self.songs],
+            list(Song.objects.order_by('id').values_list('popularity', flat=True)),
+        )
+        self.assertEqual(buffer.stats()['pending_plays'], 0)
+
+    def test_failed_flush_keeps_plays(self):
+        buffer = PlayBuffer(flush_interval=0, max_pending_songs=100, batch_size=500)
+        buffer._pending.update({self.songs[0].pk: 7, 10 ** 20: 1})
+        # the driver raises OverflowError for the out of range id
+        with self.assertLogs('catalog.plays', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        stats = buffer.stats()
+        self.assertEqual((stats['failed_flushes'], stats['pending_plays'], stats['dropped_plays']), (1, 8, 0))
+
+        # plays beyond the buffer's room are dropped and counted
+        buffer = PlayBuffer(flush_interval=0, max_pending_songs=1, batch_size=500)
+        buffer._restore([(self.songs[0].pk, 3), (self.songs[1].pk, 4)])
+        self.assertEqual((buffer.stats()['pending_plays'], buffer.stats()['dropped_plays']), (3, 4))
+
+    def test_play_rejects_bad_ids(self):
+        self.client.force_authenticate(self.user)
+        for song_id in ('100000000000000000000', '0', '-3', 'x'):
+            with self.subTest(song_id=song_id):
+                response = self.client.post(f'/catalog/songs/{song_id}/play/')
+                self.assertEqual(response.status_code, 400)
+
+
+class RecommendationCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_catalog(2)
+        self.client.force_authenticate(self.user)
+
+    def test_cached_until_favorites_change(self):
+        self.client.get('/catalog/recommendation/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/catalog/recommendation/')
+        self.assertEqual(len(queries), 0)
+
+        favorites.remove(self.user.pk, 'song', Song.objects.first().pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/catalog/recommendation/')
+        self.assertGreater(len(queries), 0)
+
+    @override_settings(ALLOWED_HOSTS=['a.test', 'b.test'])
+    def test_hosts_get_their_own_urls(self):
+        favorites.remove(self.user.pk, 'song', Song.objects.first().pk)
+        first = self.client.get('/catalog/recommendation/', HTTP_HOST='a.test').content.decode()
+        second = self.client.get('/catalog/recommendation/', HTTP_HOST='b.test').content.decode()
+        self.assertIn('http://a.test/media/', first)
+        self.assertIn('http://b.test/media/', second)
+        self.assertNotIn('a.test', second)
+
+
+@override_settings(STREAMING={'CHUNK_SIZE': 4})
+class RecommenderTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(3)
+        self.fan = User.objects.create_user('fan@vexify.test', 'fan', datetime.date(2024, 1, 1), 'password')
+        self.song = Song.objects.order_by('id').first()
+        recommender.rebuild()
+
+    def neighbors(self, **filters):
+        return set(ItemNeighbor.objects.filter(**filters).values_list(
+            'item_kind', 'item_id', 'neighbor_kind', 'neighbor_id', 'score'
+        ))
+
+    def test_rebuild_in_item_ranges(self):
+        whole = self.neighbors()
+        with override_settings(RECOMMENDER={'REBUILD_ITEMS': 2}):
+            self.assertEqual(recommender.rebuild(), len(recommender.item_counts()))
+        self.assertEqual(self.neighbors(), whole)
+
+    def test_changes_are_queued(self):
+        queue = recommender.UpdateQueue(60)
+        self.addCleanup(queue.shutdown)
+        before = self.neighbors(item_kind='song', item_id=self.song.pk)
+        with mock.patch.object(recommender, '_queue', queue), self.captureOnCommitCallbacks(execute=True):
+            favorites.add(self.fan.pk, 'song', self.song.pk)
+        # the committing request doesn't wait for the refresh
+        self.assertEqual(self.neighbors(item_kind='song', item_id=self.song.pk), before)
+
+        self.assertEqual(queue.flush(), 1)
+        updated = self.neighbors(item_kind='song', item_id=self.song.pk)
+        self.assertNotEqual(updated, before)
+        recommender.rebuild()
+        self.assertEqual(self.neighbors(item_kind='song', item_id=self.song.pk), updated)
+
+
+class TrendingTests(APITestCase):
+
+    def setUp(self):
+        make_catalog(2)
+        self.first, self.second = Song.objects.order_by('id')[:2]
+        self.t0 = 1_700_000_000.0
+
+    def test_scores_decay_by_period(self):
+        trending.record_plays([(self.first.pk, 4)], now=self.t0)
+        trending.record_plays([(self.second.pk, 3)], now=self.t0 + 3600)
+        later = self.t0 + 3600
+
+        # an hour halves the hour chart, the week chart barely moves
+        self.assertEqual([item_id for item_id, _ in trending.top('song', 'hour', 10, now=later)],
+                         [self.second.pk, self.first.pk])
+        self.assertAlmostEqual(dict(trending.top('song', 'hour', 10, now=later))[self.first.pk], 2.0)
+        self.assertAlmostEqual(dict(trending.top('song', 'day', 10, now=later))[self.first.pk], 4 * 2 ** (-1 / 24))
+        self.assertEqual(trending.top('song', 'week', 1, now=later)[0][0], self.first.pk)
+
+        # plays count for the songs' album, artists and categories, both are on the first album
+        self.assertAlmostEqual(dict(trending.top('album', 'hour', 10, now=later))[self.first.album_id], 5.0)
+        artist = self.first.artist.get()
+        self.assertAlmostEqual(dict(trending.top('artist', 'hour', 10, now=later))[artist.pk], 5.0)
+        trending.record_favorites([('song', self.first.pk), ('playlist', 1)], now=later)
+        self.assertAlmostEqual(dict(trending.top('song', 'hour', 10, now=later))[self.first.pk], 7.0)
+
+    def test_rebase_keeps_scores(self):
+        trending.record_plays([(self.first.pk, 1)], now=self.t0)
+        trending.record_plays([(self.second.pk, 1 << 20)], now=self.t0)
+        # far enough for a rebase of the hour period only
+        later = self.t0 + (trending.REBASE_HALF_LIVES + 1) * 3600
+        trending.record_plays([(self.first.pk, 1)], now=later)
+
+        self.assertEqual(TrendingLandmark.objects.get(period='hour').landmark, later)
+        self.assertEqual(TrendingLandmark.objects.get(period='day').landmark, self.t0)
+        # negligible scores are pruned, the others keep their decayed value
+        self.assertEqual(dict(trending.top('song', 'hour', 10, now=later)), {self.first.pk: 1.0})
+        week = dict(trending.top('song', 'week', 10, now=later))
+        decay = 2 ** (-(later - self.t0) / trending.PERIODS['week'])
+        self.assertAlmostEqual(week[self.second.pk], (1 << 20) * decay)
+        self.assertAlmostEqual(week[self.first.pk], 1 + decay)
+
+    def test_charts(self):
+        trending.record_plays([(self.first.pk, 2), (self.second.pk, 1)])
+        data = self.client.get('/catalog/trending/?window=hour').json()
+        self.assertEqual([song['id'] for song in data['songs']], [self.first.pk, self.second.pk])
+        self.assertAlmostEqual(data['songs'][0]['score'], 2.0, places=3)
+        self.assertEqual(set(data), {'window', 'songs', 'albums', 'artists', 'categories'})
+
+        data = self.client.get('/catalog/trending/songs/?limit=1').json()
+        self.assertEqual([song['id'] for song in data['songs']], [self.first.pk])
+        self.assertEqual(self.client.get('/catalog/trending/?window=year').status_code, 400)
+        self.assertEqual(self.client.get('/catalog/trending/playlists/').status_code, 404)
+
+
+class StreamingTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(3)
+        self.playlist = Playlist.objects.first()
+        self.playlist.songs.add(*Song.objects.exclude(playlists=self.playlist), through_defaults={'position': 99})
+
+    def pages(self, url):
+        results = []
+        while url:
+            data = self.client.get(url).json()
+            results += data['results']
+            url = data['next']
+        return results
+
+    def test_stream_matches_pages(self):
+        urls = ['/catalog/songs/', '/catalog/artists/?fields=id,albums', f'/catalog/playlists/{self.playlist.pk}/songs/']
+        for url in urls:
+            for enabled in (True, False):
+                with self.subTest(url=url, compiled=enabled), override_settings(COMPILED_SERIALIZERS=enabled):
+                    response = self.client.get(url + ('&' if '?' in url else '?') + 'stream=1')
+                    self.assertTrue(response.streaming)
+                    self.assertEqual(json.loads(b''.join(response.streaming_content)), self.pages(url))
+
+
+    @override_settings(LIBRARY_EXPORT={'CHUNK_SIZE': 4})
+    def test_library_export(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/catalog/library/export/')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(sum(record['type'] == 'favorite' for record in records),
+                         FavoriteItem.objects.filter(user=self.user).count())
+        tracks = [record['id'] for record in records if record.get('playlist_id') == self.playlist.pk]
+        self.assertEqual(tracks, list(self.playlist.tracks.order_by('position', 'id').values_list('song_id', flat=True)))
+
+        response = self.client.get('/catalog/library/export/?output=csv')
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(b''.join(response.streaming_content)).decode())))
+        self.assertEqual([(row['type'], row['id'], row['name']) for row in rows],
+                         [(record['type'], str(record['id']), record['name']) for record in records])
+
+
+class AudioStreamTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        os.mkdir(os.path.join(directory.name, 'audio_file'))
+        self.content = bytes(range(256)) * 4
+        with open(os.path.join(directory.name, 'audio_file/song.mp3'), 'wb') as file:
+            file.write(self.content)
+        self.song = Song.objects.create(name='song', audio_file='audio_file/song.mp3', release_date=datetime.date(2024, 1, 1))
+        self.url = f'/catalog/songs/{self.song.pk}/stream/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.addCleanup(response.close)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_ranges(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertEqual((response['Accept-Ranges'], response['Content-Type']), ('bytes', 'audio/mpeg'))
+
+        cases = [
+            ('bytes=100-199', 100, 199),
+            ('bytes=1000-', 1000, 1023),
+            ('bytes=-10', 1014, 1023),
+            ('bytes=1000-5000', 1000, 1023),
+            ('bytes=-5000', 0, 1023),
+        ]
+        for header, start, end in cases:
+            with self.subTest(header=header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+                self.assertEqual(body, self.content[start:end + 1])
+
+        for header in ('bytes=1024-', 'bytes=-0', 'bytes=5-4'):
+            with self.subTest(header=header):
+                response, _ = self.get(HTTP_RANGE=header)
+                self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # malformed and multiple ranges get the whole file
+        for header in ('bytes=0-1,5-6', 'items=0-1', 'bytes=-'):
+            with self.subTest(header=header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_conditional_requests(self):
+        etag = self.get()[0]['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)[0].status_code, 206)
+        # the file changed since: the whole new file
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+        os.remove(os.path.join(settings.MEDIA_ROOT, 'audio_file/song.mp3'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ImportCatalogTests(APITestCase):
+
+    def run_import(self, directory, records, **options):
+        path = os.path.join(directory, 'delivery.jsonl')
+        with open(path, 'w') as file:
+            file.writelines(json.dumps(record) + '\n' for record in records)
+        call_command('import_catalog', path, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def test_import_upserts(self):
+        existing = Artist.objects.create(name='Existing')
+        records = [
+            {'name': f'Song {i}', 'audio_file': f'audio_file/{i}.mp3', 'artists': ['Existing', f'Guest {i % 2}'],
+             'album': 'Album', 'categories': ['Jazz'], 'duration': '3:25', 'release_date': '2024-01-01'}
+            for i in range(5)
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_import(directory, records + [{'name': 'no artists'}], batch_size=2)
+            self.assertEqual(Song.objects.count(), 5)
+            self.assertEqual(Artist.objects.count(), 3)
+            self.assertEqual(existing.songs.count(), 5)
+            self.assertEqual(Album.objects.get().artist, existing)
+            self.assertEqual(Song.categories.through.objects.count(), 5)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'delivery.jsonl.checkpoint')))
+
+            records[0].update(name='Renamed', artists=['Other'])
+            self.run_import(directory, records, batch_size=2)
+        song = Song.objects.get(audio_file='audio_file/0.mp3')
+        self.assertEqual(Song.objects.count(), 5)
+        self.assertEqual(song.name, 'Renamed')
+        self.assertEqual(list(song.artist.values_list('name', flat=True)), ['Other'])
+        self.assertEqual(song.duration, datetime.timedelta(minutes=3, seconds=25))
+
+    def test_out_of_range_values_are_invalid(self):
+        record = {'audio_file': 'audio_file/a.mp3', 'artists': ['A'], 'release_date': '2024-01-01'}
+        records = [
+            dict(record, name='Huge duration', duration=1e20),
+            dict(record, name='Huge text duration', duration='99999999999:00:00'),
+            dict(record, name='Popular', popularity=1e20),
+            dict(record, name='Fine', duration=60, popularity=3),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'delivery.jsonl')
+            with open(path, 'w') as file:
+                file.writelines(json.dumps(record) + '\n' for record in records)
+            stderr = io.StringIO()
+            call_command('import_catalog', path, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue().count('out of range') + stderr.getvalue().count('at most'), 3)
+        song = Song.objects.get()
+        self.assertEqual((song.name, song.duration), ('Fine', datetime.timedelta(seconds=60)))
+
+
+class CatalogCommandTests(APITestCase):
+
+    def generate(self, prefix):
+        call_command(
+            'generate_catalog', songs=60, artists=6, albums=10, categories=4, users=8, favorites=6,
+            playlist_size=4, seed=7, prefix=prefix, stdout=io.StringIO(),
+        )
+        songs = Song.objects.filter(audio_file__startswith=f'audio_file/{prefix}-').order_by('id')
+        return list(songs.values_list('name', 'duration', 'popularity'))
+
+    def test_generate_catalog(self):
+        first = self.generate('a')
+        self.assertEqual(len(first), 60)
+        self.assertEqual((Artist.objects.count(), Album.objects.count(), User.objects.count()), (6, 10, 8))
+        self.assertEqual(Playlist.objects.count(), 8)
+        # a long tail of plays
+        popularity = sorted((song[2] for song in first), reverse=True)
+        self.assertEqual(popularity[0], 1_000_000)
+        self.assertLess(popularity[-1], popularity[0] / 50)
+
+        # counters, search index and recommendations are built
+        self.assertTrue(FavoriteItem.objects.exists())
+        for kind in Favorite.KINDS:
+            self.assertEqual(counters.reconcile(kind, fix=False), ([], 0))
+        word = first[0][0].split()[0]
+        self.assertTrue(search.search(word)[0]['song'])
+        self.assertTrue(ItemNeighbor.objects.exists())
+
+        # the same seed generates the same catalog
+        self.assertEqual(self.generate('b'), first)
+
+    # the benchmark requests localhost, which DEBUG allows
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark_catalog(self):
+        self.generate('a')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            stderr = io.StringIO()
+            call_command('benchmark_catalog', iterations=3, warmup=1, output=path, compare=path,
+                         stdout=io.StringIO(), stderr=stderr)
+            with open(path) as file:
+                report = json.load(file)
+            self.assertIn('No regressions', stderr.getvalue())
+
+            self.assertEqual(report['dataset']['song'], 60)
+            self.assertEqual(set(report['endpoints']), set(benchmark_catalog.ENDPOINTS))
+            for name, result in report['endpoints'].items():
+                self.assertEqual(result['status_codes'], {'200': 3}, name)
+                latency = result['latency_ms']
+                self.assertLessEqual(latency['min'], latency['p50'])
+                self.assertLessEqual(latency['p50'], latency['p95'])
+                self.assertLessEqual(latency['p95'], latency['max'])
+
+            # a faster baseline flags every endpoint
+            for result in report['endpoints'].values():
+                result['latency_ms'].update(p50=1e-6, p95=1e-6)
+            with open(path, 'w') as file:
+                json.dump(report, file)
+            stderr = io.StringIO()
+            call_command('benchmark_catalog', iterations=2, warmup=0, endpoint=['album'], compare=path,
+                         stdout=io.StringIO(), stderr=stderr)
+            self.assertIn('2 regression(s)', stderr.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('benchmark_catalog', iterations=1, endpoint=['album'],
+                             compare=os.path.join(directory, 'missing.json'),
+                             stdout=io.StringIO(), stderr=io.StringIO())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([benchmark_catalog.percentile(values, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(benchmark_catalog.percentile([3.0], 99), 3.0)
+
+
+class AudioMetadataTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        os.mkdir(os.path.join(directory.name, 'audio_file'))
+        self.media = directory.name
+
+    def write(self, name, content):
+        with open(os.path.join(self.media, name), 'wb') as file:
+            file.write(content)
+
+    def test_jobs_fill_metadata(self):
+        # a one second 440Hz sine at half scale, 16-bit stereo
+        with wave.open(os.path.join(self.media, 'audio_file/tone.wav'), 'wb') as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(8000)
+            file.writeframes(b''.join(
+                int(16383 * math.sin(2 * math.pi * 440 * i / 8000)).to_bytes(2, 'little', signed=True) * 2
+                for i in range(8000)
+            ))
+        # 50 MPEG-1 layer III frames at 128kbit/s and 44.1kHz
+        self.write('audio_file/song.mp3', (b'\xff\xfb\x90\x64' + bytes(413)) * 50)
+        self.write('audio_file/notes.txt', b'not audio')
+
+        today = datetime.date(2024, 1, 1)
+        tone, song, notes = [
+            Song.objects.create(name=name, audio_file=f'audio_file/{name}', release_date=today)
+            for name in ('tone.wav', 'song.mp3', 'notes.txt')
+        ]
+        self.assertEqual(AudioMetadataJob.objects.filter(status=AudioMetadataJob.PENDING).count(), 3)
+        call_command('process_audio_jobs', once=True, stdout=io.StringIO())
+
+        tone.refresh_from_db()
+        self.assertEqual(tone.duration, datetime.timedelta(seconds=1))
+        self.assertEqual((tone.sample_rate, tone.bitrate), (8000, 256000))
+        self.assertAlmostEqual(tone.loudness, -9.03, places=1)
+        self.assertEqual(len(tone.content_hash), 64)
+        song.refresh_from_db()
+        self.assertEqual((song.sample_rate, song.bitrate), (44100, 128000))
+        self.assertAlmostEqual(song.duration.total_seconds(), 50 * 417 * 8 / 128000, places=2)
+        self.assertEqual(AudioMetadataJob.objects.get(song=notes).status, AudioMetadataJob.FAILED)
+
+        # saved again with the same file nothing is queued, a new file is
+        tone.save()
+        self.assertEqual(AudioMetadataJob.objects.get(song=tone).status, AudioMetadataJob.DONE)
+        tone.audio_file = 'audio_file/song.mp3'
+        tone.save()
+        self.assertEqual(AudioMetadataJob.objects.get(song=tone).status, AudioMetadataJob.PENDING)
+
+    def test_flac_streaminfo_and_replaygain(self):
+        # 48kHz 16-bit stereo, 5 seconds of samples, then a Vorbis comment with the track gain
+        info = bytearray(34)
+        info[10:18] = (48000 << 44 | 1 << 41 | 15 << 36 | 5 * 48000).to_bytes(8, 'big')
+        comments = [b'TITLE=x', b'REPLAYGAIN_TRACK_GAIN=-6.50 dB']
+        block = b''.join([
+            (4).to_bytes(4, 'little'), b'test', len(comments).to_bytes(4, 'little'),
+            *(len(comment).to_bytes(4, 'little') + comment for comment in comments),
+        ])
+        self.write('audio_file/song.flac', b''.join([
+            b'fLaC', b'\x00', len(info).to_bytes(3, 'big'), info,
+            b'\x84', len(block).to_bytes(3, 'big'), block, bytes(100000),
+        ]))
+        metadata = audio.analyze('audio_file/song.flac')
+        self.assertEqual(metadata['duration'], datetime.timedelta(seconds=5))
+        self.assertEqual((metadata['sample_rate'], metadata['bitrate']), (48000, 160000))
+        self.assertEqual(metadata['loudness'], -11.5)
+
+    def test_mp3_vbr_headers(self):
+        frame = b'\xff\xfb\x90\x64' + bytes(413)
+        # the Xing/Info tag follows the 32 bytes of stereo MPEG-1 side information
+        xing = bytearray(frame)
+        xing[36:52] = b'Info' + (3).to_bytes(4, 'big') + (40).to_bytes(4, 'big') + (40 * 417).to_bytes(4, 'big')
+        # VBRI always sits 32 bytes after the header: version, delay, quality, bytes, frames
+        vbri = bytearray(frame)
+        vbri[36:54] = b'VBRI' + bytes(6) + (40 * 417).to_bytes(4, 'big') + (40).to_bytes(4, 'big')
+        for name, first in (('xing', xing), ('vbri', vbri)):
+            # the table counts 40 frames of a longer file
+            self.write(f'audio_file/{name}.mp3', bytes(first) + frame * 60)
+            metadata = audio.analyze(f'audio_file/{name}.mp3')
+            self.assertAlmostEqual(metadata['duration'].total_seconds(), 40 * 1152 / 44100, places=3)
+            self.assertEqual(metadata['bitrate'], round(40 * 417 * 8 * 44100 / (40 * 1152)))
+
+    @override_settings(AUDIO_METADATA={'MAX_ATTEMPTS': 2, 'RETRY_DELAY': 60})
+    def test_failed_jobs_wait_before_a_retry(self):
+        song = Song.objects.create(name='gone', audio_file='audio_file/gone.mp3', release_date=datetime.date(2024, 1, 1))
+        with audio.make_executor(1) as executor, self.assertLogs('catalog.audio', 'WARNING'):
+            self.assertEqual(audio.run_batch(executor), (0, 0))
+            job = AudioMetadataJob.objects.get(song=song)
+            self.assertEqual((job.status, job.attempts), (AudioMetadataJob.PENDING, 1))
+            self.assertIn('FileNotFoundError', job.error)
+            self.assertGreater(job.not_before, timezone.now() + datetime.timedelta(seconds=50))
+            # not claimed again before then
+            self.assertIsNone(audio.run_batch(executor))
+
+            AudioMetadataJob.objects.update(not_before=timezone.now())
+            self.assertEqual(audio.run_batch(executor), (0, 1))
+        self.assertEqual(AudioMetadataJob.objects.get(song=song).status, AudioMetadataJob.FAILED)
+
+
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(PROFILING={'DIRECTORY': self.directory}))
+        self.user = make_catalog(1)
+        self.user.is_admin = True
+        self.user.save()
+
+    def test_staff_requests_are_profiled(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/catalog/songs/', HTTP_X_PROFILE='cprofile')
+        name = response['X-Profile-Report']
+        self.assertTrue(name.endswith('.prof'))
+        self.assertEqual(os.listdir(self.directory), [name])
+
+        reports = self.client.get('/profiles/').json()
+        self.assertEqual([report['name'] for report in reports], [name])
+        download = self.client.get(f'/profiles/{name}/')
+        self.addCleanup(download.close)
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            self.assertEqual(b''.join(download.streaming_content), file.read())
+
+        other = User.objects.create_user('fan@vexify.test', 'fan', datetime.date(2024, 1, 1), 'password')
+        self.client.force_authenticate(other)
+        self.assertNotIn('X-Profile-Report', self.client.get('/catalog/songs/', HTTP_X_PROFILE='cprofile'))
+        self.assertEqual(self.client.get('/profiles/').status_code, 403)
+        self.assertEqual(self.client.get(f'/profiles/{name}/').status_code, 403)
+
+    def test_reports_stay_out_of_media_root(self):
+        with override_settings(PROFILING={}):
+            location = profiling.get_storage().location
+        self.assertEqual(os.path.commonpath([location, settings.MEDIA_ROOT]), str(settings.BASE_DIR))
+        with override_settings(MEDIA_ROOT=self.directory, PROFILING={'DIRECTORY': os.path.join(self.directory, 'p')}):
+            with self.assertRaises(ImproperlyConfigured):
+                profiling.get_storage()
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        self.user = make_catalog(2)
+        self.user.is_admin = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                samples[name] = float(value)
+        return samples
+
+    def test_requests_are_observed_by_view(self):
+        labels = '{method="GET",view="SongViewSet.list"}'
+        before = self.scrape()
+        self.client.get('/catalog/songs/')
+        after = self.scrape()
+
+        for name in ('duration_seconds', 'db_seconds', 'queries', 'handler_python_seconds', 'render_seconds'):
+            key = f'vexify_request_{name}_count{labels}'
+            self.assertEqual(after[key] - before.get(key, 0), 1)
+        queries = f'vexify_request_queries_sum{labels}'
+        self.assertGreater(after[queries] - before.get(queries, 0), 0)
+        for name in ('handler_python_seconds', 'render_seconds'):
+            key = f'vexify_request_{name}_sum{labels}'
+            self.assertGreater(after[key] - before.get(key, 0), 0)
+        self.assertIn(f'vexify_response_size_bytes_bucket{{method="GET",view="SongViewSet.list",le="+Inf"}}', after)
+        self.assertIn('vexify_play_buffer_pending_plays', after)
+
+        other = User.objects.create_user('fan@vexify.test', 'fan', datetime.date(2024, 1, 1), 'password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/slow/').status_code, 403)
+
+    @override_settings(METRICS={'SLOW_REQUEST_SECONDS': 0})
+    def test_slow_requests_keep_their_sql(self):
+        with self.assertLogs('vexify.slow_requests', 'WARNING'):
+            self.client.get('/catalog/albums/')
+            entries = self.client.get('/metrics/slow/').json()
+        entry = next(entry for entry in entries if entry['view'] == 'AlbumViewSet.list')
+        self.assertEqual(entry['status'], 200)
+        self.assertTrue(entry['slowest_queries'])
+        self.assertIn('SELECT', entry['slowest_queries'][0]['sql'])
+        self.assertIn('render_time', entry)
+
+    def test_views_without_class_are_labelled_by_url_name(self):
+        self.client.get('/admin/login/')
+        self.assertIn('vexify_request_duration_seconds_count{method="GET",view="admin:login"}', self.scrape())
+
+    @override_settings(METRICS={'QUERIES_KEPT': 3, 'SLOW_QUERY_SECONDS': 0.25})
+    def test_only_the_slowest_queries_are_kept(self):
+        durations = [0.1, 0.5, 0.2, 0.4, 0.3, 0.05]
+        clock = [0.0]
+        for duration in durations:
+            clock += [clock[-1], clock[-1] + duration]
+        with mock.patch('vexify.metrics.time.perf_counter', side_effect=clock):
+            sample = metrics.RequestSample()
+            for index in range(len(durations)):
+                sample.execute(lambda *args: None, f'SELECT {index}', (), False, {})
+
+        self.assertEqual(sample.queries, 6)
+        kept = sample.slowest_queries()
+        self.assertEqual([sql for _, sql, _ in kept], ['SELECT 1', 'SELECT 3', 'SELECT 4'])
+        self.assertTrue(all(stack for _, _, stack in kept))
+
+
+class RendererTests(APITestCase):
+
+    def test_orjson_matches_drf(self):
+        data = {
+            'at': datetime.datetime(2024, 1, 2, 3, 4, 5, 6789, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2024, 1, 2),
+            'time': datetime.time(1, 2, 3, 4),
+            'duration': datetime.timedelta(minutes=3, seconds=5),
+            'price': decimal.Decimal('1.50'),
+            'text': 'line\u2028separator é',
+            1: [1.5, None, True, 2 ** 70],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+        song = Song.objects.get(pk=FavoriteItem.objects.filter(user=make_catalog(1), kind='song').first().item_id)
+        song.duration = datetime.timedelta(minutes=3, seconds=25)
+        song.save()
+        response = self.client.get(f'/catalog/songs/{song.pk}/')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertIn('"duration":"00:03:25"', response.content.decode())
+
+    def test_orjson_falls_back_for_non_finite_floats(self):
+        data = {'scores': [1.5, float('nan')], 'max': float('inf'), 'missing': None}
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+        with self.assertRaises(ValueError):
+            ORJSONRenderer().render(data)
+
+        lenient = type('LenientRenderer', (ORJSONRenderer,), {'strict': False})()
+        self.assertEqual(lenient.render(data), b'{"scores":[1.5,NaN],"max":Infinity,"missing":null}')
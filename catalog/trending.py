@@ -0,0 +1,145 @@
+"""
+Time-decayed trending charts.
+
+Every event adds ``weight * exp(lambda * (t - landmark))`` to the score of
+the song, album, artist and category it touches, once per period (hour,
+day, week) with a half-life equal to the period. This is forward decay:
+the decayed score at any time is the stored score times a factor shared by
+every row of the period, so ordering by the stored column is ordering by
+the decayed score and a top-N read is an index range scan of N rows.
+
+When the exponent grows too large the period is rebased: every score is
+scaled back to a new landmark in one UPDATE and negligible rows are pruned.
+"""
+import math
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Song, TrendingLandmark, TrendingScore
+
+PERIODS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+}
+
+DEFAULTS = {
+    'PLAY_WEIGHT': 1.0,
+    'FAVORITE_WEIGHT': 5.0,
+    'MAX_LIMIT': 100,
+}
+
+# rebase once scores are scaled by 2 ** REBASE_HALF_LIVES
+REBASE_HALF_LIVES = 256
+# decayed scores under this are dropped on rebase
+PRUNE_BELOW = 1e-3
+
+
+def get_setting(name):
+    return getattr(settings, 'TRENDING', {}).get(name, DEFAULTS[name])
+
+
+def decay_rate(period):
+    return math.log(2) / PERIODS[period]
+
+
+# ---------- Landmarks ----------
+def _landmarks(now):
+    landmarks = dict(TrendingLandmark.objects.values_list('period', 'landmark'))
+    for period in PERIODS:
+        if period not in landmarks:
+            landmark, _ = TrendingLandmark.objects.get_or_create(period=period, defaults={'landmark': now})
+            landmarks[period] = landmark.landmark
+        elif (now - landmarks[period]) / PERIODS[period] > REBASE_HALF_LIVES:
+            landmarks[period] = rebase(period, now)
+    return landmarks
+
+
+def rebase(period, now):
+    """Move the landmark of a period to ``now`` and prune negligible scores."""
+    with transaction.atomic():
+        landmark = TrendingLandmark.objects.select_for_update().get(period=period)
+        factor = math.exp(-decay_rate(period) * (now - landmark.landmark))
+        scores = TrendingScore.objects.filter(period=period)
+        scores.filter(score__lt=PRUNE_BELOW / factor).delete()
+        scores.update(score=F('score') * factor)
+        landmark.landmark = now
+        landmark.save(update_fields=['landmark'])
+    return now
+
+
+# ---------- Recording ----------
+def _expand_songs(song_weights):
+    """Spread song weights onto their albums, artists and categories."""
+    weights = defaultdict(float)
+    for song_id, weight in song_weights.items():
+        weights[('song', song_id)] += weight
+
+    song_ids = list(song_weights)
+    for song_id, album_id in Song.objects.filter(pk__in=song_ids, album__isnull=False).values_list('id', 'album_id'):
+        weights[('album', album_id)] += song_weights[song_id]
+    for song_id, artist_id in Song.artist.through.objects.filter(song_id__in=song_ids).values_list('song_id', 'artist_id'):
+        weights[('artist', artist_id)] += song_weights[song_id]
+    for song_id, category_id in Song.categories.through.objects.filter(song_id__in=song_ids).values_list('song_id', 'category_id'):
+        weights[('category', category_id)] += song_weights[song_id]
+    return weights
+
+
+def record(weights, now=None):
+    """Add {(kind, item_id): weight} to the scores of every period in one batched upsert."""
+    if not weights:
+        return
+    now = now or time.time()
+    quote = connection.ops.quote_name
+    table = quote(TrendingScore._meta.db_table)
+    sql = (
+        f'INSERT INTO {table} ({quote("kind")}, {quote("period")}, {quote("item_id")}, {quote("score")}) '
+        f'VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT ({quote("kind")}, {quote("period")}, {quote("item_id")}) '
+        f'DO UPDATE SET {quote("score")} = {table}.{quote("score")} + excluded.{quote("score")}'
+    )
+
+    with transaction.atomic():
+        landmarks = _landmarks(now)
+        rows = []
+        for period, landmark in landmarks.items():
+            scale = math.exp(decay_rate(period) * (now - landmark))
+            rows.extend((kind, period, item_id, weight * scale) for (kind, item_id), weight in weights.items())
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def record_plays(song_counts, now=None):
+    weight = get_setting('PLAY_WEIGHT')
+    record(_expand_songs({song_id: count * weight for song_id, count in song_counts}), now=now)
+
+
+def record_favorites(items, now=None):
+    """items: iterable of (kind, item_id) newly favorited."""
+    weight = get_setting('FAVORITE_WEIGHT')
+    songs = defaultdict(float)
+    weights = defaultdict(float)
+    for kind, item_id in items:
+        if kind == 'song':
+            songs[item_id] += weight
+        elif kind in ('album', 'artist'):
+            weights[(kind, item_id)] += weight
+    for key, value in _expand_songs(songs).items():
+        weights[key] += value
+    record(weights, now=now)
+
+
+# ---------- Reading ----------
+def top(kind, period, limit, now=None):
+    """Return [(item_id, decayed score)] of the top ``limit`` items."""
+    now = now or time.time()
+    landmark = TrendingLandmark.objects.filter(period=period).values_list('landmark', flat=True).first()
+    if landmark is None:
+        return []
+    factor = math.exp(-decay_rate(period) * (now - landmark))
+    rows = TrendingScore.objects.filter(kind=kind, period=period).order_by('-score')[:limit]
+    return [(item_id, score * factor) for item_id, score in rows.values_list('item_id', 'score')]
@@ -12,5 +12,8 @@ router.register('favorites', views.FavoriteViewSet )
 urlpatterns=[
     path('', include(router.urls)),
     path('recommendation/', views.RecommendationView.as_view(),name='recommendation'),
-    path('search/', views.SearchCatalogView.as_view(),name='search')
+    path('search/', views.SearchCatalogView.as_view(),name='search'),
+    path('trending/', views.TrendingView.as_view(), name='trending'),
+    path('trending/<str:chart>/', views.TrendingView.as_view(), name='trending-chart'),
+    path('library/export/', views.LibraryExportView.as_view(), name='library-export'),
 ]
\ No newline at end of file
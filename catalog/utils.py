@@ -0,0 +1,29 @@
+from itertools import islice
+
+# largest value of a 64-bit signed integer column, bigger ids overflow the database driver
+MAX_ID = (1 << 63) - 1
+
+
+def in_order(queryset, ids):
+    """Fetch the rows of ``queryset`` with the given ids, keeping the order of ``ids``."""
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def batched(iterable, size):
+    """Lists of up to ``size`` items of ``iterable``."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def parse_id(value):
+    """``value`` as a primary key, None unless it's an integer (or its string) in 1..MAX_ID."""
+    # floats would be truncated, bools are ints
+    if not isinstance(value, (int, str)) or isinstance(value, bool):
+        return None
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return None
+    return pk if 1 <= pk <= MAX_ID else None
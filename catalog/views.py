@@ -1,52 +1,147 @@
 from django.contrib.admin.utils import flatten
 from django.db.models import Count, Q, F
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.text import re_camel_case
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from . import export, favorites, membership, playlists, recommender, search, sparse, trending
+from vexify.metrics import HandlerTimingMixin
+from vexify.profiling import ProfilingMixin
+from .cache import CachedResponseMixin
+from .compiled import CompiledListMixin, render_in_order, render_queryset
+from .eager import EagerLoadingMixin, eager_load
+from .jsonstream import StreamingListMixin
 from .models import Category, Artist, Song, Album, Playlist, Favorite
+from .pagination import PopularityPagination, ReleaseDatePagination, NamePagination, CreatedAtPagination, \
+    TrackPagination, first_page
+from .plays import get_play_buffer
 from .permisions import IsAdminOrReadOnly, IsOwnerOrAdminOrReadOnly
+from .utils import MAX_ID, in_order, parse_id
+from .streaming import PassthroughContentNegotiation, file_response
 from .serializers import CategorySerializer, ArtistSerializer, SongSerializer, SongLightSerializer, AlbumSerializer, \
     PlaylistSerializer, FavoriteSerializer, AlbumLightSerializer, ArtistLightSerializer, PlaylistLightSerializer
 
 
 # Create your views here.
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ProfilingMixin, HandlerTimingMixin, StreamingListMixin, CachedResponseMixin, CompiledListMixin,
+                      EagerLoadingMixin, viewsets.ModelViewSet):
+    cache_kind = 'category'
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = NamePagination
 
-class ArtistViewSet(viewsets.ModelViewSet):
+class ArtistViewSet(ProfilingMixin, HandlerTimingMixin, StreamingListMixin, CachedResponseMixin, CompiledListMixin,
+                    EagerLoadingMixin, viewsets.ModelViewSet):
+    cache_kind = 'artist'
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = NamePagination
 
     @action(detail=True, methods=['get'])
     def top_songs(self, request, pk=None):
         artist = self.get_object()
-        top_songs = artist.songs.order_by('-popularity')
-        serializer = SongLightSerializer(top_songs, many=True, context={'request':request})
-        return Response(serializer.data)
+        return self.render_page(artist.songs.all(), SongLightSerializer, PopularityPagination())
 
 
-class AlbumViewSet(viewsets.ModelViewSet):
+class AlbumViewSet(ProfilingMixin, HandlerTimingMixin, StreamingListMixin, CachedResponseMixin, CompiledListMixin,
+                   EagerLoadingMixin, viewsets.ModelViewSet):
+    cache_kind = 'album'
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = ReleaseDatePagination
 
-class SongViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def songs(self, request, pk=None):
+        album = self.get_object()
+        return self.render_page(album.songs.all(), SongLightSerializer, PopularityPagination())
+
+class SongViewSet(ProfilingMixin, HandlerTimingMixin, StreamingListMixin, CachedResponseMixin, CompiledListMixin,
+                  EagerLoadingMixin, viewsets.ModelViewSet):
+    cache_kind = 'song'
     queryset = Song.objects.all()
     serializer_class = SongSerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = PopularityPagination
 
-class PlaylistViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], content_negotiation_class=PassthroughContentNegotiation)
+    def stream(self, request, pk=None):
+        song = self.get_object()
+        if not song.audio_file:
+            raise Http404('Song has no audio file')
+        try:
+            return file_response(request, song.audio_file)
+        except FileNotFoundError:
+            raise Http404('Audio file not found')
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def play(self, request, pk=None):
+        # buffered, see catalog.plays; unknown ids are ignored by the flush
+        song_id = parse_id(pk)
+        if song_id is None:
+            return Response({"error": 'Invalid song id'}, status=status.HTTP_400_BAD_REQUEST)
+        get_play_buffer().record(song_id)
+        return Response({"success": 'Play recorded'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def play_stats(self, request):
+        return Response(get_play_buffer().stats())
+
+class PlaylistViewSet(ProfilingMixin, HandlerTimingMixin, StreamingListMixin, CompiledListMixin, EagerLoadingMixin,
+                      viewsets.ModelViewSet):
     queryset = Playlist.objects.all()
     serializer_class = PlaylistSerializer
     permission_classes = [IsAuthenticatedOrReadOnly,IsOwnerOrAdminOrReadOnly]
+    pagination_class = CreatedAtPagination
+
+    @action(detail=True, methods=['get'], url_path='songs')
+    def list_songs(self, request, pk=None):
+        playlist = self.get_object()
+        songs = playlist.songs.annotate(track_position=F('playlist_tracks__position'))
+        return self.render_page(songs, SongSerializer, TrackPagination())
+
+    @action(detail=True, methods=['get'])
+    def tracks(self, request, pk=None):
+        """Songs [offset, offset + limit) in playlist order."""
+        playlist = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), playlists.MAX_WINDOW))
+            # the end of the window must fit the database's OFFSET
+            offset = min(max(0, int(request.query_params.get('offset', 0))), MAX_ID - limit)
+        except ValueError:
+            return Response({"error": 'offset and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        song_ids = playlists.window(playlist, offset, limit)
+        return Response({
+            'count': playlist.tracks.count(),
+            'offset': offset,
+            'results': render_in_order(SongSerializer, Song.objects.all(), song_ids, request),
+        })
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """{"song_id": 1, "after": 2} or {"song_id": 1, "before": 2}, null anchors are the start / the end."""
+        playlist = self.get_object()
+        before = 'before' in request.data
+        if not request.data.get('song_id') or before == ('after' in request.data):
+            return Response({"error": 'song_id and one of after/before are required!'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        song_id = parse_id(request.data['song_id'])
+        anchor = request.data['before' if before else 'after']
+        anchor_id = parse_id(anchor)
+        if song_id is None or (anchor is not None and anchor_id is None):
+            return Response({"error": 'song_id and after/before must be song ids'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            playlists.move(playlist, song_id, anchor_id, before)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"success": 'Song moved'}, status=status.HTTP_200_OK)
 
     @action(detail=True , methods=['post'])
     def add_song(self,request, pk=None):
@@ -60,7 +155,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
             return Response({"error": 'Song dose not exists'}, status=status.HTTP_400_BAD_REQUEST)
         if playlist.songs.filter(id=song.id).exists():
             return Response({"error": 'Song already exists'}, status=status.HTTP_400_BAD_REQUEST)
-        playlist.songs.add(song)
+        playlists.add_songs(playlist, [song.pk])
         return Response({"success": 'Song added'}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
@@ -78,253 +173,254 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         playlist.songs.remove(song)
         return Response({"success": 'Song removed'}, status=status.HTTP_200_OK)
 
+    # -------- Bulk edits, see catalog.playlists --------
+    def _bulk(self, request, operation):
+        playlist = self.get_object()
+        try:
+            return Response(operation(playlist, request.data.get('song_ids')), status=status.HTTP_200_OK)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['post'])
+    def add_songs(self, request, pk=None):
+        return self._bulk(request, playlists.add_songs)
 
-class FavoriteViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'])
+    def remove_songs(self, request, pk=None):
+        return self._bulk(request, playlists.remove_songs)
+
+    @action(detail=True, methods=['post'])
+    def set_songs(self, request, pk=None):
+        return self._bulk(request, playlists.set_songs)
+
+    @action(detail=True, methods=['get'])
+    def contains(self, request, pk=None):
+        """?song=1,2,3 -> {"song": "101"}, one bit per requested id."""
+        playlist = self.get_object()
+        try:
+            ids = membership.parse_ids(request.query_params.get('song', ''))
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'song': membership.contains(membership.playlist_song_ids(playlist.pk), ids)})
+
+
+class FavoriteViewSet(ProfilingMixin, HandlerTimingMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     queryset = Favorite.objects.all()
     serializer_class = FavoriteSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrAdminOrReadOnly]
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
 
     def perform_create(self, serializer):
         # Automatically assign the current user when creating a Favorite
         serializer.save(user=self.request.user)
 
     # -------- Generic Add/Remove Helper --------
-    def _add_item(self,request, model,related_name):
-        item_id = request.data.get('id')
-        if not item_id:
-            return Response({"error":"id is required!"}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            item = model.objects.get(id=item_id)
-        except model.DoesNotExist:
-            return Response({"error": f'{model.__name__} does not exist!'}, status=status.HTTP_400_BAD_REQUEST)
-
-        favorite , _ = Favorite.objects.get_or_create(user=request.user)
-        relation = getattr(favorite, related_name)
-
-        if relation.filter(id=item.id).exists():
+    def _item_id(self, request, model):
+        """(id, None) for an existing item, (None, error Response) otherwise."""
+        if not request.data.get('id'):
+            return None, Response({"error":"id is required!"}, status=status.HTTP_400_BAD_REQUEST)
+        item_id = parse_id(request.data['id'])
+        if item_id is None:
+            return None, Response({"error": 'id must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not model.objects.filter(id=item_id).exists():
+            return None, Response({"error": f'{model.__name__} does not exist!'}, status=status.HTTP_400_BAD_REQUEST)
+        return item_id, None
+
+    def _add_item(self, request, kind):
+        model = Favorite.KINDS[kind]
+        item_id, error = self._item_id(request, model)
+        if error:
+            return error
+        if not favorites.add(request.user.pk, kind, item_id):
             return Response({"error": f"{model.__name__} already in favorites"}, status=status.HTTP_400_BAD_REQUEST)
-
-        relation.add(item)
         return Response({"success": f"{model.__name__} added to favorites"}, status=status.HTTP_200_OK)
 
-    def _remove_item(self,request, model,related_name):
-        item_id = request.data.get('id')
-        if not item_id:
-            return Response({"error":"id is required!"}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            item = model.objects.get(id=item_id)
-        except model.DoesNotExist:
-            return Response({"error": f'{model.__name__} does not exist!'}, status=status.HTTP_400_BAD_REQUEST)
-
-        favorite , _ = Favorite.objects.get_or_create(user=request.user)
-        relation = getattr(favorite, related_name)
-
-        if not relation.filter(id=item.id).exists():
+    def _remove_item(self, request, kind):
+        model = Favorite.KINDS[kind]
+        item_id, error = self._item_id(request, model)
+        if error:
+            return error
+        if not favorites.remove(request.user.pk, kind, item_id):
             return Response({"error": f"{model.__name__} not in favorites"}, status=status.HTTP_400_BAD_REQUEST)
-
-        relation.remove(item)
         return Response({"success": f"{model.__name__} removed from favorites"}, status=status.HTTP_200_OK)
 
     # -------- Actions --------
+    @action(detail=False, methods=['get'])
+    def contains(self, request):
+        """?song=1,2&album=3 -> {"song": "10", "album": "1"}, one bit per requested id."""
+        requested = {}
+        try:
+            for kind in Favorite.KINDS:
+                if kind in request.query_params:
+                    requested[kind] = membership.parse_ids(request.query_params[kind])
+        except ValueError as exc:
+            return Response({"error": f"{kind}: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not requested:
+            return Response({"error": f"Pass ids per kind ({', '.join(Favorite.KINDS)}), e.g. ?song=1,2"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        favorites = membership.favorite_ids(request.user.pk)
+        return Response({kind: membership.contains(favorites[kind], ids) for kind, ids in requested.items()})
+
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """{"operations": [{"op": "add", "kind": "song", "id": 1}, ...]}, applied in order, see catalog.favorites."""
+        try:
+            return Response(favorites.sync(request.user, request.data.get('operations')), status=status.HTTP_200_OK)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['post'])
     def add_song(self,request):
-        return self._add_item(request,Song,'songs')
+        return self._add_item(request, 'song')
 
     @action(detail=False, methods=['post'])
     def remove_song(self,request):
-        return self._remove_item(request,Song,'songs')
+        return self._remove_item(request, 'song')
 
     @action(detail=False, methods=['post'])
     def add_album(self,request):
-        return self._add_item(request,Album,'albums')
+        return self._add_item(request, 'album')
 
     @action(detail=False, methods=['post'])
     def remove_album(self,request):
-        return self._remove_item(request,Album,'albums')
+        return self._remove_item(request, 'album')
 
     @action(detail=False, methods=['post'])
     def add_artist(self,request):
-        return self._add_item(request,Artist,'artists')
+        return self._add_item(request, 'artist')
 
     @action(detail=False, methods=['post'])
     def remove_artist(self,request):
-        return self._remove_item(request,Artist,'artists')
+        return self._remove_item(request, 'artist')
 
     @action(detail=False, methods=['post'])
     def add_playlist(self,request):
-        return self._add_item(request,Playlist,'playlists')
+        return self._add_item(request, 'playlist')
 
     @action(detail=False, methods=['post'])
     def remove_playlist(self,request):
-        return self._remove_item(request,Playlist,'playlists')
+        return self._remove_item(request, 'playlist')
 
 
-class RecommendationView(APIView):
+class RecommendationView(ProfilingMixin, HandlerTimingMixin, APIView):
    permission_classes = [AllowAny]
 
    def get(self,request):
-
-    # ---------- STEP 1: User favorites ----------
     user = request.user if request.user.is_authenticated else None
-    if user:
-        try :
-            user_fav = Favorite.objects.get(user=user)
-            fav_songs = user_fav.songs.all()
-            fav_artists = user_fav.artists.all()
-            fav_albums = user_fav.albums.all()
-            fav_playlists = user_fav.playlists.all()
-        except Favorite.DoesNotExist:
-            fav_songs = fav_albums = fav_artists = fav_playlists = []
-    else:
-        fav_songs = fav_albums = fav_artists = fav_playlists = []
+    # ?fields= and ?expand= apply to the items of every list
+    selection = sparse.from_request(request)
+    variant = None if selection == sparse.ALL else selection
+    origin = f'{request.scheme}://{request.get_host()}'
+    return Response(recommender.cached(user, lambda: self.build(request, user), variant, origin))
 
+   def build(self, request, user):
 
-    # ---------- STEP 2: Similar users ----------
-    if user and fav_songs:
-        similar_users_favs = Favorite.objects.filter(
-            Q(songs__in=fav_songs) |
-            Q(artists__in=fav_artists) |
-            Q(albums__in=fav_albums) |
-            Q(playlists__in=fav_playlists)
-        ).exclude(user=user).distinct()
-
-    else:
-        similar_users_favs = Favorite.objects.none()
-
+    # ---------- STEP 1: User favorites ----------
+    favorites = recommender.user_favorites(user) if user else {}
+    fav_songs = favorites.get('song')
 
-    # ---------- STEP 3: Collect favorites items from similar users favs ----------
-    similar_songs = Song.objects.filter(favorites__in=similar_users_favs).distinct()
-    similar_albums = Album.objects.filter(favorited_by__in=similar_users_favs).distinct()
-    similar_artists = Artist.objects.filter(favorited_by__in=similar_users_favs).distinct()
-    similar_playlists = Playlist.objects.filter(favorited_by__in=similar_users_favs).distinct()
+    # ---------- STEP 2: Merge precomputed neighbours of the favorites ----------
+    recommended = recommender.recommend(favorites)
 
-    # ---------- STEP 4: Category-based songs ----------
+    # ---------- STEP 3: Category-based ----------
     if fav_songs:
         related_categories = Category.objects.filter(songs__in=fav_songs).distinct()
     else:
         related_categories = Category.objects.all()
 
-    category_songs = Song.objects.filter(
-        categories__in=related_categories
-    ).distinct()
-
-    if fav_songs:
-        category_songs =  category_songs.exclude(id__in=fav_songs.values_list('id', flat=True))
-
-    # ---------- STEP 5: Popularity fallback ----------
-    popular_songs = Song.objects.all().order_by('-popularity')
-
-    # ---------- STEP 6: Combine + weight results ----------
-    recommended_songs = similar_songs.annotate(
-        fav_count=Count('favorites')
-    ).order_by('-fav_count','-popularity')
-    if fav_songs:
-        recommended_songs = recommended_songs.exclude(id__in=fav_songs.values_list('id', flat=True))
-
-
-    recommended_albums = similar_albums.annotate(
-        fav_count=Count('favorited_by')
-    ).order_by('-fav_count')
-    if  fav_albums:
-        recommended_albums = recommended_albums.exclude(id__in=fav_albums.values_list('id',flat=True))
-
-
-    recommended_artists = similar_artists.annotate(
-        fav_count=Count('favorited_by')
-    ).order_by('-fav_count')
-
-    if fav_artists:
-        recommended_artists = recommended_artists.exclude(id__in=fav_artists.values_list('id',flat=True))
-
-
-    recommended_playlists = similar_playlists.annotate(
-        fav_count = Count('favorited_by')
-    ).order_by('-fav_count')
-
-    if fav_playlists:
-        recommended_playlists = recommended_playlists.exclude(id__in=fav_playlists.values_list('id',flat=True))
-
-
     recommended_categories = related_categories.annotate(
         song_count = Count('songs')
     ).order_by('-song_count')
 
-    # ---------- STEP 7: Serialize ----------
+    # ---------- STEP 4: Popularity fallback ----------
+    popular_songs = first_page(Song.objects.all(), PopularityPagination.ordering)
+
+    # ---------- STEP 5: Serialize ----------
     data = {
-        'recommended_songs': SongSerializer(recommended_songs, many=True, context={'request': request}).data,
-        'recommended_albums': AlbumLightSerializer(recommended_albums, many=True, context={'request': request}).data,
-        'recommended_artists': ArtistLightSerializer(recommended_artists, many=True, context={'request': request}).data,
-        'recommended_playlists': PlaylistSerializer(recommended_playlists, many=True, context={'request': request}).data,
-        'recommended_categories': CategorySerializer(recommended_categories, many=True, context={'request': request}).data,
-        'popular_songs': SongSerializer(popular_songs, many=True, context={'request': request}).data
+        'recommended_songs': render_in_order(SongSerializer, Song.objects.all(), recommended['song'], request),
+        'recommended_albums': render_in_order(AlbumLightSerializer, Album.objects.all(), recommended['album'], request),
+        'recommended_artists': render_in_order(ArtistLightSerializer, Artist.objects.all(), recommended['artist'], request),
+        'recommended_playlists': render_in_order(PlaylistSerializer, Playlist.objects.all(), recommended['playlist'], request),
+        'recommended_categories': render_queryset(CategorySerializer, recommended_categories, request),
+        'popular_songs': render_queryset(SongSerializer, popular_songs, request),
     }
 
-    return Response(data)
+    return data
 
 
-class SearchCatalogView(APIView):
+class TrendingView(ProfilingMixin, HandlerTimingMixin, APIView):
+    permission_classes = [AllowAny]
 
-    def get(self, request):
-        q= request.GET.get('q').lower()
+    charts = {
+        'songs': ('song', Song, SongLightSerializer),
+        'albums': ('album', Album, AlbumLightSerializer),
+        'artists': ('artist', Artist, ArtistLightSerializer),
+        'categories': ('category', Category, CategorySerializer),
+    }
 
-        # ---------- Songs ----------a
-        songs = Song.objects.filter(
-            Q(name__icontains=q) | Q(artist__name__icontains=q)
-        ).order_by('-popularity').distinct()[:20]
+    def get(self, request, chart=None):
+        if chart is not None and chart not in self.charts:
+            return Response({"error": f"Unknown chart '{chart}'"}, status=status.HTTP_404_NOT_FOUND)
 
-        # ---------- Albums ----------
-        albums = Album.objects.filter(
-            Q(name__icontains=q) | Q(artist__name__icontains=q)
-        ).annotate(score=Count('favorited_by')).order_by('-score').distinct()[:10]
+        window = request.GET.get('window', 'day')
+        if window not in trending.PERIODS:
+            return Response({"error": f"window must be one of {', '.join(trending.PERIODS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.GET.get('limit', 20 if chart else 10))
+        except ValueError:
+            return Response({"error": 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, trending.get_setting('MAX_LIMIT')))
+
+        data = {'window': window}
+        for name in [chart] if chart else self.charts:
+            kind, model, serializer_class = self.charts[name]
+            scores = dict(trending.top(kind, window, limit))
+            context = {'request': request}
+            items = in_order(eager_load(model.objects.all(), serializer_class, context), list(scores))
+            data[name] = serializer_class(items, many=True, context=context).data
+            for obj, item in zip(items, data[name]):
+                item['score'] = scores[obj.pk]
 
-        # ---------- Artists ----------
-        artists = Artist.objects.filter(name__icontains=q).annotate(
-            score=Count('favorited_by')
-        ).order_by('-score').distinct()[:10]
+        return Response(data)
 
-        # ---------- Playlists ----------
-        playlists = Playlist.objects.filter(name__icontains=q).annotate(
-            score=Count('favorited_by')
-        ).order_by('-score').distinct()[:10]
 
-        # ---------- Categories ----------
-        categories = Category.objects.filter(name__icontains=q).annotate(
-            score=Count('songs')
-        ).order_by('-score').distinct()[:10]
+class SearchCatalogView(ProfilingMixin, HandlerTimingMixin, APIView):
 
+    def get(self, request):
+        q = request.GET.get('q', '')
+
+        # ---------- One ranked pass over the search index ----------
+        results, top = search.search(q)
+
+        context = {'request': request}
+        songs = in_order(eager_load(Song.objects.all(), SongLightSerializer, context), results['song'])
+        artists = in_order(eager_load(Artist.objects.all(), ArtistLightSerializer, context), results['artist'])
+        albums = in_order(eager_load(Album.objects.all(), AlbumLightSerializer, context), results['album'])
+        playlists = in_order(eager_load(Playlist.objects.all(), PlaylistLightSerializer, context), results['playlist'])
+        categories = in_order(eager_load(Category.objects.all(), CategorySerializer, context), results['category'])
 
         # ---------- Top Result ----------
         top_result = None
 
-        priority_order = [
-            (songs, SongLightSerializer),
-            (artists, ArtistLightSerializer),
-            (albums, AlbumLightSerializer),
-            (playlists, PlaylistLightSerializer),
-            (categories, CategorySerializer),
-        ]
-
-        for model_list , serializer in priority_order:
-
-            for item in model_list:
-                if item.name.lower() == q:
-                    top_result = serializer(item, context={'request': request}).data
-                    top_result['type'] = item._meta.model_name
-                    break
-            if top_result:
-                break
-
-        if not top_result:
-            for model_list, serializer in priority_order:
-                if model_list.exists():
-                    top_result = serializer(model_list[0],context={'request': request}).data
-                    top_result['type'] = item._meta.model_name
-                    break
+        serializers = {
+            'song': (songs, SongLightSerializer),
+            'artist': (artists, ArtistLightSerializer),
+            'album': (albums, AlbumLightSerializer),
+            'playlist': (playlists, PlaylistLightSerializer),
+            'category': (categories, CategorySerializer),
+        }
+
+        if top:
+            kind, item_id = top
+            model_list, serializer = serializers[kind]
+            item = next((item for item in model_list if item.id == item_id), None)
+            if item is not None:
+                top_result = serializer(item, context={'request': request}).data
+                top_result['type'] = kind
 
         data = {
             'top_result' : top_result,
@@ -336,3 +432,19 @@ class SearchCatalogView(APIView):
         }
 
         return Response(data)
+
+
+class LibraryExportView(ProfilingMixin, HandlerTimingMixin, APIView):
+    """The user's favorites and playlist tracks as a gzipped download, see catalog.export."""
+    permission_classes = [IsAuthenticated]
+    # the response is a raw file, ?format= is taken by DRF
+    content_negotiation_class = PassthroughContentNegotiation
+
+    def get(self, request):
+        output = request.GET.get('output', 'jsonl')
+        if output not in export.OUTPUTS:
+            return Response({"error": f"output must be one of {', '.join(export.OUTPUTS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(export.export(request.user.pk, output), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{export.filename(request.user.pk, output)}"'
+        return response
@@ -0,0 +1,250 @@
+"""
+In-process request metrics.
+
+RequestMetricsMiddleware fills a RequestSample per request (wall, DB,
+handler and render time, query count, response size) and observes it into
+histograms labelled by view. Handler time is the Python time of views using
+HandlerTimingMixin outside database queries (serializers building the data,
+but also permission checks, pagination and the rest of the handler); render
+time is added by the renderers of vexify.renderers. Collectors registered with
+``register_collector`` add gauges computed at scrape time. Everything is
+exposed in the Prometheus text format by MetricsView; each worker process
+keeps its own numbers.
+"""
+import bisect
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_QUERY_SECONDS': 0.1,    # queries slower than this keep their stack
+    'SLOW_REQUESTS_KEPT': 20,
+    'QUERIES_KEPT': 50,           # slowest queries per request, for the slow request log
+}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def get_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+# ---------- Histograms ----------
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        return list(zip([*self.buckets, '+Inf'], itertools.accumulate(self.counts)))
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}      # name -> (help, buckets, {labels: Histogram})
+        self._collectors = []
+
+    def histogram(self, name, help_text, buckets):
+        self._metrics.setdefault(name, (help_text, buckets, {}))
+
+    def observe(self, name, labels, value):
+        _, buckets, series = self._metrics[name]
+        with self._lock:
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def register_collector(self, collector):
+        """collector() returns [(name, type, help, [(labels dict, value)])]."""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, _, series) in self._metrics.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for labels, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{_labels(dict(labels, le=bound))} {count}')
+                    lines.append(f'{name}_sum{_labels(dict(labels))} {histogram.sum}')
+                    lines.append(f'{name}_count{_labels(dict(labels))} {histogram.count}')
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_labels(labels)} {value}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+registry = Registry()
+registry.histogram('vexify_request_duration_seconds', 'Wall time of requests.', SECONDS_BUCKETS)
+registry.histogram('vexify_request_db_seconds', 'Time spent in database queries per request.', SECONDS_BUCKETS)
+registry.histogram('vexify_request_queries', 'Database queries per request.', QUERY_BUCKETS)
+registry.histogram(
+    'vexify_request_handler_python_seconds',
+    'Python time of view handlers per request, database queries excluded.', SECONDS_BUCKETS,
+)
+registry.histogram('vexify_request_render_seconds', 'Time spent rendering response bodies per request.', SECONDS_BUCKETS)
+registry.histogram('vexify_response_size_bytes', 'Response body size, streaming responses excluded.', BYTES_BUCKETS)
+
+register_collector = registry.register_collector
+
+
+# ---------- Per-request samples ----------
+_current = contextvars.ContextVar('request_sample', default=None)
+
+
+class RequestSample:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.handler_time = 0.0
+        self.render_time = 0.0
+        self.sql = []           # min-heap of (duration, n, sql, stack or None), the QUERIES_KEPT slowest
+        self._order = itertools.count()
+        self.queries_kept = get_setting('QUERIES_KEPT')
+        self.slow_query = get_setting('SLOW_QUERY_SECONDS')
+
+    def execute(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_time += elapsed
+            self.queries += 1
+            if len(self.sql) < self.queries_kept:
+                heapq.heappush(self.sql, self._query(elapsed, sql))
+            elif self.sql and elapsed > self.sql[0][0]:
+                heapq.heapreplace(self.sql, self._query(elapsed, sql))
+
+    def _query(self, elapsed, sql):
+        stack = ''.join(traceback.format_stack(limit=16)[:-2]) if elapsed >= self.slow_query else None
+        return elapsed, next(self._order), sql, stack
+
+    def slowest_queries(self):
+        """(duration, sql, stack or None) of the kept queries, slowest first."""
+        return [(duration, sql, stack) for duration, _, sql, stack in sorted(self.sql, reverse=True)]
+
+
+def activate(sample):
+    return _current.set(sample)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextlib.contextmanager
+def rendering():
+    """Adds the time of the block to the render time of the request."""
+    sample = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if sample is not None:
+            sample.render_time += time.perf_counter() - started
+
+
+class HandlerTimingMixin:
+    """Adds the time the handler of APIViews spends outside database queries to the handler time."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        sample = _current.get()
+        if sample is not None:
+            # after authentication, token checks are measured by the request duration only
+            self._handler_started = (time.perf_counter(), sample.db_time)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        started = getattr(self, '_handler_started', None)
+        sample = _current.get()
+        if started is not None and sample is not None:
+            self._handler_started = None
+            elapsed = time.perf_counter() - started[0]
+            sample.handler_time += max(0.0, elapsed - (sample.db_time - started[1]))
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+# ---------- Slow requests ----------
+class SlowRequests:
+    """The slowest requests seen by this process, slowest first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+
+    def add(self, duration, entry):
+        keep = get_setting('SLOW_REQUESTS_KEPT')
+        with self._lock:
+            item = (duration, next(self._counter), entry)
+            if len(self._heap) < keep:
+                heapq.heappush(self._heap, item)
+            elif duration > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def entries(self):
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+
+
+slow_requests = SlowRequests()
+
+
+# ---------- Views ----------
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def perform_content_negotiation(self, request, force=False):
+        # the body is rendered above, Accept headers of scrapers don't matter
+        renderer = self.get_renderers()[0]
+        return renderer, renderer.media_type
+
+
+class SlowRequestsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(slow_requests.entries())
@@ -0,0 +1,90 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger('vexify.slow_requests')
+
+
+def view_name(request):
+    """``ViewSet.action`` for DRF viewsets, the view class name or the URL name or route otherwise."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    view = getattr(match.func, 'cls', None)
+    if view is None:
+        return match.view_name or match.route
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        return f'{view.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return view.__name__
+
+
+class RequestMetricsMiddleware:
+    """Times every request into vexify.metrics and logs the slow ones with their SQL."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.get_setting('ENABLED')
+        self.slow_request = metrics.get_setting('SLOW_REQUEST_SECONDS')
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        sample = metrics.RequestSample()
+        token = metrics.activate(sample)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample.execute))
+                response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        sample.duration = time.perf_counter() - sample.started
+
+        self.observe(request, response, sample)
+        return response
+
+    def observe(self, request, response, sample):
+        labels = (('method', request.method), ('view', view_name(request)))
+        metrics.registry.observe('vexify_request_duration_seconds', labels, sample.duration)
+        metrics.registry.observe('vexify_request_db_seconds', labels, sample.db_time)
+        metrics.registry.observe('vexify_request_queries', labels, sample.queries)
+        metrics.registry.observe('vexify_request_handler_python_seconds', labels, sample.handler_time)
+        metrics.registry.observe('vexify_request_render_seconds', labels, sample.render_time)
+        if not response.streaming:
+            metrics.registry.observe('vexify_response_size_bytes', labels, len(response.content))
+
+        if sample.duration >= self.slow_request:
+            self.log_slow(request, response, sample, dict(labels)['view'])
+
+    def log_slow(self, request, response, sample, view):
+        queries = sample.slowest_queries()
+        entry = {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'view': view,
+            'status': response.status_code,
+            'duration': sample.duration,
+            'db_time': sample.db_time,
+            'handler_time': sample.handler_time,
+            'render_time': sample.render_time,
+            'queries': sample.queries,
+            'slowest_queries': [
+                {'duration': duration, 'sql': sql, 'stack': stack} for duration, sql, stack in queries[:10]
+            ],
+        }
+        metrics.slow_requests.add(sample.duration, entry)
+        logger.warning(
+            "Slow request %s %s (%s): %.3fs, %d queries in %.3fs, handler %.3fs, render %.3fs\n%s",
+            request.method, entry['path'], view, sample.duration, sample.queries, sample.db_time,
+            sample.handler_time, sample.render_time,
+            '\n'.join(
+                f'  {duration:.3f}s {sql}' + (f'\n{stack}' if stack else '')
+                for duration, sql, stack in queries[:5]
+            ),
+        )
@@ -0,0 +1,205 @@
+"""
+On-demand request profiling.
+
+Views using ProfilingMixin run the handler under a profiler when a staff
+user sends the ``X-Profile`` header, or for a random PROFILING['SAMPLE_RATE']
+fraction of all requests. ``X-Profile: cprofile`` uses cProfile and stores
+a pstats dump; anything else uses a sampling profiler thread that walks the
+request thread's stack every INTERVAL seconds and stores folded stacks
+(``frame;frame;frame count`` lines, readable by flamegraph.pl, speedscope
+and inferno). Reports are listed and served to staff by ProfileListView and
+ProfileDownloadView.
+"""
+import cProfile
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404
+from django.utils.text import get_valid_filename
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+DEFAULTS = {
+    'HEADER': 'HTTP_X_PROFILE',
+    'SAMPLE_RATE': 0.0,           # fraction of all requests profiled continuously
+    'INTERVAL': 0.005,            # seconds between stack samples
+    'DIRECTORY': None,            # defaults to BASE_DIR/profiles
+    'MAX_REPORTS': 500,           # oldest reports are deleted beyond this
+}
+
+EXTENSIONS = {'sampling': '.folded', 'cprofile': '.prof'}
+
+
+def get_setting(name):
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def get_storage():
+    directory = os.path.realpath(get_setting('DIRECTORY') or os.path.join(settings.BASE_DIR, 'profiles'))
+    media = os.path.realpath(settings.MEDIA_ROOT) if settings.MEDIA_ROOT else None
+    if media and os.path.commonpath([directory, media]) == media:
+        # reports show source paths and timings of every view
+        raise ImproperlyConfigured("PROFILING['DIRECTORY'] must be outside MEDIA_ROOT")
+    return FileSystemStorage(location=directory)
+
+
+# ---------- Profilers ----------
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that created it from a background thread."""
+    mode = 'sampling'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common()).encode()
+
+
+class CProfiler:
+    mode = 'cprofile'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self):
+        # same format as Profile.dump_stats, loadable with pstats.Stats
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+def start_profiler(mode):
+    if mode == 'cprofile':
+        profiler = CProfiler()
+        try:
+            profiler.start()
+            return profiler
+        except ValueError:
+            # another profiler is active in this thread, fall back to sampling
+            pass
+    profiler = SamplingProfiler(get_setting('INTERVAL'))
+    profiler.start()
+    return profiler
+
+
+# ---------- Reports ----------
+def save_report(profiler, label):
+    storage = get_storage()
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    name = get_valid_filename(f'{stamp}-{label}-{uuid.uuid4().hex[:12]}{EXTENSIONS[profiler.mode]}')
+    name = storage.save(name, ContentFile(profiler.report()))
+    _prune(storage)
+    return name
+
+
+def _prune(storage):
+    limit = get_setting('MAX_REPORTS')
+    names = sorted(storage.listdir('')[1])
+    for name in names[:max(0, len(names) - limit)]:
+        storage.delete(name)
+
+
+def list_reports():
+    storage = get_storage()
+    if not os.path.isdir(storage.location):
+        return []
+    return [
+        {'name': name, 'size': storage.size(name), 'created_at': storage.get_modified_time(name)}
+        for name in sorted(storage.listdir('')[1], reverse=True)
+    ]
+
+
+# ---------- Views ----------
+class ProfilingMixin:
+    """Profile the handler of APIViews, see the module docstring."""
+
+    def initial(self, request, *args, **kwargs):
+        # after authentication and permission checks, so the staff check sees the JWT user
+        super().initial(request, *args, **kwargs)
+        self._profiler = None
+        requested = request.META.get(get_setting('HEADER'))
+        if requested and request.user.is_staff:
+            self._profiler = start_profiler(requested.strip().lower())
+            self._profile_requested = True
+        elif random.random() < get_setting('SAMPLE_RATE'):
+            self._profiler = start_profiler('sampling')
+            self._profile_requested = False
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        profiler = getattr(self, '_profiler', None)
+        if profiler is not None:
+            self._profiler = None
+            profiler.stop()
+            name = save_report(profiler, self._profile_label(request))
+            if self._profile_requested:
+                response['X-Profile-Report'] = name
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def _profile_label(self, request):
+        action = getattr(self, 'action', None)
+        return f'{type(self).__name__}.{action}' if action else type(self).__name__
+
+
+class ProfileListView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response([
+            dict(report, url=request.build_absolute_uri(f'{report["name"]}/')) for report in list_reports()
+        ])
+
+
+class ProfileDownloadView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        storage = get_storage()
+        if name != get_valid_filename(name) or not storage.exists(name):
+            raise Http404('Unknown profile report')
+        return FileResponse(storage.open(name, 'rb'), as_attachment=True, filename=name)
+
+    def perform_content_negotiation(self, request, force=False):
+        renderer = self.get_renderers()[0]
+        return renderer, renderer.media_type
@@ -0,0 +1,72 @@
+"""
+Faster response renderer.
+
+ORJSONRenderer produces the same bytes as DRF's JSONRenderer with orjson:
+types orjson would format differently (datetimes, dates, times and
+dataclasses) are passed to DRF's own encoder and \\u2028/\\u2029 are
+escaped the same way. Indented output (the browsable API,
+``Accept: application/json; indent=4``), settings orjson cannot honour and
+data holding NaN or infinities (null with orjson, an error or bare NaN with
+DRF depending on STRICT_JSON) fall back to the stdlib renderer, as does
+everything when orjson is not installed. Rendering counts as render time
+in vexify.metrics.
+"""
+import math
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+
+    if orjson is not None:
+        options = (
+            orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.rendering():
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder.default, option=self.options)
+        except orjson.JSONEncodeError:
+            # integers beyond 64 bits and the like
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'null' in ret and _has_non_finite(data):
+            # orjson writes them as null
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def _has_non_finite(data):
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
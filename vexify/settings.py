@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "vexify.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -106,12 +107,112 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+    ),
+    # see vexify/renderers.py
+    "DEFAULT_RENDERER_CLASSES": (
+        "vexify.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=30),  # default is 5 minutes
     'REFRESH_TOKEN_LIFETIME': timedelta(days=60),     # default is 1 day
 }
+
+# Item-to-item recommender, see catalog/recommender.py
+RECOMMENDER = {
+    'TOP_K': 50,
+    'MAX_RESULTS': 50,
+    'INCREMENTAL': True,
+    'UPDATE_INTERVAL': 10.0,
+    'REBUILD_ITEMS': 10000,
+    'CACHE_ALIAS': 'recommendations',
+    'CACHE_TIMEOUT': 600,
+}
+
+# Write-behind play counter feeding Song.popularity, see catalog/plays.py
+PLAY_BUFFER = {
+    'FLUSH_INTERVAL': 5.0,
+    'MAX_PENDING_SONGS': 10000,
+    'BATCH_SIZE': 500,
+}
+
+# Decayed trending charts, see catalog/trending.py
+TRENDING = {
+    'PLAY_WEIGHT': 1.0,
+    'FAVORITE_WEIGHT': 5.0,
+    'MAX_LIMIT': 100,
+}
+
+# Catalog read responses are cached, see catalog.cache. Use a shared backend
+# (redis, file) with several processes so invalidations reach all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vexify',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # rendered per-user recommendations, least recently used entries are culled
+    'recommendations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recommendations',
+        'OPTIONS': {'MAX_ENTRIES': 2000, 'CULL_FREQUENCY': 10},
+    },
+}
+
+RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'VERSION': 1,       # bump to drop every cached response on deploy
+}
+
+# Request metrics served at /metrics, see vexify/metrics.py
+METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_QUERY_SECONDS': 0.1,
+    'SLOW_REQUESTS_KEPT': 20,
+}
+
+# Staff requests sending X-Profile are profiled, see vexify/profiling.py
+PROFILING = {
+    'SAMPLE_RATE': 0.0,     # e.g. 0.001 profiles one request in a thousand
+    'INTERVAL': 0.005,
+    'DIRECTORY': BASE_DIR / 'profiles',     # not under MEDIA_ROOT, that is served publicly
+    'MAX_REPORTS': 500,
+}
+
+# Cached id sets behind favorites/contains and playlists/<id>/contains, see catalog/membership.py
+MEMBERSHIP = {
+    'CACHE_TIMEOUT': 3600,
+    'MAX_IDS': 500,
+}
+
+# Catalog list endpoints render through catalog/compiled.py, False uses the DRF serializers
+COMPILED_SERIALIZERS = True
+
+# ?stream=1 returns whole collections as streamed JSON, see catalog/jsonstream.py
+STREAMING = {
+    'CHUNK_SIZE': 500,
+}
+
+# Chunked library exports, see catalog/export.py
+LIBRARY_EXPORT = {
+    'CHUNK_SIZE': 2000,
+}
+
+# Audio metadata read from uploads in the background, see catalog/audio.py
+# Run `manage.py process_audio_jobs` as a worker, IN_PROCESS runs the queue
+# from the web processes instead (on a process pool) for setups without one.
+AUDIO_METADATA = {
+    'IN_PROCESS': False,
+    'WORKERS': 2,
+    'BATCH_SIZE': 20,
+    'MAX_ATTEMPTS': 3,
+    'STALE_AFTER': 600,
+    'RETRY_DELAY': 60,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
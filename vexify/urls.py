@@ -3,8 +3,15 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import MetricsView, SlowRequestsView
+from .profiling import ProfileDownloadView, ProfileListView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('account/', include('accounts.urls')),
     path('catalog/', include('catalog.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('metrics/slow/', SlowRequestsView.as_view(), name='slow-requests'),
+    path('profiles/', ProfileListView.as_view(), name='profiles'),
+    path('profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile-download'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)